@@ -0,0 +1,367 @@
+import argparse
+import contextlib
+import glob
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from data_processing import UNIQUE_SENSOR_LOCATIONS
+from training_orchestrator import MODEL_CLASSES
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# The microclimate sensor locations, as every one but Argyle Square's is reported in the microclimate export
+MICROCLIMATE_SENSOR_LOCATIONS = sorted(UNIQUE_SENSOR_LOCATIONS - {'Argyle Square'})
+
+# Period the synthetic readings are spread over. It covers 2024, the year the predictors serve.
+SYNTHETIC_DATA_START = pd.Timestamp('2023-06-01', tz='UTC')
+SYNTHETIC_DATA_END = pd.Timestamp('2025-01-01', tz='UTC')
+
+# Rows generated and written at a time, so tens of millions of rows never sit in memory at once
+GENERATION_CHUNKSIZE = 1000000
+
+# Stages timed inside process_and_clean_data and train(), as (module, attribute) pairs. Time spent outside them is
+# reported as 'other'.
+PREPROCESSING_STAGES = {
+    'read_raw_data': ('data_processing', 'read_raw_csv'),
+    'prepare_microclimate_sensors_data': ('data_processing', 'prepare_microclimate_sensors_data'),
+    'prepare_argyle_square_sensor_data': ('data_processing', 'prepare_argyle_square_sensor_data'),
+    'remove_outliers': ('data_processing', 'remove_outliers'),
+    'encode_weather_data': ('data_processing', 'encode_weather_data'),
+    'compact_weather_data': ('data_processing', 'compact_weather_data'),
+    'write_columnar': ('data_processing', 'write_columnar'),
+    'build_rollup': ('weather_rollup', 'build_rollup'),
+}
+
+
+def generate_sensor_data(directory, rows, argyle_square_fraction=0.1, seed=0):
+    # Writes the two raw sensor exports with the given total number of rows, spread over the 11 sensor locations.
+    # Like the real exports they hold a few missing and non-numeric readings, unparseable dates and locations with
+    # stray whitespace or outside the known ones.
+    rng = np.random.default_rng(seed)
+    argyle_square_rows = int(rows * argyle_square_fraction)
+    locations = np.array(MICROCLIMATE_SENSOR_LOCATIONS + ['Batman\n Park', 'Unknown location'])
+    location_weights = np.r_[np.full(len(MICROCLIMATE_SENSOR_LOCATIONS), 0.098), 0.01, 0.01]
+
+    def write_chunks(file_name, total_rows, make_chunk):
+        file_path = os.path.join(directory, file_name)
+        span = (SYNTHETIC_DATA_END - SYNTHETIC_DATA_START).total_seconds()
+        for start in range(0, max(total_rows, 1), GENERATION_CHUNKSIZE):
+            size = min(GENERATION_CHUNKSIZE, total_rows - start)
+            # Each chunk covers its own stretch of the period, so the file is in time order like the exports
+            seconds = np.sort(rng.uniform(start / total_rows, (start + size) / total_rows, size)) * span
+            timestamps = SYNTHETIC_DATA_START + pd.to_timedelta(seconds.astype('int64'), unit='s')
+            make_chunk(size, timestamps).to_csv(file_path, mode='w' if start == 0 else 'a', header=start == 0,
+                                                index=False)
+
+    def readings(size, mean, spread, low, high):
+        values = np.round(np.clip(rng.normal(mean, spread, size), low, high), 2)
+        values[rng.random(size) < 0.02] = np.nan
+        return values
+
+    def microclimate_chunk(size, timestamps):
+        received_at = pd.Series(timestamps.strftime('%Y-%m-%dT%H:%M:%S%z'))
+        received_at[rng.random(size) < 0.001] = 'not a date'
+        airtemperature = readings(size, 15, 5, 0.5, 29.4).astype(object)
+        airtemperature[rng.random(size) < 0.001] = 'invalid'
+        return pd.DataFrame({
+            'device_id': 'ews-ee-0001', 'received_at': received_at,
+            'sensorlocation': rng.choice(locations, size, p=location_weights), 'latlong': '-37.81, 144.96',
+            'minimumwinddirection': 0, 'airtemperature': airtemperature,
+            'relativehumidity': readings(size, 60, 15, 1, 99.4), 'atmosphericpressure': readings(size, 1010, 8, 950, 1050),
+        })
+
+    def argyle_square_chunk(size, timestamps):
+        return pd.DataFrame({
+            'dev_id': 'argyle-square-1', 'time': timestamps.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'relativehumidity': readings(size, 65, 12, 1, 99.4), 'airtemp': readings(size, 16, 4, 0.5, 29.4),
+            'atmosphericpressure': readings(size, 1011, 6, 950, 1050),
+        })
+
+    write_chunks('microclimate-sensors-data.csv', rows - argyle_square_rows, microclimate_chunk)
+    write_chunks('meshed-sensor-type-1.csv', argyle_square_rows, argyle_square_chunk)
+
+
+class StageTimer:
+    # Times calls to module attributes by swapping them for wrappers while the timer is active. A call made inside
+    # another timed call counts towards the outer stage only, so the stages never overlap.
+    def __init__(self, stages):
+        self.stages = stages
+        self.seconds = {stage: 0.0 for stage in stages}
+        self.originals = {}
+        self.depth = 0
+
+    def wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            if self.depth:
+                return function(*args, **kwargs)
+            self.depth += 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+                self.depth -= 1
+        return timed
+
+    def __enter__(self):
+        for stage, (module_name, attribute) in self.stages.items():
+            owner = importlib.import_module(module_name)
+            self.originals[stage] = (owner, attribute, getattr(owner, attribute))
+            setattr(owner, attribute, self.wrap(stage, getattr(owner, attribute)))
+        return self
+
+    def __exit__(self, *exc_info):
+        for owner, attribute, original in self.originals.values():
+            setattr(owner, attribute, original)
+
+    def report(self, total_seconds):
+        stages = dict(self.seconds)
+        stages['other'] = max(0.0, total_seconds - sum(self.seconds.values()))
+        return {'seconds': total_seconds, 'stages': stages}
+
+
+def time_preprocessing():
+    data_processing = importlib.import_module('data_processing')
+    with StageTimer(PREPROCESSING_STAGES) as timer:
+        start = time.perf_counter()
+        weather_data = data_processing.process_and_clean_data()
+        report = timer.report(time.perf_counter() - start)
+    report['rows'] = len(weather_data)
+    return report
+
+
+def time_training(name):
+    module_name, class_name = MODEL_CLASSES[name]
+    predictor_class = getattr(importlib.import_module(module_name), class_name)
+    predictor = predictor_class()
+    model_class = type(predictor.model)
+    stages = {
+        'training_data': (module_name, class_name + '.training_data'),
+        'fit': None,
+        'save_artifact': (module_name, 'save_artifact'),
+        'materialize_forecasts': ('forecast_materialization', 'materialize_forecasts'),
+    }
+    # Methods are timed on their classes, the module functions where train() and the orchestrator look them up
+    timer = StageTimer({stage: target for stage, target in stages.items() if target and '.' not in target[1]})
+    methods = {'training_data': (predictor_class, 'training_data'), 'fit': (model_class, 'fit')}
+    timer.seconds.update({stage: 0.0 for stage in methods})
+    originals = {stage: getattr(owner, attribute) for stage, (owner, attribute) in methods.items()}
+    for stage, (owner, attribute) in methods.items():
+        setattr(owner, attribute, timer.wrap(stage, originals[stage]))
+    try:
+        with timer, contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            predictor.train()
+            # The forecasts are materialized after training, as train_models does
+            importlib.import_module('forecast_materialization').materialize_forecasts([name])
+            return timer.report(time.perf_counter() - start)
+    finally:
+        for stage, (owner, attribute) in methods.items():
+            setattr(owner, attribute, originals[stage])
+
+
+def latency_summary(seconds):
+    # Percentiles in milliseconds and the number of requests served per second one after another
+    milliseconds = np.array(seconds) * 1000
+    return {
+        'requests': len(milliseconds),
+        'p50_ms': float(np.percentile(milliseconds, 50)),
+        'p95_ms': float(np.percentile(milliseconds, 95)),
+        'p99_ms': float(np.percentile(milliseconds, 99)),
+        'mean_ms': float(milliseconds.mean()),
+        'throughput_per_second': float(len(milliseconds) / milliseconds.sum() * 1000),
+    }
+
+
+def inference_requests(days, seed=0):
+    # Every month, plus the whole year, and a sample of the days of 2024, as the endpoints receive them
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2024-01-01', '2024-12-31')
+    return ([None] + [str(month) for month in range(1, 13)],
+            [date.strftime('%d-%m') for date in dates[np.sort(rng.choice(len(dates), days, replace=False))]])
+
+
+def time_inference(name, repeats, days):
+    # Latency of predict and predict_day, both with the prediction cache cleared before every request and served
+    # from the cache. The first request, which loads the model and the date index, is reported on its own.
+    prediction_cache = importlib.import_module('prediction_cache').prediction_cache
+    module_name, class_name = MODEL_CLASSES[name]
+    predictor = getattr(importlib.import_module(module_name), class_name)()
+    months, dates = inference_requests(days)
+
+    start = time.perf_counter()
+    predictor.predict(None)
+    report = {'first_request_ms': (time.perf_counter() - start) * 1000}
+
+    for method, arguments in (('predict', months), ('predict_day', dates)):
+        for cached in (False, True):
+            if cached:
+                for argument in arguments:
+                    getattr(predictor, method)(argument)
+            seconds = []
+            for _ in range(repeats):
+                for argument in arguments:
+                    if not cached:
+                        prediction_cache.clear()
+                    start = time.perf_counter()
+                    getattr(predictor, method)(argument)
+                    seconds.append(time.perf_counter() - start)
+            report[method + ('_cached' if cached else '')] = latency_summary(seconds)
+    return report
+
+
+def run_worker(output_file, names, repeats, days):
+    # Runs inside the benchmark workspace, where the modules read and write the generated data
+    # Preprocessing runs twice: first parsing the raw files, then with them read back from the raw data cache
+    results = {'preprocessing': time_preprocessing(), 'preprocessing_cached': time_preprocessing(), 'training': {},
+               'inference': {}}
+    for name in names:
+        results['training'][name] = time_training(name)
+    for name in names:
+        results['inference'][name] = time_inference(name, repeats, days)
+    # The histograms of the timing spans recorded along the way, for a closer look at a regression
+    results['spans'] = importlib.import_module('instrumentation').metrics.snapshot()
+    with open(output_file, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=current_dir, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(rows, output_file, names=None, repeats=3, days=30, workspace=None, keep_workspace=False):
+    # Copies the modules into a workspace, generates the raw data there and times the whole pipeline in a fresh
+    # process, so the benchmark never touches the data and models next to the code
+    names = list(names or MODEL_CLASSES)
+    workspace = workspace or tempfile.mkdtemp(prefix='weather_benchmark_')
+    os.makedirs(workspace, exist_ok=True)
+    try:
+        for module_file in glob.glob(os.path.join(current_dir, '*.py')):
+            shutil.copy(module_file, workspace)
+
+        start = time.perf_counter()
+        generate_sensor_data(workspace, rows)
+        generation_seconds = time.perf_counter() - start
+
+        worker_output = os.path.join(workspace, 'benchmark_worker.json')
+        subprocess.run([sys.executable, 'benchmark.py', 'worker', worker_output] + names +
+                       ['--repeats', str(repeats), '--days', str(days)], cwd=workspace, check=True)
+        with open(worker_output) as worker_file:
+            results = json.load(worker_file)
+    finally:
+        if not keep_workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    results['meta'] = {
+        'rows': rows,
+        'generation_seconds': generation_seconds,
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    with open(output_file, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    return results
+
+
+def flatten_timings(results, prefix=''):
+    # The timings of a results file as {'training.temperature-regression.stages.fit': 12.3, ...}. Throughputs are
+    # left out, as they are the inverse of the mean latency.
+    timings = {}
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            timings.update(flatten_timings(value, path + '.'))
+        elif (isinstance(value, (int, float)) and (key.endswith('_ms') or key == 'seconds' or prefix.endswith('stages.'))):
+            timings[path] = value
+    return timings
+
+
+def compare_results(baseline, candidate, threshold=0.1, min_seconds=0.05):
+    # Timings of the candidate run that are more than threshold slower than in the baseline run, as
+    # (name, baseline, candidate, ratio), slowest first. Timings under min_seconds in both runs are too noisy to compare.
+    baseline_timings = flatten_timings({key: value for key, value in baseline.items() if key != 'meta'})
+    candidate_timings = flatten_timings({key: value for key, value in candidate.items() if key != 'meta'})
+    regressions = []
+    for name, baseline_value in baseline_timings.items():
+        candidate_value = candidate_timings.get(name)
+        if candidate_value is None:
+            continue
+        scale = 1000 if name.endswith('_ms') else 1
+        if max(baseline_value, candidate_value) < min_seconds * scale:
+            continue
+        ratio = candidate_value / baseline_value if baseline_value else float('inf')
+        if ratio > 1 + threshold:
+            regressions.append((name, baseline_value, candidate_value, ratio))
+    return sorted(regressions, key=lambda regression: regression[3], reverse=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing, training and inference on synthetic data')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='generate data and time the whole pipeline')
+    run_parser.add_argument('--rows', type=int, default=100000, help='raw rows generated across both sensor files')
+    run_parser.add_argument('--output', default='benchmark_results.json', help='results file to write')
+    run_parser.add_argument('--repeats', type=int, default=3, help='passes over the inference requests')
+    run_parser.add_argument('--days', type=int, default=30, help='days of 2024 requested from predict_day')
+    run_parser.add_argument('--workspace', help='directory to run in, a temporary one by default')
+    run_parser.add_argument('--keep-workspace', action='store_true', help='keep the generated data and models')
+    run_parser.add_argument('models', nargs='*', metavar='model',
+                            help=f"models to benchmark, all by default: {', '.join(MODEL_CLASSES)}")
+
+    compare_parser = commands.add_parser('compare', help='list the timings that got slower between two runs')
+    compare_parser.add_argument('baseline', help='results file of the reference run')
+    compare_parser.add_argument('candidate', help='results file of the run to check')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='slowdown tolerated, 0.1 for 10%%')
+    compare_parser.add_argument('--min-seconds', type=float, default=0.05,
+                                help='timings shorter than this in both runs are too noisy to compare')
+
+    worker_parser = commands.add_parser('worker')
+    worker_parser.add_argument('output')
+    worker_parser.add_argument('--repeats', type=int, default=3)
+    worker_parser.add_argument('--days', type=int, default=30)
+    worker_parser.add_argument('models', nargs='*')
+
+    args = parser.parse_args()
+    if args.command == 'worker':
+        run_worker(args.output, args.models or list(MODEL_CLASSES), args.repeats, args.days)
+    elif args.command == 'run':
+        for name in args.models:
+            if name not in MODEL_CLASSES:
+                parser.error(f"unknown model {name!r}, expected one of {', '.join(MODEL_CLASSES)}")
+        results = run_benchmark(args.rows, args.output, args.models, args.repeats, args.days, args.workspace,
+                                args.keep_workspace)
+        print(f"Preprocessing {results['meta']['rows']} rows: {results['preprocessing']['seconds']:.2f}s, "
+              f"{results['preprocessing_cached']['seconds']:.2f}s with the raw data cached")
+        for name, training in results['training'].items():
+            print(f"Training {name}: {training['seconds']:.2f}s")
+        for name, inference in results['inference'].items():
+            for method in ('predict', 'predict_day'):
+                latency = inference[method]
+                print(f"{name} {method}: p50 {latency['p50_ms']:.1f} ms, p95 {latency['p95_ms']:.1f} ms, "
+                      f"p99 {latency['p99_ms']:.1f} ms, {latency['throughput_per_second']:.1f} requests/s")
+        print(f"Results written to {args.output}")
+    else:
+        with open(args.baseline) as baseline_file, open(args.candidate) as candidate_file:
+            regressions = compare_results(json.load(baseline_file), json.load(candidate_file), args.threshold,
+                                          args.min_seconds)
+        for name, baseline_value, candidate_value, ratio in regressions:
+            print(f"{name}: {baseline_value:.3f} -> {candidate_value:.3f} ({ratio:.2f}x)")
+        print(f"{len(regressions)} timing(s) slower by more than {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,79 @@
+import argparse
+import time
+import numpy as np
+from combined_prediction import PREDICTION_MODELS, model_inputs
+from feature_store import feature_store
+from flat_forest import flat_model_file, load_model
+from model_registry import artifact_version
+
+
+def sklearn_nbytes(model):
+    # Memory held by the node and value arrays of every tree of a sklearn forest
+    total = 0
+    for estimator in model.estimators_:
+        state = estimator.tree_.__getstate__()
+        total += state['nodes'].nbytes + state['values'].nbytes
+    return total
+
+
+def time_predictions(model, X, repeats):
+    # Best time of a few predictions of the same rows, along with the predictions
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predictions = model.predict(X)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, predictions
+
+
+def benchmark_backends(names=None, repeats=5):
+    # Compares the sklearn and flat backends of every model on the rows of a day, a month and the whole of 2024:
+    # the predictions must be identical, and the time, rows per second, artifact size and resident memory are reported
+    batches = {'day': feature_store.lookup(3, 5), 'month': feature_store.lookup(3), 'year': feature_store.lookup()}
+
+    report = {}
+    for name in names or PREDICTION_MODELS:
+        spec = PREDICTION_MODELS[name]
+        sklearn_model = load_model(spec['model'], 'sklearn')
+        flat_model = load_model(spec['model'], 'flat')
+        report[name] = {
+            'artifact_bytes': {'sklearn': artifact_version(spec['model'])[1],
+                               'flat': artifact_version(flat_model_file(spec['model']))[1]},
+            'resident_bytes': {'sklearn': sklearn_nbytes(sklearn_model), 'flat': flat_model.nbytes()},
+            'batches': {},
+        }
+
+        for batch_name, rows in batches.items():
+            # The inputs the service predicts from, so the backends are compared and timed on them
+            X = model_inputs(name, rows)
+            sklearn_seconds, sklearn_predictions = time_predictions(sklearn_model, X, repeats)
+            flat_seconds, flat_predictions = time_predictions(flat_model, X, repeats)
+            if not np.array_equal(sklearn_predictions, flat_predictions):
+                raise AssertionError(f"The flat forest of {name} does not match sklearn on the {batch_name} rows")
+            report[name]['batches'][batch_name] = {
+                'rows': len(X),
+                'seconds': {'sklearn': sklearn_seconds, 'flat': flat_seconds},
+                'rows_per_second': {'sklearn': len(X) / sklearn_seconds, 'flat': len(X) / flat_seconds},
+            }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the sklearn and flat forest inference backends')
+    parser.add_argument('--repeats', type=int, default=5, help='predictions timed per batch, the best is kept')
+    parser.add_argument('models', nargs='*', metavar='model',
+                        help=f"models to compare, all by default: {', '.join(PREDICTION_MODELS)}")
+    args = parser.parse_args()
+
+    for name, result in benchmark_backends(args.models, args.repeats).items():
+        print(name)
+        print(f"  artifact: sklearn {result['artifact_bytes']['sklearn'] / 2 ** 20:.1f} MiB, "
+              f"flat {result['artifact_bytes']['flat'] / 2 ** 20:.1f} MiB")
+        print(f"  resident: sklearn {result['resident_bytes']['sklearn'] / 2 ** 20:.1f} MiB, "
+              f"flat {result['resident_bytes']['flat'] / 2 ** 20:.1f} MiB")
+        for batch_name, batch in result['batches'].items():
+            print(f"  {batch_name} ({batch['rows']} rows): "
+                  f"sklearn {batch['seconds']['sklearn'] * 1000:.1f} ms "
+                  f"({batch['rows_per_second']['sklearn']:.0f} rows/s), "
+                  f"flat {batch['seconds']['flat'] * 1000:.1f} ms ({batch['rows_per_second']['flat']:.0f} rows/s)")
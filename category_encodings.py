@@ -0,0 +1,83 @@
+import json
+import numpy as np
+import pandas as pd
+import os
+import threading
+from model_registry import file_signature
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+CATEGORY_ENCODINGS_FILE = os.path.join(current_dir, 'category_encodings.json')
+
+
+class CategoryEncodings:
+    # Integer codes of the categorical columns, kept in one JSON file shared by the processing scripts, the processed
+    # store and the models trained on it. A category keeps its code forever: categories seen for the first time are
+    # appended after the known ones and the version goes up, so new rows are encoded without renumbering old ones.
+    # A column's first categories, along with the expected ones given on its first encoding, are numbered in sorted
+    # order, as LabelEncoder numbers them.
+    def __init__(self, encodings_file=CATEGORY_ENCODINGS_FILE):
+        self.encodings_file = encodings_file
+        self.lock = threading.Lock()
+        self.encodings = {'version': 0, 'columns': {}}
+        self.signature = None
+
+    def reload(self):
+        # Picking up the categories appended by another process, if the file changed since it was last read
+        if not os.path.exists(self.encodings_file):
+            return
+        signature = file_signature(self.encodings_file)
+        if signature != self.signature:
+            with open(self.encodings_file) as encodings_file:
+                self.encodings = json.load(encodings_file)
+            self.signature = signature
+
+    def save(self):
+        # Writing to a temporary file and renaming it over the old one, so readers never see a half written file
+        with open(self.encodings_file + '.tmp', 'w') as encodings_file:
+            json.dump(self.encodings, encodings_file, indent=2)
+        os.replace(self.encodings_file + '.tmp', self.encodings_file)
+        self.signature = file_signature(self.encodings_file)
+
+    @property
+    def version(self):
+        with self.lock:
+            self.reload()
+            return self.encodings['version']
+
+    def categories(self, column):
+        # The categories of the column in code order
+        with self.lock:
+            self.reload()
+            return list(self.encodings['columns'].get(column, []))
+
+    def encode(self, column, values, expected_categories=()):
+        # Codes of the values, -1 for missing ones. Each distinct value is looked up once, and the categories not seen
+        # before are appended and saved.
+        codes, uniques = pd.factorize(values)
+        with self.lock:
+            self.reload()
+            # The expected categories are only registered along with the first values of a column
+            if column not in self.encodings['columns']:
+                candidates = set(uniques) | set(expected_categories)
+            else:
+                candidates = set(uniques)
+            categories = self.encodings['columns'].setdefault(column, [])
+            known = {category: code for code, category in enumerate(categories)}
+            new_categories = sorted(candidates - known.keys())
+            if new_categories:
+                for category in new_categories:
+                    known[category] = len(categories)
+                    categories.append(category)
+                self.encodings['version'] += 1
+                self.save()
+
+        lookup = np.array([known[category] for category in uniques] + [-1], dtype=np.int64)
+        return lookup[codes]
+
+    def decode(self, column, codes):
+        # Categories of the codes, as a pandas categorical
+        return pd.Categorical.from_codes(codes, self.categories(column))
+
+
+# Encodings shared by everything in the process
+category_encodings = CategoryEncodings()
@@ -0,0 +1,299 @@
+import json
+import joblib
+import numpy as np
+import pandas as pd
+import os
+import shutil
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+COLUMNAR_DATA_NAME = 'processed_weather_data'
+COLUMNAR_DATA_DIR = os.path.join(current_dir, COLUMNAR_DATA_NAME)
+# The joblib pickle the processed data was saved as before the columnar store replaced it. It is only read while the
+# store has not been written yet, and removed once it has.
+PROCESSED_DATA_FILE = os.path.join(current_dir, 'processed_weather_data.pkl')
+
+# Every partition holds one year/month of rows, sorted by day. day_offsets[d] is the first row of day d, so the rows of
+# a day are a contiguous slice. row_number keeps the position of each row in the processed frame.
+DAY_OFFSETS_FILE = 'day_offsets.npy'
+ROW_NUMBER_FILE = 'row_number.npy'
+
+# Every write goes to a version folder of its own inside the store, and this file names the current one. Replacing it
+# is atomic, so readers find either the old version or the new one, complete. The version before the current one is
+# kept for the readers still reading it.
+CURRENT_VERSION_FILE = 'CURRENT'
+
+
+def dataset_dir(root=COLUMNAR_DATA_DIR):
+    # The folder of the current version, or the store itself when it was written before versions were added
+    try:
+        with open(os.path.join(root, CURRENT_VERSION_FILE)) as version_file:
+            return os.path.join(root, version_file.read().strip())
+    except FileNotFoundError:
+        return root
+
+
+def has_columnar(root=COLUMNAR_DATA_DIR):
+    return os.path.exists(os.path.join(dataset_dir(root), 'metadata.json'))
+
+
+def partition_years(weather_data):
+    # The processed Date column holds yyyymmdd keys, or 'dd-mm-yy' strings in data processed before it was compacted
+    if pd.api.types.is_integer_dtype(weather_data['Date']):
+        return weather_data['Date'] // 10000
+    return ('20' + weather_data['Date'].str[-2:]).astype(int)
+
+
+def write_columnar(weather_data, root=COLUMNAR_DATA_DIR):
+    # Writes the processed weather data as one .npy file per column and partition. Textual and categorical columns
+    # are stored as integer codes into a shared list of categories.
+    metadata = {'columns': {}, 'categories': {}, 'partitions': []}
+    columns = {}
+    for column in weather_data.columns:
+        if pd.api.types.is_numeric_dtype(weather_data[column]):
+            columns[column] = weather_data[column].to_numpy()
+            metadata['columns'][column] = str(columns[column].dtype)
+        else:
+            codes, categories = pd.factorize(weather_data[column], sort=True)
+            columns[column] = codes.astype('int8' if len(categories) < 128 else 'int32')
+            metadata['columns'][column] = 'category'
+            metadata['categories'][column] = categories.tolist()
+
+    # Writing a new version next to the current one and pointing the store at it at the end, so readers never see a
+    # partial or missing dataset
+    previous_version, version, temporary_root = start_version(root)
+
+    years = partition_years(weather_data).to_numpy()
+    months = weather_data['month'].to_numpy()
+    days = weather_data['day'].to_numpy().astype(int)
+    for year, month in sorted(set(zip(years, months.astype(int)))):
+        rows = np.flatnonzero((years == year) & (months == month))
+        partition_path = f'year={year}/month={month:02d}'
+        write_partition(os.path.join(temporary_root, partition_path),
+                        {column: values[rows] for column, values in columns.items()}, rows, days[rows])
+        metadata['partitions'].append({'year': int(year), 'month': int(month), 'rows': len(rows),
+                                       'path': partition_path})
+
+    publish_version(root, metadata, previous_version, version, temporary_root)
+
+
+def start_version(root):
+    # The version current before the write, the name of the new one and the temporary folder it is written to
+    previous_version = os.path.basename(dataset_dir(root)) if os.path.exists(root) else None
+    version = f'v{time.time_ns()}-{os.getpid()}'
+    temporary_root = os.path.join(root, version + '.tmp')
+    os.makedirs(temporary_root)
+    return previous_version, version, temporary_root
+
+
+def write_partition(partition_dir, columns, row_number, days):
+    # Writes the columns of one partition with its rows sorted by day, along with their row numbers and day offsets.
+    # The sort is stable, so the rows of a day stay in their processed order.
+    order = np.argsort(days, kind='stable')
+    os.makedirs(partition_dir)
+    for column, values in columns.items():
+        np.save(os.path.join(partition_dir, f'{column}.npy'), values[order])
+    np.save(os.path.join(partition_dir, ROW_NUMBER_FILE), row_number[order])
+    np.save(os.path.join(partition_dir, DAY_OFFSETS_FILE), np.searchsorted(days[order], np.arange(33)))
+
+
+def link_partition(source_dir, partition_dir):
+    # Hard links the files of an unchanged partition into a new version, so they are shared instead of rewritten.
+    # They are copied where the file system does not support links.
+    os.makedirs(partition_dir)
+    for file_name in os.listdir(source_dir):
+        try:
+            os.link(os.path.join(source_dir, file_name), os.path.join(partition_dir, file_name))
+        except OSError:
+            shutil.copy2(os.path.join(source_dir, file_name), os.path.join(partition_dir, file_name))
+
+
+def publish_version(root, metadata, previous_version, version, temporary_root):
+    with open(os.path.join(temporary_root, 'metadata.json'), 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+
+    os.replace(temporary_root, os.path.join(root, version))
+    version_file = os.path.join(root, CURRENT_VERSION_FILE)
+    with open(version_file + '.tmp', 'w') as output:
+        output.write(version)
+    os.replace(version_file + '.tmp', version_file)
+
+    # Dropping the older versions, unfinished writes and the files of a store written before versions were added
+    for entry in os.listdir(root):
+        if entry not in (CURRENT_VERSION_FILE, version, previous_version):
+            entry_path = os.path.join(root, entry)
+            if os.path.isdir(entry_path):
+                shutil.rmtree(entry_path, ignore_errors=True)
+            else:
+                os.remove(entry_path)
+
+
+def append_columnar(new_rows, root=COLUMNAR_DATA_DIR):
+    # Appends processed rows to the store as a new version, in which only the partitions of the year/months the rows
+    # fall into are written. The files of the other partitions are linked from the current version, so an append
+    # costs the size of the partitions it touches rather than of the whole dataset. Returns False, leaving the store
+    # as it is, when the rows cannot be appended to it: when it has not been written yet, when their columns or dtypes
+    # differ from its own, or when a category column would outgrow its int8 codes. The whole data has to be written
+    # with write_columnar then.
+    if not has_columnar(root):
+        return False
+    current_root = dataset_dir(root)
+    metadata = load_metadata(current_root)
+    if list(new_rows.columns) != list(metadata['columns']):
+        return False
+
+    # The new rows' values, with the categories they add put after the stored ones, so the codes already written
+    # keep their meaning
+    columns = {}
+    for column, dtype in metadata['columns'].items():
+        if dtype != 'category':
+            if str(new_rows[column].dtype) != dtype:
+                return False
+            columns[column] = new_rows[column].to_numpy()
+            continue
+        values = new_rows[column].astype(object)
+        categories = metadata['categories'][column]
+        added = sorted(set(values) - set(categories))
+        if len(categories) < 128 <= len(categories) + len(added):
+            return False
+        categories = categories + added
+        metadata['categories'][column] = categories
+        columns[column] = pd.Categorical(values, categories=categories).codes.astype(
+            'int8' if len(categories) < 128 else 'int32')
+
+    # The new rows are numbered after the stored ones, so they come after them in the processed order
+    first_row = sum(partition['rows'] for partition in metadata['partitions'])
+    row_number = np.arange(first_row, first_row + len(new_rows))
+    years = partition_years(new_rows).to_numpy()
+    months = new_rows['month'].to_numpy().astype(int)
+    days = new_rows['day'].to_numpy().astype(int)
+    touched = {(int(year), int(month)) for year, month in zip(years, months)}
+
+    previous_version, version, temporary_root = start_version(root)
+    partitions = {(partition['year'], partition['month']): partition for partition in metadata['partitions']}
+    for year, month in sorted(set(partitions) | touched):
+        partition = partitions.get((year, month))
+        if (year, month) not in touched:
+            link_partition(os.path.join(current_root, partition['path']),
+                           os.path.join(temporary_root, partition['path']))
+            continue
+
+        rows = np.flatnonzero((years == year) & (months == month))
+        partition_columns = {column: values[rows] for column, values in columns.items()}
+        partition_row_number, partition_days = row_number[rows], days[rows]
+        if partition is None:
+            partition = {'year': year, 'month': month, 'rows': 0, 'path': f'year={year}/month={month:02d}'}
+            partitions[(year, month)] = partition
+        elif partition['rows']:
+            # The stored rows of the partition followed by the new ones, sorted by day again as a whole
+            partition_dir = os.path.join(current_root, partition['path'])
+            for column in partition_columns:
+                stored = np.load(os.path.join(partition_dir, f'{column}.npy'))
+                partition_columns[column] = np.concatenate([stored, partition_columns[column]])
+            partition_row_number = np.concatenate(
+                [np.load(os.path.join(partition_dir, ROW_NUMBER_FILE)), partition_row_number])
+            partition_days = partition_columns['day'].astype(int)
+        write_partition(os.path.join(temporary_root, partition['path']), partition_columns, partition_row_number,
+                        partition_days)
+        partition['rows'] += len(rows)
+
+    metadata['partitions'] = [partitions[key] for key in sorted(partitions)]
+    publish_version(root, metadata, previous_version, version, temporary_root)
+    return True
+
+
+def load_metadata(root=COLUMNAR_DATA_DIR):
+    with open(os.path.join(root, 'metadata.json')) as metadata_file:
+        return json.load(metadata_file)
+
+
+def read_partition(root, metadata, partition, columns, day=None):
+    # Memory-maps the requested columns of one partition, sliced to a single day when one is given. Only the
+    # pages that are touched get read, and they are shared through the OS page cache with every other reader.
+    # Category columns come back as pandas categoricals over their codes.
+    partition_dir = os.path.join(root, partition['path'])
+    start, end = 0, partition['rows']
+    if day is not None:
+        day_offsets = np.load(os.path.join(partition_dir, DAY_OFFSETS_FILE))
+        start, end = day_offsets[int(day)], day_offsets[int(day) + 1]
+
+    data = {}
+    for column in columns:
+        values = np.load(os.path.join(partition_dir, f'{column}.npy'), mmap_mode='r')[start:end]
+        if metadata['columns'][column] == 'category':
+            values = pd.Categorical.from_codes(values, metadata['categories'][column])
+        data[column] = values
+    row_number = np.load(os.path.join(partition_dir, ROW_NUMBER_FILE), mmap_mode='r')[start:end]
+    return pd.DataFrame(data, copy=False), row_number
+
+
+def read_columnar(columns=None, year=None, month=None, day=None, root=COLUMNAR_DATA_DIR):
+    # Reads the processed weather data, keeping only the given columns and the rows of the given year, month and day.
+    # Year and month select partitions and day selects a slice inside them, so the other rows are never read. The rows
+    # come back in their processed order whatever partitions they span, so training sees the rows in the same order
+    # however the data is partitioned. Every file is read from the version current when the read started.
+    root = dataset_dir(root)
+    metadata = load_metadata(root)
+    if columns is None:
+        columns = list(metadata['columns'])
+
+    frames = []
+    row_numbers = []
+    for partition in metadata['partitions']:
+        if year is not None and partition['year'] != int(year):
+            continue
+        if month is not None and partition['month'] != int(month):
+            continue
+        frame, row_number = read_partition(root, metadata, partition, columns, day)
+        frames.append(frame)
+        row_numbers.append(row_number)
+
+    if not frames:
+        return pd.DataFrame({column: pd.Series(dtype=pd.CategoricalDtype(metadata['categories'][column])
+                                               if metadata['columns'][column] == 'category'
+                                               else metadata['columns'][column]) for column in columns})
+    if len(frames) == 1 and day is not None:
+        # The rows of a day are contiguous in their partition and already in their processed order, so they are
+        # returned as they were memory-mapped
+        return frames[0]
+
+    # The rows of whole partitions, which are sorted by day, or of several partitions, are put back in their
+    # processed order
+    weather_data = pd.concat(frames, ignore_index=True)
+    order = np.argsort(np.concatenate(row_numbers), kind='stable')
+    return weather_data.take(order).reset_index(drop=True)
+
+
+def remove_legacy_pickle():
+    # Dropping the pickle of an older version once the store replaced it, so it can never be read instead of a newer
+    # store
+    if has_columnar() and os.path.exists(PROCESSED_DATA_FILE):
+        os.remove(PROCESSED_DATA_FILE)
+
+
+def dataset_version():
+    # Signature of the processed dataset the predictors read, which changes whenever it is rewritten
+    metadata_file = os.path.join(dataset_dir(), 'metadata.json')
+    data_file = metadata_file if os.path.exists(metadata_file) else PROCESSED_DATA_FILE
+    if not os.path.exists(data_file):
+        return None
+    stat = os.stat(data_file)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def load_weather_data(columns=None, year=None, month=None, day=None):
+    # Loads the processed weather data from the columnar store, or from the joblib pickle of an older version when the
+    # store has not been written yet
+    if has_columnar():
+        return read_columnar(columns, year, month, day)
+
+    weather_data = joblib.load(PROCESSED_DATA_FILE)
+    if year is not None:
+        weather_data = weather_data[partition_years(weather_data) == int(year)]
+    if month is not None:
+        weather_data = weather_data[weather_data['month'] == int(month)]
+    if day is not None:
+        weather_data = weather_data[weather_data['day'] == int(day)]
+    if columns is not None:
+        weather_data = weather_data[columns]
+    return weather_data.reset_index(drop=True)
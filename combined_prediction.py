@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+from columnar_store import dataset_version
+from data_processing import expand_readings
+from date_index import day_of_month
+from feature_store import HUMIDITY_FEATURES, TEMPERATURE_FEATURES, feature_store
+from flat_forest import load_model
+from model_registry import artifact_version, model_registry
+from prediction_cache import cached_prediction
+
+def mean_by_group(groups, predictions):
+    # Average prediction of every group, the groups being given as a frame of one or more key columns
+    result = groups.assign(Prediction=predictions)
+    return result.groupby(list(groups.columns), as_index=False)['Prediction'].mean()
+
+
+def group_codes(groups):
+    # Code of every row's group, numbering the groups in the sorted order groupby gives them, and the key columns of
+    # each group. Several key columns are combined into one code per row, so the rows are factorized only once more.
+    column_codes, column_uniques = [], []
+    for column in groups.columns:
+        codes, uniques = pd.factorize(groups[column], sort=True)
+        column_codes.append(codes)
+        column_uniques.append(uniques)
+    if len(column_codes) == 1:
+        return column_codes[0], pd.DataFrame({groups.columns[0]: column_uniques[0]})
+    sizes = [len(uniques) for uniques in column_uniques]
+    row_groups, group_keys = pd.factorize(np.ravel_multi_index(column_codes, sizes), sort=True)
+    keys = np.unravel_index(group_keys, sizes)
+    return row_groups, pd.DataFrame({column: uniques[codes] for column, uniques, codes in
+                                     zip(groups.columns, column_uniques, keys)})
+
+
+def vote_by_group(groups, class_codes, classes, probabilities=None):
+    # Majority class of every group, counting the votes of all groups at once with a bincount over the group and class
+    # codes. Ties go to the first class, as with pd.Series.mode when the classes are sorted. Given the rows' class
+    # probabilities, the group's average probability of every class is added as a column named after the class.
+    row_groups, result = group_codes(groups)
+    votes = np.bincount(row_groups * len(classes) + class_codes, minlength=len(result) * len(classes))
+    result['Prediction'] = np.asarray(classes)[votes.reshape(len(result), len(classes)).argmax(axis=1)]
+    if probabilities is not None:
+        rows = np.bincount(row_groups, minlength=len(result))
+        for index, label in enumerate(classes):
+            result[label] = np.bincount(row_groups, weights=probabilities[:, index], minlength=len(result)) / rows
+    return result
+
+
+def mode_by_group(groups, predictions):
+    # Most frequent prediction of every group
+    class_codes, classes = pd.factorize(predictions, sort=True)
+    return vote_by_group(groups, class_codes, classes)
+
+
+def distribution_by_group(groups, probabilities, classes):
+    # Most frequent prediction of every group along with its class distribution, both from one predict_proba. The
+    # rows' predictions are the most probable classes, as predict gives them.
+    return vote_by_group(groups, probabilities.argmax(axis=1), classes, probabilities)
+
+
+# The four models, keyed like the /prediction/<model>/ endpoints, with their artifacts, features and the aggregation
+# of their predictions
+PREDICTION_MODELS = {
+    'temperature-regression': {'model': 'temperature_regression_model.pkl', 'scaler': None,
+                               'features': TEMPERATURE_FEATURES, 'aggregate': mean_by_group},
+    'humidity-regression': {'model': 'humidity_regression_model.pkl', 'scaler': None,
+                            'features': HUMIDITY_FEATURES, 'aggregate': mean_by_group},
+    'temperature-classification': {'model': 'temperature_classification_model.pkl', 'scaler': 'temperature_scaler.pkl',
+                                   'features': TEMPERATURE_FEATURES, 'aggregate': mode_by_group},
+    'humidity-classification': {'model': 'humidity_classification_model.pkl', 'scaler': 'humidity_scaler.pkl',
+                                'features': HUMIDITY_FEATURES, 'aggregate': mode_by_group},
+}
+
+
+def model_artifacts(name):
+    spec = PREDICTION_MODELS[name]
+    return [spec['model']] + ([spec['scaler']] if spec['scaler'] else [])
+
+
+def model_version(name):
+    # Versions of the model's artifacts and of the processed dataset its predictions are computed from
+    return tuple(artifact_version(artifact) for artifact in model_artifacts(name)) + (dataset_version(),)
+
+
+def model_inputs(name, rows):
+    # The feature matrix the model predicts from for the feature store rows: the regressors take the features as they
+    # are, the classifiers the readings expanded and scaled, as they were trained
+    spec = PREDICTION_MODELS[name]
+    X = rows.features(spec['features'])
+    if spec['scaler']:
+        X = model_registry.get(spec['scaler']).transform(expand_readings(X))
+    return X
+
+
+def predict_models(rows, group_columns, names=None):
+    # Runs the given models over the same feature store rows and aggregates their predictions by the group columns,
+    # 'date_key' and/or 'hour'
+    return {name: results[0] for name, results in predict_groupings(rows, [group_columns], names).items()}
+
+
+def predict_groupings(rows, groupings, names=None):
+    # Runs each of the given models once over the feature store rows and aggregates the same predictions by every
+    # list of group columns, returning one result per grouping for every model
+    groupings = [rows.groups(group_columns) for group_columns in groupings]
+    results = {}
+    for name in names or PREDICTION_MODELS:
+        spec = PREDICTION_MODELS[name]
+        predictions = load_model(spec['model']).predict(model_inputs(name, rows))
+        results[name] = [spec['aggregate'](groups, predictions) for groups in groupings]
+    return results
+
+
+class CombinedPredictor:
+    # Serves the temperature and humidity regressors and classifiers together. The rows of a month or day are
+    # selected from the feature store once, then shared by all four models. Results are keyed like the
+    # /prediction/<model>/ endpoints and match what each model's own predict and predict_day return.
+
+    @cached_prediction(*[artifact for name in PREDICTION_MODELS for artifact in model_artifacts(name)])
+    def predict(self, month=None):
+        # Daily predictions of all four models for the 2024 rows of the month, if provided
+        rows = feature_store.lookup(int(month) if month else None)
+        results = predict_models(rows, ['date_key'])
+        for name, result in results.items():
+            results[name] = pd.DataFrame({'Date': day_of_month(result['date_key']), 'Prediction': result['Prediction']})
+        return CombinedPrediction(results)
+
+    @cached_prediction(*[artifact for name in PREDICTION_MODELS for artifact in model_artifacts(name)])
+    def predict_day(self, date="01-01"):
+        # Hourly predictions of all four models for the 2024 rows of the day, given as 'dd-mm'
+        date = date.split("-")
+        month = int(date[1])
+        day = int(date[0])
+        rows = feature_store.lookup(month, day)
+        return CombinedPrediction(predict_models(rows, ['hour']))
+
+
+class CombinedPrediction(dict):
+    # The four results of a combined prediction, keyed by model name
+
+    def copy(self):
+        return CombinedPrediction({name: result.copy() for name, result in self.items()})
+
+    def to_dict(self):
+        # One JSON-ready response holding every series, e.g. {'temperature-regression': [{'Date': '01', ...}, ...]}
+        return {name: result.to_dict('records') for name, result in self.items()}
@@ -1,133 +1,384 @@
-import joblib
+import numpy as np
 import pandas as pd
 import re
 import os
-from sklearn.preprocessing import LabelEncoder
+from category_encodings import category_encodings
+from columnar_store import COLUMNAR_DATA_NAME, remove_legacy_pickle, write_columnar
+from date_index import date_keys
+from instrumentation import metrics, timed
+from model_registry import record_sources, source_fingerprint
+from raw_data_cache import read_raw_csv
+from streaming_statistics import ColumnStatistics
 
+# The raw sensor exports the processed data is built from
+MICROCLIMATE_SENSORS_DATA_FILE = "microclimate-sensors-data.csv"
+ARGYLE_SQUARE_SENSOR_DATA_FILE = "meshed-sensor-type-1.csv"
+# The processed data is kept in the columnar store, and the raw files it was built from are recorded under its name
+PROCESSED_DATA_NAME = COLUMNAR_DATA_NAME
 
-def process_and_clean_data():  # returns the processed and cleaned weather data
-    # Getting the directory where the script is located
-    current_dir = os.path.dirname(os.path.abspath(__file__))
+# Columns read from each raw sensor export, with the dtypes of the textual columns fixed up front so the parser
+# skips type inference on them. The numeric readings are coerced with pd.to_numeric after reading.
+MICROCLIMATE_SENSORS_DATA_COLUMNS = ["received_at", "sensorlocation", "airtemperature", "relativehumidity",
+                                     'atmosphericpressure']
+MICROCLIMATE_SENSORS_DATA_DTYPES = {'received_at': str, 'sensorlocation': str}
+ARGYLE_SQUARE_SENSOR_DATA_COLUMNS = ["time", "relativehumidity", "airtemp", "atmosphericpressure"]
+ARGYLE_SQUARE_SENSOR_DATA_DTYPES = {'time': str}
 
-    # Define paths to the data files using absolute paths
-    microclimate_sensors_data_file = os.path.join(current_dir, "microclimate-sensors-data.csv")
-    argyle_square_sensor_data_file = os.path.join(current_dir, "meshed-sensor-type-1.csv")
+WEATHER_DATA_NUMERIC_COLUMNS = ['airtemperature', 'relativehumidity', 'atmosphericpressure']
+
+# Columns of the processed weather data, in the order they are saved
+PROCESSED_WEATHER_DATA_COLUMNS = ['Date', 'sensorlocation', 'airtemperature', 'relativehumidity', 'atmosphericpressure',
+                                  'hour', 'month', 'day', 'season', 'sensor-location-encoded', 'season-encoded']
+
+# Compact dtypes the processed weather data is saved and loaded with. Date becomes an integer yyyymmdd key. The
+# readings are rounded to one decimal, so float32 keeps enough digits to round them back to the exact float64 values.
+COMPACT_WEATHER_DATA_DTYPES = {'Date': 'int32', 'sensorlocation': 'category', 'airtemperature': 'float32',
+                               'relativehumidity': 'float32', 'atmosphericpressure': 'float32', 'hour': 'int8',
+                               'month': 'int8', 'day': 'int8', 'season': 'category', 'sensor-location-encoded': 'int8',
+                               'season-encoded': 'int8'}
+READING_DECIMALS = 1
+
+# Categorical columns and the columns holding their codes from the shared category encodings
+ENCODED_COLUMNS = {'sensorlocation': 'sensor-location-encoded', 'season': 'season-encoded'}
+
+# Number of raw rows read at a time when processing in streaming mode
+DEFAULT_CHUNKSIZE = 100000
+
+UNIQUE_SENSOR_LOCATIONS = {'Batman Park', 'CH1 rooftop',
+                           'Tram Stop 7C - Melbourne Tennis Centre Precinct - Rod Laver Arena',
+                           "SkyFarm (Jeff's Shed). Rooftop - Melbourne Conference & Exhibition Centre (MCEC)",
+                           'Royal Park Asset ID: COM2707',
+                           'Tram Stop 7B - Melbourne Tennis Centre Precinct - Rod Laver Arena',
+                           '101 Collins St L11 Rooftop', 'Birrarung Marr Park - Pole 1131',
+                           'Enterprize Park - Pole ID: COM1667',
+                           'Swanston St - Tram Stop 13 adjacent Federation Sq & Flinders St Station',
+                           'Argyle Square'}
+
+
+# Removing any escape characters in the textual columns.
+def clean_text(location):
+    if isinstance(location, str):  # Only apply cleaning if the value is a string
+        cleaned_location = re.sub(r'[\n\t\r]', ' ', location)
+        cleaned_location = re.sub(r'\s+', ' ', cleaned_location).strip()
+        return cleaned_location
+    return location
+
+
+# Whitespace other than a plain space, which clean_text always rewrites
+ESCAPE_CHARACTER_PATTERN = re.compile(r'[^\S ]')
+
+
+# Vectorized clean_text over a whole column. Each distinct value is looked at once and only the rows holding a value
+# that clean_text changes are rewritten.
+def clean_text_column(values):
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    is_text = np.array([isinstance(value, str) for value in uniques], dtype=bool)
+
+    # A value is already clean unless it holds an escape character, two spaces in a row or a leading or trailing
+    # space. Joining the values with '\0' checks the whole column with a few scans.
+    joined = '\x00' + '\x00'.join(uniques[is_text]) + '\x00'
+    if not (ESCAPE_CHARACTER_PATTERN.search(joined) or '  ' in joined or '\x00 ' in joined or ' \x00' in joined):
+        return values
+
+    cleaned = np.array([clean_text(value) for value in uniques], dtype=object)
+    changed = is_text & (cleaned != uniques)
+    rows = (codes >= 0) & changed[codes]
+    values = values.copy()
+    values[rows] = cleaned[codes[rows]]
+    return values
+
+
+# Mapping the month to Melbourne's seasons for machine learning tasks
+def get_season(month):
+    if month in [12, 1, 2]:
+        return 'Summer'
+    elif month in [3, 4, 5]:
+        return 'Autumn'
+    elif month in [6, 7, 8]:
+        return 'Winter'
+    elif month in [9, 10, 11]:
+        return 'Spring'
+
+
+SEASON_BY_MONTH = {month: get_season(month) for month in range(1, 13)}
 
-    # Loading the weather data, Argyle Square data
-    microclimate_sensors_data = pd.read_csv(microclimate_sensors_data_file)
-    argyle_square_sensor_data = pd.read_csv(argyle_square_sensor_data_file)
 
+# Vectorized get_season over a column of months, looking each one up in SEASON_BY_MONTH
+def get_seasons(months):
+    return months.map(SEASON_BY_MONTH)
+
+
+# Converting the textual reading times to UTC datetimes, once cleaned of escape characters
+def parse_timestamps(values):
+    # The exports hold ISO 8601 times. Naming the format parses every value the same way, where an inferred format
+    # would depend on the first value of each chunk.
+    return pd.to_datetime(clean_text_column(values), errors='coerce', utc=True, format='ISO8601')
+
+
+# Formatting the datetimes as 'dd-mm-yy' dates once per distinct day rather than once per reading
+def format_dates(timestamps):
+    codes, days = pd.factorize(timestamps.dt.floor('D'))
+    return pd.Series(days.strftime('%d-%m-%y').take(codes, allow_fill=True, fill_value=np.nan),
+                     index=timestamps.index)
+
+
+# The reading time columns of the raw sensor exports, parsed once when the exports are cached
+MICROCLIMATE_SENSORS_DATA_PARSERS = {'received_at': parse_timestamps}
+ARGYLE_SQUARE_SENSOR_DATA_PARSERS = {'time': parse_timestamps}
+
+
+def prepare_microclimate_sensors_data(microclimate_sensors_data):
     # Selecting relevant columns for processing
-    microclimate_sensors_data = microclimate_sensors_data[
-        ["received_at", "sensorlocation", "airtemperature", "relativehumidity", 'atmosphericpressure']]
-    argyle_square_sensor_data = argyle_square_sensor_data[
-        ["time", "relativehumidity", "airtemp", "atmosphericpressure"]]
-
-    # Removing any escape characters in the textual columns.
-    def clean_text(location):
-        if isinstance(location, str):  # Only apply cleaning if the value is a string
-            cleaned_location = re.sub(r'[\n\t\r]', ' ', location)
-            cleaned_location = re.sub(r'\s+', ' ', cleaned_location).strip()
-            return cleaned_location
-        return location
-
-    microclimate_sensors_data['sensorlocation'] = microclimate_sensors_data['sensorlocation'].apply(clean_text)
-    microclimate_sensors_data['received_at'] = microclimate_sensors_data['received_at'].apply(clean_text)
-    argyle_square_sensor_data['time'] = argyle_square_sensor_data['time'].apply(clean_text)
-
-    # Converting received_at and Date columns to datetime
-    microclimate_sensors_data['received_at'] = pd.to_datetime(microclimate_sensors_data['received_at'], errors='coerce',
-                                                              utc=True)
-    argyle_square_sensor_data['time'] = pd.to_datetime(argyle_square_sensor_data['time'], errors='coerce', utc=True)
-
-    # Extracting hour, day, and month from the datetime columns
+    microclimate_sensors_data = microclimate_sensors_data[MICROCLIMATE_SENSORS_DATA_COLUMNS].copy()
+
+    microclimate_sensors_data['sensorlocation'] = clean_text_column(microclimate_sensors_data['sensorlocation'])
+
+    # Converting received_at to datetime, unless it comes parsed from the raw data cache, and extracting hour, day,
+    # and month from it
+    if not pd.api.types.is_datetime64_any_dtype(microclimate_sensors_data['received_at']):
+        microclimate_sensors_data['received_at'] = parse_timestamps(microclimate_sensors_data['received_at'])
     microclimate_sensors_data['hour'] = microclimate_sensors_data['received_at'].dt.hour
     microclimate_sensors_data['month'] = microclimate_sensors_data['received_at'].dt.month
     microclimate_sensors_data['day'] = microclimate_sensors_data['received_at'].dt.day
+
+    # Formatting dates to 'dd-mm-yy' and renaming received_at to Date
+    microclimate_sensors_data['received_at'] = format_dates(microclimate_sensors_data['received_at'])
+    microclimate_sensors_data.rename(columns={'received_at': 'Date'}, inplace=True)
+    return microclimate_sensors_data
+
+
+def prepare_argyle_square_sensor_data(argyle_square_sensor_data):
+    # Selecting relevant columns for processing
+    argyle_square_sensor_data = argyle_square_sensor_data[ARGYLE_SQUARE_SENSOR_DATA_COLUMNS].copy()
+
+    # Converting time to datetime, unless it comes parsed from the raw data cache, and extracting month, day, and hour
+    # from it
+    if not pd.api.types.is_datetime64_any_dtype(argyle_square_sensor_data['time']):
+        argyle_square_sensor_data['time'] = parse_timestamps(argyle_square_sensor_data['time'])
     argyle_square_sensor_data['month'] = argyle_square_sensor_data['time'].dt.month
     argyle_square_sensor_data['day'] = argyle_square_sensor_data['time'].dt.day
     argyle_square_sensor_data['hour'] = argyle_square_sensor_data['time'].dt.hour
 
-    # Formatting dates in both dataframes to 'dd-mm-yy'
-    microclimate_sensors_data['received_at'] = microclimate_sensors_data['received_at'].dt.strftime('%d-%m-%y')
-    argyle_square_sensor_data['time'] = argyle_square_sensor_data['time'].dt.strftime('%d-%m-%y')
+    # Formatting dates to 'dd-mm-yy'
+    argyle_square_sensor_data['time'] = format_dates(argyle_square_sensor_data['time'])
 
     # Renaming the columns in argyle square data to match the names of microclimate_sensors_data columns
     argyle_square_sensor_data.rename(columns={'time': 'Date', 'airtemp': 'airtemperature'}, inplace=True)
     argyle_square_sensor_data['sensorlocation'] = 'Argyle Square'
+    return argyle_square_sensor_data
 
-    # Renaming received_at to Date in microclimate_sensors_data
-    microclimate_sensors_data.rename(columns={'received_at': 'Date'}, inplace=True)
 
-    # Concatenating microclimate_sensors_data and argyle square data
-    microclimate_sensors_data = pd.concat([microclimate_sensors_data, argyle_square_sensor_data], ignore_index=True)
+def remove_outliers(weather_data, lower_bound, upper_bound):
+    for column in WEATHER_DATA_NUMERIC_COLUMNS:
+        weather_data = weather_data[
+            (weather_data[column] >= lower_bound[column]) & (weather_data[column] <= upper_bound[column])]
+    return weather_data
 
-    # Converting numerical columns to numeric and handle missing values
-    # Mean imputing into the null values, removing any non numeric data, and rounding the numeric data to 1 decimal point.
 
-    for column in ['airtemperature', 'relativehumidity', 'atmosphericpressure']:
-        microclimate_sensors_data[column] = pd.to_numeric(microclimate_sensors_data[column], errors='coerce')
-        microclimate_sensors_data[column] = microclimate_sensors_data[column].fillna(
-            microclimate_sensors_data[column].mean())
-        microclimate_sensors_data.loc[:, column] = microclimate_sensors_data[column].round(1)
+def encode_weather_data(weather_data):
+    # Adding the 'season' column
+    weather_data['season'] = get_seasons(weather_data['month'])
 
-    # Outlier detection using IQR method
-    weather_data_numeric_columns = ['airtemperature', 'relativehumidity', 'atmosphericpressure']
-    Q1 = microclimate_sensors_data[weather_data_numeric_columns].quantile(0.25)
-    Q3 = microclimate_sensors_data[weather_data_numeric_columns].quantile(0.75)
-    IQR = Q3 - Q1
+    # Encoding the sensor locations and seasons into numerical values for machine learning tasks. The codes come from
+    # the persisted category encodings, so they stay the same across runs and new categories get new codes.
+    weather_data['sensor-location-encoded'] = category_encodings.encode(
+        'sensorlocation', weather_data['sensorlocation'], UNIQUE_SENSOR_LOCATIONS)
+    weather_data['season-encoded'] = category_encodings.encode(
+        'season', weather_data['season'], SEASON_BY_MONTH.values())
 
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
+    # Dropping any null values left
+    weather_data = weather_data.dropna()
+    weather_data.reset_index(drop=True, inplace=True)
+    return weather_data
 
-    for column in weather_data_numeric_columns:
-        microclimate_sensors_data = microclimate_sensors_data[
-            (microclimate_sensors_data[column] >= lower_bound[column]) & (
-                        microclimate_sensors_data[column] <= upper_bound[column])]
-
-    # Removing any unexpected sensor location in the data
-    unique_sensor_locations = {'Batman Park', 'CH1 rooftop',
-                               'Tram Stop 7C - Melbourne Tennis Centre Precinct - Rod Laver Arena',
-                               "SkyFarm (Jeff's Shed). Rooftop - Melbourne Conference & Exhibition Centre (MCEC)",
-                               'Royal Park Asset ID: COM2707',
-                               'Tram Stop 7B - Melbourne Tennis Centre Precinct - Rod Laver Arena',
-                               '101 Collins St L11 Rooftop', 'Birrarung Marr Park - Pole 1131',
-                               'Enterprize Park - Pole ID: COM1667',
-                               'Swanston St - Tram Stop 13 adjacent Federation Sq & Flinders St Station',
-                               'Argyle Square'}
-
-    microclimate_sensors_data = microclimate_sensors_data[
-        microclimate_sensors_data['sensorlocation'].isin(unique_sensor_locations)]
-
-    # Mapping the month to Melbourne's seasons for machine learning tasks
-    def get_season(month):
-        if month in [12, 1, 2]:
-            return 'Summer'
-        elif month in [3, 4, 5]:
-            return 'Autumn'
-        elif month in [6, 7, 8]:
-            return 'Winter'
-        elif month in [9, 10, 11]:
-            return 'Spring'
 
-    # Adding the 'season' column
-    microclimate_sensors_data['season'] = microclimate_sensors_data['month'].apply(get_season)
+def compact_weather_data(weather_data):
+    # Converting the encoded weather data to the compact dtypes, with the 'dd-mm-yy' dates turned into yyyymmdd keys.
+    # The categorical columns take the categories of the shared encodings, so their codes equal the encoded columns.
+    dtypes = dict(COMPACT_WEATHER_DATA_DTYPES)
+    for column in ENCODED_COLUMNS:
+        dtypes[column] = pd.CategoricalDtype(category_encodings.categories(column))
+    weather_data = weather_data.assign(Date=date_keys(weather_data['Date']))
+    return weather_data.astype(dtypes)
 
-    # Encoding the sensor locations and seasons into numerical values for machine learning tasks
-    label_encoder = LabelEncoder()
-    microclimate_sensors_data['sensor-location-encoded'] = label_encoder.fit_transform(
-        microclimate_sensors_data['sensorlocation'])
-    microclimate_sensors_data['season-encoded'] = label_encoder.fit_transform(microclimate_sensors_data['season'])
 
-    # Dropping any null values left
-    microclimate_sensors_data = microclimate_sensors_data.dropna()
-    microclimate_sensors_data.reset_index(drop=True, inplace=True)
+def expand_readings(weather_data):
+    # Float64 copy of the float32 readings of a frame or series, rounded back to the values they were processed to.
+    # Models are trained and scaled on these, so they match the ones trained before the readings were compacted.
+    if isinstance(weather_data, pd.Series):
+        if weather_data.dtype != 'float32':
+            return weather_data
+        return weather_data.astype('float64').round(READING_DECIMALS)
+    readings = [column for column in weather_data.columns if weather_data[column].dtype == 'float32']
+    return weather_data.astype({column: 'float64' for column in readings}).round(
+        {column: READING_DECIMALS for column in readings})
+
+
+@timed('process_and_clean_data')
+def process_and_clean_data(chunksize=None, quantile_error=None):  # returns the processed and cleaned weather data
+    laps = metrics.laps('process_and_clean_data')
+
+    # Getting the directory where the script is located
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+
+    # Define paths to the data files using absolute paths
+    microclimate_sensors_data_file = os.path.join(current_dir, MICROCLIMATE_SENSORS_DATA_FILE)
+    argyle_square_sensor_data_file = os.path.join(current_dir, ARGYLE_SQUARE_SENSOR_DATA_FILE)
+    # Fingerprinted before reading, so changes made to the files while they are processed are picked up next time
+    raw_data_sources = source_fingerprint([MICROCLIMATE_SENSORS_DATA_FILE, ARGYLE_SQUARE_SENSOR_DATA_FILE])
+
+    if chunksize:
+        # Streaming mode: the raw files are read chunksize rows at a time so peak memory stays bounded. The
+        # quartiles are exact unless a quantile_error is given for the sketch.
+        microclimate_sensors_data = process_and_clean_data_in_chunks(microclimate_sensors_data_file,
+                                                                     argyle_square_sensor_data_file, chunksize,
+                                                                     quantile_error)
+        laps.mark('clean_in_chunks')
+    else:
+        # Loading the weather data, Argyle Square data, from the raw data cache unless the files changed
+        microclimate_sensors_data = read_raw_csv(microclimate_sensors_data_file, MICROCLIMATE_SENSORS_DATA_COLUMNS,
+                                                 MICROCLIMATE_SENSORS_DATA_DTYPES, MICROCLIMATE_SENSORS_DATA_PARSERS)
+        argyle_square_sensor_data = read_raw_csv(argyle_square_sensor_data_file, ARGYLE_SQUARE_SENSOR_DATA_COLUMNS,
+                                                 ARGYLE_SQUARE_SENSOR_DATA_DTYPES, ARGYLE_SQUARE_SENSOR_DATA_PARSERS)
+        laps.mark('read_raw_data')
+        microclimate_sensors_data = prepare_microclimate_sensors_data(microclimate_sensors_data)
+        argyle_square_sensor_data = prepare_argyle_square_sensor_data(argyle_square_sensor_data)
+        laps.mark('prepare')
+
+        # Concatenating microclimate_sensors_data and argyle square data
+        microclimate_sensors_data = pd.concat([microclimate_sensors_data, argyle_square_sensor_data],
+                                              ignore_index=True)
+        laps.mark('concat')
+
+        # Converting numerical columns to numeric and handle missing values
+        # Mean imputing into the null values, removing any non numeric data, and rounding the numeric data to 1 decimal point.
+
+        for column in WEATHER_DATA_NUMERIC_COLUMNS:
+            microclimate_sensors_data[column] = pd.to_numeric(microclimate_sensors_data[column], errors='coerce')
+            microclimate_sensors_data[column] = microclimate_sensors_data[column].fillna(
+                microclimate_sensors_data[column].mean())
+            microclimate_sensors_data.loc[:, column] = microclimate_sensors_data[column].round(1)
+        laps.mark('clean_readings')
+
+        # Outlier detection using IQR method
+        Q1 = microclimate_sensors_data[WEATHER_DATA_NUMERIC_COLUMNS].quantile(0.25)
+        Q3 = microclimate_sensors_data[WEATHER_DATA_NUMERIC_COLUMNS].quantile(0.75)
+        IQR = Q3 - Q1
+
+        lower_bound = Q1 - 1.5 * IQR
+        upper_bound = Q3 + 1.5 * IQR
+
+        microclimate_sensors_data = remove_outliers(microclimate_sensors_data, lower_bound, upper_bound)
+
+        # Removing any unexpected sensor location in the data
+        microclimate_sensors_data = microclimate_sensors_data[
+            microclimate_sensors_data['sensorlocation'].isin(UNIQUE_SENSOR_LOCATIONS)]
+        laps.mark('remove_outliers')
 
-    processed_data_file = os.path.join(current_dir, 'processed_weather_data.pkl')
-    joblib.dump(microclimate_sensors_data, processed_data_file)
+    microclimate_sensors_data = compact_weather_data(encode_weather_data(microclimate_sensors_data))
+    laps.mark('encode')
 
+    save_processed_data(microclimate_sensors_data, raw_data_sources, laps)
     return microclimate_sensors_data
 
 
-# Execute the function
-process_and_clean_data()
+def save_processed_data(weather_data, raw_data_sources, laps, rollup=None):
+    # Writing the columnar store the predictors read from, which replaced the joblib pickle of older versions
+    write_columnar(weather_data)
+    remove_legacy_pickle()
+    laps.mark('write_columnar')
+
+    # And the rollup the dashboard statistics are answered from, unless given one already updated with the rows
+    # appended to the data. Imported here, as the rollup reads the readings with expand_readings from this module.
+    from weather_rollup import build_rollup, save_rollup
+    save_rollup(build_rollup(weather_data) if rollup is None else rollup, raw_data_sources)
+    laps.mark('rollup')
+
+    # Recording the raw files the processed data was built from, so it is reused at startup until they change
+    record_sources(PROCESSED_DATA_NAME, raw_data_sources)
+
+
+def read_sensor_data_in_chunks(microclimate_sensors_data_file, argyle_square_sensor_data_file, chunksize,
+                               numeric_only=False):
+    # Yields the raw sensor data chunk by chunk, reading only the columns that are processed. With numeric_only
+    # the chunks hold just the readings, named as in the processed data. The chunks are read from the raw data
+    # cache, which is built chunk by chunk too when a file changed.
+    microclimate_columns = MICROCLIMATE_SENSORS_DATA_COLUMNS
+    argyle_square_columns = ARGYLE_SQUARE_SENSOR_DATA_COLUMNS
+    if numeric_only:
+        microclimate_columns = WEATHER_DATA_NUMERIC_COLUMNS
+        argyle_square_columns = ["relativehumidity", "airtemp", "atmosphericpressure"]
+
+    for chunk in read_raw_csv(microclimate_sensors_data_file, MICROCLIMATE_SENSORS_DATA_COLUMNS,
+                              MICROCLIMATE_SENSORS_DATA_DTYPES, MICROCLIMATE_SENSORS_DATA_PARSERS, chunksize,
+                              select=microclimate_columns):
+        yield chunk if numeric_only else prepare_microclimate_sensors_data(chunk)
+    for chunk in read_raw_csv(argyle_square_sensor_data_file, ARGYLE_SQUARE_SENSOR_DATA_COLUMNS,
+                              ARGYLE_SQUARE_SENSOR_DATA_DTYPES, ARGYLE_SQUARE_SENSOR_DATA_PARSERS, chunksize,
+                              select=argyle_square_columns):
+        if numeric_only:
+            yield chunk.rename(columns={'airtemp': 'airtemperature'})
+        else:
+            yield prepare_argyle_square_sensor_data(chunk)
+
+
+def collect_weather_statistics(microclimate_sensors_data_file, argyle_square_sensor_data_file,
+                               chunksize=DEFAULT_CHUNKSIZE, quantile_error=None):
+    # First pass: accumulating the imputation means and the quartiles of every numeric column chunk by chunk
+    weather_statistics = {column: ColumnStatistics(quantile_error=quantile_error)
+                          for column in WEATHER_DATA_NUMERIC_COLUMNS}
+    for chunk in read_sensor_data_in_chunks(microclimate_sensors_data_file, argyle_square_sensor_data_file,
+                                            chunksize, numeric_only=True):
+        for column in WEATHER_DATA_NUMERIC_COLUMNS:
+            weather_statistics[column].update(chunk[column])
+    return weather_statistics
+
+
+def summarize_weather_statistics(weather_statistics):
+    # Reducing the accumulated statistics to the values applied while cleaning: the imputation means and the IQR
+    # outlier bounds of every numeric column
+    cleaning_statistics = {'mean': {}, 'lower_bound': {}, 'upper_bound': {}}
+    for column in WEATHER_DATA_NUMERIC_COLUMNS:
+        cleaning_statistics['mean'][column] = weather_statistics[column].mean
+        lower_bound, upper_bound = weather_statistics[column].iqr_bounds()
+        cleaning_statistics['lower_bound'][column] = lower_bound
+        cleaning_statistics['upper_bound'][column] = upper_bound
+    return cleaning_statistics
+
+
+def clean_weather_data_chunk(chunk, cleaning_statistics):
+    # Mean imputing, rounding and removing the outliers and unexpected sensor locations of one prepared chunk
+    for column in WEATHER_DATA_NUMERIC_COLUMNS:
+        chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+        chunk[column] = chunk[column].fillna(cleaning_statistics['mean'][column])
+        chunk.loc[:, column] = chunk[column].round(1)
+
+    chunk = remove_outliers(chunk, cleaning_statistics['lower_bound'], cleaning_statistics['upper_bound'])
+    return chunk[chunk['sensorlocation'].isin(UNIQUE_SENSOR_LOCATIONS)]
+
+
+def process_and_clean_data_in_chunks(microclimate_sensors_data_file, argyle_square_sensor_data_file,
+                                     chunksize=DEFAULT_CHUNKSIZE, quantile_error=None):
+    weather_statistics = collect_weather_statistics(microclimate_sensors_data_file, argyle_square_sensor_data_file,
+                                                    chunksize, quantile_error)
+    cleaning_statistics = summarize_weather_statistics(weather_statistics)
+
+    # Second pass: cleaning each chunk with the global statistics and keeping only the rows that survive
+    cleaned_chunks = []
+    date_parts_have_nulls = False
+    for chunk in read_sensor_data_in_chunks(microclimate_sensors_data_file, argyle_square_sensor_data_file,
+                                            chunksize):
+        # Hour, day and month turn into floats when a date could not be parsed, as they do in the full frame
+        date_parts_have_nulls = date_parts_have_nulls or chunk['hour'].isna().any()
+        cleaned_chunks.append(clean_weather_data_chunk(chunk, cleaning_statistics))
+
+    weather_data = pd.concat(cleaned_chunks, ignore_index=True)
+    if date_parts_have_nulls:
+        weather_data = weather_data.astype({'hour': 'float64', 'month': 'float64', 'day': 'float64'})
+    return weather_data
+
+
+# Execute the function when run as a script, so the helpers above can be imported without reprocessing everything
+if __name__ == '__main__':
+    process_and_clean_data()
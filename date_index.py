@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+
+def date_keys(dates):
+    # Turns 'dd-mm-yy' dates into integer yyyymmdd keys by slicing the strings, without going through pd.to_datetime.
+    # Dates of the compact processed data already are yyyymmdd keys.
+    if pd.api.types.is_integer_dtype(dates):
+        return np.asarray(dates, dtype=np.int64)
+    dates = pd.Series(dates).astype(str)
+    years = 2000 + dates.str[6:8].astype(int)
+    return (years * 10000 + dates.str[3:5].astype(int) * 100 + dates.str[0:2].astype(int)).to_numpy()
+
+
+def day_of_month(date_keys):
+    # Formats yyyymmdd keys like strftime('%d') does
+    return pd.Series(date_keys % 100).map('{:02d}'.format)
+
+
+def date_bounds(sorted_keys, year, month=None, day=None):
+    # First and past the last position of the given year, month and day in sorted yyyymmdd keys
+    first_key = year * 10000 + (month or 1) * 100 + (day or 1)
+    last_key = year * 10000 + (month or 12) * 100 + (day or 31)
+    return (np.searchsorted(sorted_keys, first_key, side='left'),
+            np.searchsorted(sorted_keys, last_key, side='right'))
+
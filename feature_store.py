@@ -0,0 +1,89 @@
+import threading
+import numpy as np
+import pandas as pd
+from columnar_store import dataset_version, load_weather_data
+from date_index import date_bounds, date_keys
+
+# Both readings plus the features every model shares. The temperature models take the humidity reading as a feature
+# and the humidity models take the temperature reading.
+TEMPERATURE_FEATURES = ['relativehumidity', 'day', 'hour', 'sensor-location-encoded', 'atmosphericpressure',
+                        'season-encoded']
+HUMIDITY_FEATURES = ['airtemperature', 'day', 'hour', 'sensor-location-encoded', 'atmosphericpressure',
+                     'season-encoded']
+
+# Year of the rows the predictions are made for
+PREDICTION_YEAR = 2024
+
+
+def read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+class FeatureSlice:
+    # Rows of a year, month or day: their yyyymmdd date keys, their hours and a float32 feature matrix per feature
+    # set, all read-only arrays
+    def __init__(self, date_keys, hours, matrices):
+        self.date_keys = date_keys
+        self.hours = hours
+        self.matrices = matrices
+
+    def __len__(self):
+        return len(self.date_keys)
+
+    def __getitem__(self, rows):
+        # A range of the rows, as views of the same arrays
+        return FeatureSlice(self.date_keys[rows], self.hours[rows],
+                            {columns: matrix[rows] for columns, matrix in self.matrices.items()})
+
+    def features(self, columns):
+        # The feature matrix of the columns wrapped in a frame without copying it, so the models and scalers fitted on
+        # frames see the feature names they were fitted with
+        return pd.DataFrame(self.matrices[tuple(columns)], columns=columns, copy=False)
+
+    def groups(self, columns):
+        # The 'date_key' and 'hour' columns the predictions are grouped by
+        return pd.DataFrame({column: {'date_key': self.date_keys, 'hour': self.hours}[column] for column in columns})
+
+
+class FeatureStore:
+    # Owns the prediction year's rows of the processed dataset for every model of the process. The rows are sorted by
+    # date and every feature set turned into one contiguous float32 matrix once, so the rows of any month or day are
+    # a contiguous range and each lookup hands out views into the same arrays. The trees compare their features as
+    # float32, so nothing is lost. The arrays are rebuilt only when the processed dataset changes.
+    def __init__(self, feature_sets=(TEMPERATURE_FEATURES, HUMIDITY_FEATURES), year=PREDICTION_YEAR):
+        self.feature_sets = [list(columns) for columns in feature_sets]
+        self.year = year
+        self.lock = threading.Lock()
+        self.rows = None
+        self.version = None
+
+    def year_rows(self):
+        version = dataset_version()
+        with self.lock:
+            if self.rows is None or self.version != version:
+                columns = [column for columns in self.feature_sets for column in columns] + ['Date']
+                weather_data = load_weather_data(list(dict.fromkeys(columns)), year=self.year)
+                keys = date_keys(weather_data['Date'])
+                order = np.argsort(keys, kind='stable')
+                weather_data = weather_data.take(order)
+                self.rows = FeatureSlice(
+                    read_only(keys[order]), read_only(weather_data['hour'].to_numpy(copy=True)),
+                    {tuple(columns): read_only(np.ascontiguousarray(weather_data[columns].to_numpy(dtype=np.float32)))
+                     for columns in self.feature_sets})
+                self.version = version
+            return self.rows
+
+    def lookup(self, month=None, day=None):
+        # The rows of the whole year, or of the given month and day when provided
+        rows = self.year_rows()
+        start, end = date_bounds(rows.date_keys, self.year, month, day)
+        return rows[start:end]
+
+    def nbytes(self):
+        rows = self.year_rows()
+        return rows.date_keys.nbytes + rows.hours.nbytes + sum(matrix.nbytes for matrix in rows.matrices.values())
+
+
+# Feature store shared by every model of the process
+feature_store = FeatureStore()
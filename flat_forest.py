@@ -0,0 +1,180 @@
+import os
+import threading
+import numpy as np
+from model_registry import artifact_version, model_registry, save_artifact
+
+# Backend serving the forests: 'sklearn' predicts with the trained models as they are, 'flat' with a flattened copy
+# of their trees that gives the same predictions
+INFERENCE_BACKEND = os.environ.get('WEATHER_INFERENCE_BACKEND', 'sklearn')
+
+# Number of rows predicted at once, which bounds the memory of a prediction
+DEFAULT_BATCH_SIZE = 32768
+
+# Number of (tree, row) pairs walked down together
+DEFAULT_WALK_SIZE = 65536
+
+# Feature index sklearn gives the leaves
+LEAF = -2
+
+
+class FlatForest:
+    # A random forest whose trees are concatenated into a few flat node arrays, so every row is walked down every
+    # tree together, one level per step, with numpy. The two children of node i are children[2 * i] and
+    # children[2 * i + 1], indexed over the whole forest, and a child that is a leaf is stored as the bitwise complement
+    # of its index in leaf_values. Only what prediction needs is kept, which makes the artifact several times smaller
+    # than the sklearn model.
+    def __init__(self, feature, threshold, children, missing_go_to_left, leaf_values, roots, classes=None,
+                 source_version=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.missing_go_to_left = missing_go_to_left
+        self.leaf_values = leaf_values
+        self.roots = roots
+        self.classes_ = classes
+        self.source_version = source_version
+
+    @classmethod
+    def from_model(cls, model, source_version=None):
+        # Flattens a fitted single output RandomForestRegressor or RandomForestClassifier
+        if model.n_outputs_ != 1:
+            raise ValueError('Only single output forests can be flattened')
+        is_classifier = hasattr(model, 'classes_')
+
+        feature, threshold, children, missing_go_to_left, leaf_values, roots = [], [], [], [], [], []
+        node_count = 0
+        leaf_count = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.feature == LEAF
+            # Split nodes are renumbered over the forest and leaves get the complement of their leaf value index
+            node_numbers = np.where(is_leaf, ~(np.cumsum(is_leaf) - 1 + leaf_count),
+                                    np.cumsum(~is_leaf) - 1 + node_count)
+            split = ~is_leaf
+
+            feature.append(tree.feature[split].astype(np.int32))
+            threshold.append(tree.threshold[split])
+            children.append(np.column_stack([node_numbers[tree.children_left[split]],
+                                             node_numbers[tree.children_right[split]]]).ravel().astype(np.int32))
+            missing_go_to_left.append(tree.missing_go_to_left[split].astype(bool))
+            # Classifier leaves hold the fraction of every class, which is what the tree's predict_proba returns
+            values = tree.value[is_leaf, 0]
+            leaf_values.append(values[:, :model.n_classes_] if is_classifier else values[:, 0])
+            roots.append(node_numbers[0])
+
+            node_count += int(split.sum())
+            leaf_count += int(is_leaf.sum())
+
+        return cls(np.concatenate(feature), np.concatenate(threshold), np.concatenate(children),
+                   np.concatenate(missing_go_to_left), np.concatenate(leaf_values), np.array(roots, dtype=np.int32),
+                   model.classes_ if is_classifier else None, source_version)
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def nbytes(self):
+        # Memory held by the node and leaf arrays
+        return sum(array.nbytes for array in (self.feature, self.threshold, self.children, self.missing_go_to_left,
+                                              self.leaf_values, self.roots))
+
+    def apply(self, X):
+        # Leaf value index reached by every row in every tree, as an (n_estimators, n_rows) array. Rows are compared
+        # as float32 against the float64 thresholds, like sklearn does, so they take exactly the same paths.
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows = len(X)
+        leaves = np.empty((self.n_estimators, n_rows), dtype=np.int32)
+        # Walking a few trees at a time keeps the nodes being read in cache when there are many rows
+        trees_per_walk = max(1, DEFAULT_WALK_SIZE // max(n_rows, 1))
+        for first_tree in range(0, self.n_estimators, trees_per_walk):
+            roots = self.roots[first_tree:first_tree + trees_per_walk]
+            leaves[first_tree:first_tree + len(roots)] = self._walk(X, roots).reshape(len(roots), n_rows)
+        return leaves
+
+    def _walk(self, X, roots):
+        n_rows, n_features = X.shape
+        values = X.ravel()
+        has_missing = bool(np.isnan(values).any())
+
+        # One (tree, row) pair per position, tree by tree, with the node it is at and the offset of its row in X
+        leaves = np.repeat(roots, n_rows)
+        position = np.flatnonzero(leaves >= 0).astype(np.int32)
+        node = leaves[position]
+        row_offset = (position % n_rows * n_features).astype(np.int32)
+        while position.size:
+            value = values[row_offset + self.feature[node]]
+            go_right = value > self.threshold[node]
+            if has_missing:
+                # A missing value is never greater than the threshold and goes where the split sent them in training
+                go_right |= np.isnan(value) & ~self.missing_go_to_left[node]
+            node = self.children[2 * node + go_right]
+
+            # Pairs that reached a leaf are done, the others take the next step
+            done = node < 0
+            leaves[position[done]] = node[done]
+            split = ~done
+            node, position, row_offset = node[split], position[split], row_offset[split]
+        return ~leaves
+
+    def _accumulate(self, X, batch_size):
+        # Sum of the leaf values of every tree divided by the number of trees. The trees are added one after another
+        # in the order sklearn adds them, so the float rounding is the same.
+        X = np.asarray(X)
+        total = np.zeros((len(X),) + self.leaf_values.shape[1:])
+        for start in range(0, len(X), batch_size):
+            batch_total = total[start:start + batch_size]
+            for tree_leaves in self.apply(X[start:start + batch_size]):
+                batch_total += self.leaf_values[tree_leaves]
+        total /= self.n_estimators
+        return total
+
+    def predict_proba(self, X, batch_size=DEFAULT_BATCH_SIZE):
+        if self.classes_ is None:
+            raise AttributeError('A regression forest has no predict_proba')
+        return self._accumulate(X, batch_size)
+
+    def predict(self, X, batch_size=DEFAULT_BATCH_SIZE):
+        if self.classes_ is None:
+            return self._accumulate(X, batch_size)
+        return self.classes_.take(np.argmax(self._accumulate(X, batch_size), axis=1), axis=0)
+
+
+def flat_model_file(file_name):
+    # 'temperature_regression_model.pkl' is flattened to 'temperature_regression_model.flat.pkl'
+    return os.path.splitext(file_name)[0] + '.flat.pkl'
+
+
+export_lock = threading.Lock()
+
+
+def export_flat_forest(file_name):
+    # Flattens the model artifact and saves the flat forest next to it, compressed, with the version of the model it
+    # was made from
+    source_version = artifact_version(file_name)
+    forest = FlatForest.from_model(model_registry.get(file_name), source_version)
+    save_artifact(forest, flat_model_file(file_name), compress=3)
+    return forest
+
+
+def load_model(file_name, backend=None):
+    # The model to predict with on the given backend, INFERENCE_BACKEND by default. The flat forest is exported the
+    # first time it is needed and again whenever the model artifact is replaced, e.g. by train().
+    backend = backend or INFERENCE_BACKEND
+    if backend == 'sklearn':
+        return model_registry.get(file_name)
+    if backend != 'flat':
+        raise ValueError(f"Unknown inference backend {backend!r}, expected 'sklearn' or 'flat'")
+
+    flat_file = flat_model_file(file_name)
+    if artifact_version(flat_file) is not None:
+        forest = model_registry.get(flat_file)
+        if forest.source_version == artifact_version(file_name):
+            return forest
+    with export_lock:
+        # Another thread may have exported the model while this one was waiting
+        if artifact_version(flat_file) is not None:
+            forest = model_registry.get(flat_file)
+            if forest.source_version == artifact_version(file_name):
+                return forest
+        export_flat_forest(file_name)
+    return model_registry.get(flat_file)
@@ -0,0 +1,116 @@
+import threading
+import numpy as np
+import pandas as pd
+from combined_prediction import PREDICTION_MODELS, CombinedPredictor, model_artifacts, model_version, predict_groupings
+from date_index import day_of_month
+from feature_store import feature_store
+from model_registry import artifact_version, model_registry, save_artifact
+
+
+def forecast_file_name(name):
+    return f"forecast_{name.replace('-', '_')}.pkl"
+
+
+def materialize_forecasts(names=None):
+    # Computes every answer the given models can serve, the daily results of all months and the hourly results of all
+    # days of 2024, with one bulk prediction per model. Each model's tables are saved as their own artifact, along with
+    # the model and dataset versions they were computed from. Run once the models are trained, by the training
+    # orchestrator and at startup.
+    rows = feature_store.lookup()
+    for name in names or PREDICTION_MODELS:
+        version = model_version(name)
+        if len(rows):
+            # The predictions of the year's rows, averaged or voted by day and by day and hour
+            daily, hourly = predict_groupings(rows, [['date_key'], ['date_key', 'hour']], [name])[name]
+        else:
+            # Without rows of 2024 there is nothing to predict, and the models cannot predict zero rows. The tables are
+            # saved empty, so the model's forecasts are current all the same.
+            daily = pd.DataFrame({'date_key': np.array([], dtype=np.int64), 'Prediction': []})
+            hourly = daily.assign(hour=np.array([], dtype=rows.hours.dtype))[['date_key', 'hour', 'Prediction']]
+        save_artifact({'version': version, 'daily': daily, 'hourly': hourly}, forecast_file_name(name))
+
+
+def forecasts_current(name):
+    # Whether the model's forecast tables were computed from its current model and dataset
+    forecast_file = forecast_file_name(name)
+    return (artifact_version(forecast_file) is not None
+            and model_registry.get(forecast_file)['version'] == model_version(name))
+
+
+def stale_forecasts(names=None):
+    # The trained models whose forecast tables are missing or older than the model or the dataset
+    return [name for name in names or PREDICTION_MODELS
+            if all(artifact_version(artifact) is not None for artifact in model_artifacts(name))
+            and not forecasts_current(name)]
+
+
+class ForecastStore:
+    # Serves predictions from the materialized forecast tables. When an artifact is loaded, its tables are split once
+    # into the result of every month and day, so a request is a dictionary lookup, and a month or day the tables hold
+    # no rows of gets an empty result. When a table is missing or older than its model or the dataset, the prediction
+    # is computed live instead.
+    def __init__(self):
+        self.live_predictor = CombinedPredictor()
+        self.lock = threading.Lock()
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def forecast_results(self, name):
+        if not forecasts_current(name):
+            return None
+        forecasts = model_registry.get(forecast_file_name(name))
+
+        results = self.results.get(name)
+        if results is None or results['forecasts'] is not forecasts:
+            results = {'forecasts': forecasts, 'monthly': {}, 'day-hourly': {}}
+            daily = forecasts['daily']
+            daily = daily.assign(Date=day_of_month(daily['date_key']).to_numpy())
+            results['monthly'][None] = daily[['Date', 'Prediction']].reset_index(drop=True)
+            results['empty'] = {'monthly': results['monthly'][None].iloc[:0],
+                                'day-hourly': forecasts['hourly'][['hour', 'Prediction']].iloc[:0]}
+            for month, rows in daily.groupby(daily['date_key'] // 100 % 100):
+                results['monthly'][month] = rows[['Date', 'Prediction']].reset_index(drop=True)
+            hourly = forecasts['hourly']
+            for date_key, rows in hourly.groupby('date_key'):
+                results['day-hourly'][date_key] = rows[['hour', 'Prediction']].reset_index(drop=True)
+            self.results[name] = results
+        return results
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def predict(self, name, month=None):
+        results = self.forecast_results(name)
+        result = (results['monthly'].get(int(month) if month else None, results['empty']['monthly']) if results
+                  else None)
+        self.count(result is not None)
+        if result is None:
+            return self.live_predictor.predict(month)[name]
+        return result.copy()
+
+    def predict_day(self, name, date="01-01"):
+        day, month = (int(part) for part in date.split("-"))
+        results = self.forecast_results(name)
+        result = (results['day-hourly'].get(20240000 + month * 100 + day, results['empty']['day-hourly']) if results
+                  else None)
+        self.count(result is not None)
+        if result is None:
+            return self.live_predictor.predict_day(date)[name]
+        return result.copy()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+# Store shared by the serving code of the process
+forecast_store = ForecastStore()
+
+
+if __name__ == '__main__':
+    materialize_forecasts()
@@ -3,34 +3,74 @@
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 from sklearn.ensemble import RandomForestRegressor
 import numpy as np
-import joblib
-import os
 import pandas as pd
+from columnar_store import load_weather_data
+from data_processing import expand_readings
+from date_index import date_keys, day_of_month
+from feature_store import HUMIDITY_FEATURES, feature_store
+from flat_forest import load_model
+from incremental_training import fit_forest, record_training
+from instrumentation import metrics, timed
+from model_registry import save_artifact
+from model_tuning import holdout_predictions, training_sources, tuned_parameters
+from prediction_cache import cached_prediction
 
 
 class HumidityRegressor:
     def __init__(self):
         self.model = RandomForestRegressor(n_estimators=100, random_state=42)
+        # The forest settings picked by model_tuning, once it has been run, replace the defaults
+        self.model.set_params(**tuned_parameters('humidity-regression'))
         self.weather_data_file = 'processed_weather_data.pkl'
-        current_dir = os.path.dirname(__file__)
-        file_path = os.path.join(current_dir, 'processed_weather_data.pkl')
-        self.weather_data = joblib.load(file_path)
+        self._weather_data = None
 
-    def train(self):
-        # Select features (X) and target (y) from the dataset
-        X = self.weather_data[
-            ['airtemperature', 'day', 'hour', 'sensor-location-encoded', 'atmosphericpressure', 'season-encoded']]
-        y = self.weather_data['relativehumidity']
-
-        # Initialize and train the Random Forest Regression model
-        self.model.fit(X, y)
+    @property
+    def weather_data(self):
+        # The full processed dataset is only loaded when training needs it, predictions read just their own rows
+        if self._weather_data is None:
+            self._weather_data = load_weather_data()
+        return self._weather_data
 
-        # Make predictions on the test set
-        y_pred = self.model.predict(X)
+    @weather_data.setter
+    def weather_data(self, weather_data):
+        self._weather_data = weather_data
 
-        current_dir = os.path.dirname(__file__)
-        file_path = os.path.join(current_dir, 'humidity_regression_model.pkl')
-        joblib.dump(self.model, file_path)
+    def training_data(self):
+        # Select features (X) and target (y) from the dataset
+        X = self.weather_data[HUMIDITY_FEATURES]
+        y = expand_readings(self.weather_data['relativehumidity'])
+        return X, y
+
+    @timed('humidity-regression.train')
+    def train(self, incremental=False, evaluate=False):
+        laps = metrics.laps('humidity-regression.train')
+        # The dataset and settings the model is trained from, recorded along with it
+        sources = training_sources('humidity-regression')
+        X, y = self.training_data()
+        laps.mark('training_data')
+
+        # Initialize and train the Random Forest Regression model, or refresh the trained one with the new readings
+        # for an incremental update
+        self.model, evaluation_rows = fit_forest(self.model, 'humidity_regression_model.pkl', X, y, self.weather_data,
+                                                 incremental)
+        if evaluation_rows is None:
+            print('No new readings since the model was last trained')
+            return
+        laps.mark('fit')
+
+        save_artifact(self.model, 'humidity_regression_model.pkl', sources=sources)
+        record_training('humidity_regression_model.pkl', self.weather_data, evaluation_rows)
+        laps.mark('save')
+
+        if not evaluate:
+            return
+        # Scoring the model's settings on the most recent days with a copy fitted on the days before them, as the model
+        # saved was trained on every row
+        holdout = holdout_predictions(self.model, X, y, date_keys(self.weather_data['Date']))
+        if holdout is None:
+            print('Too few days of readings to hold some out for evaluation')
+            return
+        y, y_pred = holdout
 
         # Calculate evaluation metrics
         mse = mean_squared_error(y, y_pred)  # Mean Squared Error
@@ -43,28 +83,30 @@ class HumidityRegressor:
         print('Root Mean Squared Error (RMSE): %.2f' % rmse)
         print('Mean Absolute Error (MAE): %.2f' % mae)
         print('R^2 Score: %.2f' % r2)
+        laps.mark('evaluate')
 
+    @timed('humidity-regression.predict')
+    @cached_prediction('humidity_regression_model.pkl')
     def predict(self, month=None):
-        self.weather_data['Date'] = pd.to_datetime(self.weather_data['Date'], format='%d-%m-%y', errors='coerce')
+        laps = metrics.laps('humidity-regression.predict')
+
+        # Selecting the 2024 rows of the specific month, if provided, from the feature store
+        rows = feature_store.lookup(int(month) if month else None)
+        laps.mark('lookup')
 
-        # Filter the data for the year 2024
-        weather_data = self.weather_data[self.weather_data['Date'].dt.year == 2024]
-        if month:
-            weather_data = weather_data[weather_data["month"] == month]
         # Selecting the features (X) for the model (without splitting the dataset)
-        X = weather_data[
-            ['airtemperature', 'day', 'hour', 'sensor-location-encoded', 'atmosphericpressure', 'season-encoded']]
+        X = rows.features(HUMIDITY_FEATURES)
 
         # Assuming there is a 'date' column in your dataset, we store it separately
-        dates = weather_data['Date']
+        dates = rows.date_keys
 
-        # Load the trained model
-        current_dir = os.path.dirname(__file__)
-        file_path = os.path.join(current_dir, 'humidity_regression_model.pkl')
-        model = joblib.load(file_path)
+        # Get the trained model from the registry
+        model = load_model('humidity_regression_model.pkl')
+        laps.mark('load_model')
 
         # Make predictions for all entries in the dataset
         predictions = model.predict(X)
+        laps.mark('model_predict')
 
         # Create a DataFrame to store dates and predictions
         result = pd.DataFrame({
@@ -75,39 +117,38 @@ class HumidityRegressor:
         result = result.groupby('Date', as_index=False)['Prediction'].mean()
 
         # Format the Date column to 'dd-mm-yy'
-        result['Date'] = result['Date'].dt.strftime('%d')
+        result['Date'] = day_of_month(result['Date'])
+        laps.mark('aggregate')
 
         # Return the DataFrame with one entry per day (average predicted temperature)
         return result
 
+    @timed('humidity-regression.predict_day')
+    @cached_prediction('humidity_regression_model.pkl')
     def predict_day(self, date="01-01"):
+        laps = metrics.laps('humidity-regression.predict_day')
+
         date = date.split("-")
         month = int(date[1])
         day = int(date[0])
 
-        # Ensure that the Date column is in datetime format
-        self.weather_data['Date'] = pd.to_datetime(self.weather_data['Date'], format='%d-%m-%y', errors='coerce')
-
-        # Filter the data for the year 2024
-        weather_data = self.weather_data[self.weather_data['Date'].dt.year == 2024]
-
-        # Filter the data for a specific month and day provided
-        weather_data = weather_data[(weather_data["month"] == month) & (weather_data["Date"].dt.day == day)]
+        # Selecting the 2024 rows of the specific month and day from the feature store
+        rows = feature_store.lookup(month, day)
+        laps.mark('lookup')
 
         # Selecting the features (X) for the model
-        X = weather_data[
-            ['airtemperature', 'day', 'hour', 'sensor-location-encoded', 'atmosphericpressure', 'season-encoded']]
+        X = rows.features(HUMIDITY_FEATURES)
 
         # Store the Date column
-        hours = weather_data['hour']
+        hours = rows.hours
 
-        # Load the trained model
-        current_dir = os.path.dirname(__file__)
-        file_path = os.path.join(current_dir, 'humidity_regression_model.pkl')
-        model = joblib.load(file_path)
+        # Get the trained model from the registry
+        model = load_model('humidity_regression_model.pkl')
+        laps.mark('load_model')
 
         # Make predictions for all entries in the dataset
         predictions = model.predict(X)
+        laps.mark('model_predict')
 
         # Create a DataFrame to store dates and predictions
         result = pd.DataFrame({
@@ -117,6 +158,7 @@ class HumidityRegressor:
 
         # Group by 'Date' and calculate the average predicted temperature for each day
         result = result.groupby('hour', as_index=False)['Prediction'].mean()
+        laps.mark('aggregate')
 
         # Return the DataFrame with one entry per day (average predicted temperature)
         return result
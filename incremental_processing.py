@@ -0,0 +1,245 @@
+import copy
+import hashlib
+import io
+import joblib
+import pandas as pd
+import os
+from category_encodings import category_encodings
+from columnar_store import append_columnar, dataset_version, load_weather_data
+from data_processing import (ARGYLE_SQUARE_SENSOR_DATA_COLUMNS, ARGYLE_SQUARE_SENSOR_DATA_DTYPES, DEFAULT_CHUNKSIZE,
+                             ENCODED_COLUMNS, MICROCLIMATE_SENSORS_DATA_COLUMNS, MICROCLIMATE_SENSORS_DATA_DTYPES,
+                             PROCESSED_DATA_NAME, PROCESSED_WEATHER_DATA_COLUMNS, WEATHER_DATA_NUMERIC_COLUMNS,
+                             clean_weather_data_chunk, compact_weather_data, encode_weather_data,
+                             parse_timestamps, prepare_argyle_square_sensor_data, prepare_microclimate_sensors_data,
+                             save_processed_data, summarize_weather_statistics)
+from instrumentation import metrics
+from model_registry import record_sources, source_fingerprint
+from streaming_statistics import ColumnStatistics
+from weather_rollup import load_rollup, save_rollup
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# Folder of the state the incremental processing keeps between runs. The rows it processes are appended to the
+# processed data the predictors read.
+PROCESSED_STORE_DIR = os.path.join(current_dir, 'processed_weather_store')
+
+# The raw sources, with the column holding the reading time and the function that prepares a chunk of them
+SENSOR_SOURCES = {
+    'microclimate': {
+        'file': os.path.join(current_dir, "microclimate-sensors-data.csv"),
+        'columns': MICROCLIMATE_SENSORS_DATA_COLUMNS,
+        'dtypes': MICROCLIMATE_SENSORS_DATA_DTYPES,
+        'time_column': 'received_at',
+        'prepare': prepare_microclimate_sensors_data,
+    },
+    'argyle_square': {
+        'file': os.path.join(current_dir, "meshed-sensor-type-1.csv"),
+        'columns': ARGYLE_SQUARE_SENSOR_DATA_COLUMNS,
+        'dtypes': ARGYLE_SQUARE_SENSOR_DATA_DTYPES,
+        'time_column': 'time',
+        'prepare': prepare_argyle_square_sensor_data,
+    },
+}
+
+# The statistics are refreshed once the raw rows seen since the last refresh exceed this fraction of the rows
+# they were computed from
+DEFAULT_STALE_FRACTION = 0.1
+
+# Number of bytes before the stored offset that are hashed to check that a source file was only appended to
+TAIL_CHECK_BYTES = 4096
+
+# Bytes read at a time while looking for the last complete line of a source file
+LINE_SEARCH_BYTES = 65536
+
+
+def new_state():
+    return {
+        'sources': {},  # Byte offset of every source, and a hash of the bytes before it
+        'weather_statistics': {column: ColumnStatistics() for column in WEATHER_DATA_NUMERIC_COLUMNS},
+        'cleaning_statistics': None,
+        'rows_at_refresh': 0,
+        'rows_since_refresh': 0,
+        'dataset': None,  # Version of the processed data the state's rows were last written to
+    }
+
+
+def load_state(store_dir=PROCESSED_STORE_DIR):
+    state_file = os.path.join(store_dir, 'state.pkl')
+    if os.path.exists(state_file):
+        return joblib.load(state_file)
+    return new_state()
+
+
+def save_state(state, store_dir=PROCESSED_STORE_DIR):
+    # Writing to a temporary file first so a crash never leaves a half written state behind
+    state_file = os.path.join(store_dir, 'state.pkl')
+    joblib.dump(state, state_file + '.tmp')
+    os.replace(state_file + '.tmp', state_file)
+
+
+def hash_bytes_before(file_path, offset):
+    with open(file_path, 'rb') as file:
+        file.seek(max(0, offset - TAIL_CHECK_BYTES))
+        return hashlib.sha1(file.read(min(offset, TAIL_CHECK_BYTES))).hexdigest()
+
+
+def complete_lines_end(file_path):
+    # Byte offset just past the last newline of the file. A writer appending to the file may be in the middle of a
+    # line, which is left for the next run.
+    with open(file_path, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - LINE_SEARCH_BYTES)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+class ByteRange(io.RawIOBase):
+    # The bytes of an open file up to a given offset, so rows appended while the file is read are not seen
+    def __init__(self, file, end):
+        self.file = file
+        self.end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = max(0, min(len(buffer), self.end - self.file.tell()))
+        data = self.file.read(size)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def appended_only(source, source_state, end):
+    # Whether the source file was only appended to since its rows up to the stored offset were processed
+    offset = source_state.get('offset', 0)
+    return (offset and end >= offset
+            and source_state.get('tail_hash') == hash_bytes_before(source['file'], offset))
+
+
+def read_new_rows(source, source_state, chunksize, end):
+    # Yields the rows of a source after its stored byte offset, chunk by chunk, reading the file only up to the end
+    # byte offset. Every row past the offset is new whatever its reading time, so late readings are kept too. Rows
+    # without a valid reading time are dropped.
+    file_path = source['file']
+    header = pd.read_csv(file_path, nrows=0).columns
+    read_options = {'usecols': source['columns'], 'dtype': source['dtypes'], 'chunksize': chunksize}
+
+    offset = source_state.get('offset', 0)
+    with open(file_path, 'rb') as file:
+        if offset:
+            file.seek(offset)
+            if offset == end:
+                return
+            reader = pd.read_csv(io.BufferedReader(ByteRange(file, end)), header=None, names=header,
+                                 **read_options)
+        else:
+            reader = pd.read_csv(io.BufferedReader(ByteRange(file, end)), **read_options)
+
+        for chunk in reader:
+            chunk = chunk[parse_timestamps(chunk[source['time_column']]).notna()]
+            if len(chunk):
+                yield chunk
+
+
+def append_rows(frames):
+    # The processed rows of the frames one after the other. The categorical columns are put back on the shared
+    # encodings, which the later rows may have added categories to.
+    weather_data = pd.concat([frame[PROCESSED_WEATHER_DATA_COLUMNS] for frame in frames], ignore_index=True)
+    return weather_data.astype({column: pd.CategoricalDtype(category_encodings.categories(column))
+                                for column in ENCODED_COLUMNS})
+
+
+def process_new_data(store_dir=PROCESSED_STORE_DIR, stale_fraction=DEFAULT_STALE_FRACTION,
+                     chunksize=DEFAULT_CHUNKSIZE):
+    # Processes only the raw rows appended since the last run and appends them to the processed data the predictors
+    # read. Returns the number of rows appended.
+    laps = metrics.laps('process_new_data')
+    os.makedirs(store_dir, exist_ok=True)
+    state = load_state(store_dir)
+
+    # Both passes read every source up to the end of its last complete line at this point, so rows appended meanwhile
+    # are neither missed by the statistics nor skipped by the next run. The fingerprint is taken first, so a file
+    # appended to meanwhile no longer matches the one recorded with the processed data.
+    raw_data_sources = source_fingerprint([source['file'] for source in SENSOR_SOURCES.values()])
+    ends = {name: complete_lines_end(source['file']) for name, source in SENSOR_SOURCES.items()}
+
+    # When the processed data was rewritten since the state's rows were written to it, e.g. by a full processing, or a
+    # source was changed other than by appending to it, the rows the processed data holds are not known. Every source
+    # is then processed again from the top, into processed data of its own.
+    if state.get('dataset') is None or state['dataset'] != dataset_version() or not all(
+            appended_only(source, state['sources'].get(name, {}), ends[name])
+            for name, source in SENSOR_SOURCES.items()):
+        state = new_state()
+
+    # First pass over the new rows: updating the accumulated statistics
+    new_row_count = 0
+    for name, source in SENSOR_SOURCES.items():
+        source_state = state['sources'].get(name, {})
+        for chunk in read_new_rows(source, source_state, chunksize, ends[name]):
+            chunk = chunk.rename(columns={'airtemp': 'airtemperature'})
+            for column in WEATHER_DATA_NUMERIC_COLUMNS:
+                state['weather_statistics'][column].update(chunk[column])
+            new_row_count += len(chunk)
+    laps.mark('statistics')
+
+    # Refreshing the imputation means and outlier bounds only once they are stale
+    state['rows_since_refresh'] += new_row_count
+    if new_row_count and (state['cleaning_statistics'] is None
+                          or state['rows_since_refresh'] > stale_fraction * state['rows_at_refresh']):
+        state['cleaning_statistics'] = summarize_weather_statistics(state['weather_statistics'])
+        state['rows_at_refresh'] += state['rows_since_refresh']
+        state['rows_since_refresh'] = 0
+
+    # Second pass: cleaning the new rows with the current statistics. The offsets move past the bytes read even when
+    # they held no valid rows, so they are not read again by the next run.
+    cleaned_chunks = []
+    for name, source in SENSOR_SOURCES.items():
+        source_state = state['sources'].get(name, {})
+        if new_row_count:
+            for chunk in read_new_rows(source, source_state, chunksize, ends[name]):
+                weather_data = clean_weather_data_chunk(source['prepare'](chunk), state['cleaning_statistics'])
+                # The shared category encodings give the new rows the same codes as the rows already processed
+                weather_data = compact_weather_data(encode_weather_data(weather_data))
+                if len(weather_data):
+                    cleaned_chunks.append(weather_data[PROCESSED_WEATHER_DATA_COLUMNS])
+        state['sources'][name] = {'offset': ends[name], 'tail_hash': hash_bytes_before(source['file'], ends[name])}
+    laps.mark('clean')
+
+    # Appending them to the processed data and recording the version written. A crash before the state is saved
+    # leaves a version the state does not know, so the next run starts over.
+    appended_rows = sum(len(rows) for rows in cleaned_chunks)
+    if state['dataset'] is None:
+        # Processed from the top, the rows make up the processed data of their own, which is empty without any
+        save_processed_data(append_rows(cleaned_chunks or [compact_weather_data(
+            pd.DataFrame(columns=PROCESSED_WEATHER_DATA_COLUMNS))]), raw_data_sources, laps)
+        state['dataset'] = dataset_version()
+    elif not cleaned_chunks:
+        # The processed data is unchanged, and holds every valid row of the raw files as they are now
+        record_sources(PROCESSED_DATA_NAME, raw_data_sources)
+    else:
+        # The rollup of the processed data is taken before the data changes, as it is checked against the version it
+        # summarizes. A copy of it gets the new rows added once they are in the data, as the one loaded is the one the
+        # statistics are served from until the new rollup is saved.
+        new_weather_data = append_rows(cleaned_chunks)
+        rollup = copy.deepcopy(load_rollup())
+        if append_columnar(new_weather_data):
+            # Only the year/month partitions of the new rows were written
+            laps.mark('append_columnar')
+            save_rollup(rollup.update(new_weather_data), raw_data_sources)
+            laps.mark('rollup')
+            record_sources(PROCESSED_DATA_NAME, raw_data_sources)
+        else:
+            # The store cannot take the rows as they are, so the whole processed data is saved again
+            save_processed_data(append_rows([load_weather_data(), new_weather_data]), raw_data_sources, laps,
+                                rollup.update(new_weather_data))
+        state['dataset'] = dataset_version()
+    save_state(state, store_dir)
+    return appended_rows
+
+
+if __name__ == '__main__':
+    print(f"Appended {process_new_data()} new rows to the processed data")
@@ -0,0 +1,201 @@
+import argparse
+import importlib
+import joblib
+import json
+import os
+import time
+import numpy as np
+from sklearn.base import clone
+from sklearn.preprocessing import StandardScaler
+from columnar_store import load_weather_data
+from date_index import date_keys
+from model_tuning import DEFAULT_VALIDATION_FRACTION, time_split
+from training_orchestrator import MODEL_CLASSES
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Share of a forest's trees an incremental update replaces: the oldest ones are retired and as many new ones are grown
+# on the current data, so a refresh costs about this fraction of a full fit and the forest is renewed completely
+# after 1 / DEFAULT_REFRESH_FRACTION refreshes
+DEFAULT_REFRESH_FRACTION = 0.1
+
+# Hours of readings the accuracy comparison feeds to the incremental model one refresh at a time
+DEFAULT_REFRESHES = 12
+
+# Forest parameters that only change how a forest is fitted, not the trees it grows
+RUNTIME_PARAMETERS = {'n_jobs', 'verbose', 'warm_start'}
+
+
+def training_state_file_name(model_file):
+    return model_file + '.training.json'
+
+
+def load_training_state(model_file):
+    # The number of refreshes since the model's last full fit and the watermark of the newest reading it was trained
+    # on, or None when it was not trained since incremental training was added
+    state_path = os.path.join(current_dir, training_state_file_name(model_file))
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path) as state_file:
+        return json.load(state_file)
+
+
+def row_watermarks(weather_data):
+    # yyyymmddhh keys of the readings, which only grow as new readings arrive
+    return date_keys(weather_data['Date']) * 100 + weather_data['hour'].to_numpy(dtype=np.int64)
+
+
+def record_training(model_file, weather_data, evaluation_rows):
+    # Saving the state the next incremental update starts from, once the model is saved. A model evaluated on all of
+    # its rows was fitted from scratch, one evaluated on the new rows only was refreshed.
+    state = load_training_state(model_file) or {'refreshes': 0}
+    refreshed = not isinstance(evaluation_rows, slice)
+    state = {'refreshes': state['refreshes'] + 1 if refreshed else 0,
+             'watermark': int(row_watermarks(weather_data).max()), 'rows': len(weather_data)}
+    state_path = os.path.join(current_dir, training_state_file_name(model_file))
+    with open(state_path + '.tmp', 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def same_forest_settings(trained_model, model):
+    # Whether the trained forest grows its trees with the settings the model has now, e.g. after tuning changed them
+    def settings(forest):
+        return {key: value for key, value in forest.get_params().items() if key not in RUNTIME_PARAMETERS}
+    return type(trained_model) is type(model) and settings(trained_model) == settings(model)
+
+
+def refresh_forest(model, X, y, refresh_fraction=DEFAULT_REFRESH_FRACTION, seed=None):
+    # Grows new trees on X, y with warm_start and retires as many of the oldest ones, in place. Returns the model, or
+    # None when the classes of a classifier changed, as trees of different classes cannot vote together.
+    if hasattr(model, 'classes_') and not np.array_equal(np.unique(np.asarray(y)), model.classes_):
+        return None
+    trees = len(model.estimators_)
+    retired = max(1, round(trees * refresh_fraction))
+    random_state = model.random_state
+    # Each refresh draws the seeds of its trees from its own random state, so they differ from the retired ones
+    model.set_params(warm_start=True, n_estimators=trees + retired, random_state=seed)
+    try:
+        model.fit(X, y)
+    finally:
+        model.set_params(warm_start=False, n_estimators=trees, random_state=random_state)
+    del model.estimators_[:len(model.estimators_) - trees]
+    return model
+
+
+def fit_forest(model, model_file, X, y, weather_data, incremental=False, refresh_fraction=DEFAULT_REFRESH_FRACTION):
+    # Fits the model from scratch, or, with incremental, refreshes the trained model saved under model_file instead.
+    # Returns the fitted model and the rows to evaluate it on: all of them after a full fit, the readings that are new
+    # since the model was last trained after a refresh, and None, without fitting anything, when there are none. A
+    # model without training state, whose forest settings changed since it was trained or whose classes changed, is
+    # fitted from scratch.
+    state = load_training_state(model_file) if incremental else None
+    model_path = os.path.join(current_dir, model_file)
+    if state is not None and os.path.exists(model_path):
+        new_rows = np.flatnonzero(row_watermarks(weather_data) > state['watermark'])
+        if not len(new_rows):
+            return model, None
+        # A copy of the trained model is refreshed, never the one the registry serves predictions from
+        trained_model = joblib.load(model_path)
+        if same_forest_settings(trained_model, model):
+            # The new trees are grown with the cores the model was given for this training
+            trained_model.set_params(n_jobs=model.n_jobs)
+            seed = None if trained_model.random_state is None else trained_model.random_state + state['refreshes'] + 1
+            if refresh_forest(trained_model, X, y, refresh_fraction, seed) is not None:
+                return trained_model, new_rows
+    model.fit(X, y)
+    return model, slice(None)
+
+
+def evaluate_incremental(name, weather_data, refreshes=DEFAULT_REFRESHES, holdout_fraction=DEFAULT_VALIDATION_FRACTION,
+                         refresh_fraction=DEFAULT_REFRESH_FRACTION):
+    # Compares hourly incremental updates with a full refit on a time based holdout. A model fitted on the readings
+    # before the last hours of the training period gets one refresh per hour of them, and is scored on the held out
+    # days along with a model refitted on the whole training period and the model before any refresh.
+    module_name, class_name = MODEL_CLASSES[name]
+    predictor = getattr(importlib.import_module(module_name), class_name)()
+    predictor.weather_data = weather_data
+    X, y = predictor.training_data()
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+
+    train_rows, holdout_rows, holdout_start = time_split(date_keys(weather_data['Date']), holdout_fraction)
+    watermarks = row_watermarks(weather_data)[train_rows]
+    hours = np.unique(watermarks)[-refreshes:]
+    base_rows = train_rows[watermarks < hours[0]]
+
+    # The classifiers keep the scaler of their last full fit through the refreshes, as train() does
+    def scaler_for(rows):
+        return StandardScaler().fit(X[rows]) if name.endswith('classification') else None
+
+    def features(scaler, rows):
+        return scaler.transform(X[rows]) if scaler else X[rows]
+
+    scaler = scaler_for(base_rows)
+    model = clone(predictor.model)
+    start = time.perf_counter()
+    model.fit(features(scaler, base_rows), y[base_rows])
+    base_fit_seconds = time.perf_counter() - start
+    stale_score = model.score(features(scaler, holdout_rows), y[holdout_rows])
+
+    refresh_seconds = []
+    full_refits = 0
+    for refresh, hour in enumerate(hours):
+        rows = train_rows[watermarks <= hour]
+        seed = None if model.random_state is None else model.random_state + refresh + 1
+        start = time.perf_counter()
+        if refresh_forest(model, features(scaler, rows), y[rows], refresh_fraction, seed) is None:
+            scaler = scaler_for(rows)
+            model = clone(predictor.model).fit(features(scaler, rows), y[rows])
+            full_refits += 1
+        refresh_seconds.append(time.perf_counter() - start)
+    incremental_score = model.score(features(scaler, holdout_rows), y[holdout_rows])
+
+    full_scaler = scaler_for(train_rows)
+    full_model = clone(predictor.model)
+    start = time.perf_counter()
+    full_model.fit(features(full_scaler, train_rows), y[train_rows])
+    full_fit_seconds = time.perf_counter() - start
+    full_score = full_model.score(features(full_scaler, holdout_rows), y[holdout_rows])
+
+    return {
+        'metric': 'accuracy' if name.endswith('classification') else 'r2',
+        'holdout_start': holdout_start,
+        'holdout_rows': len(holdout_rows),
+        'refreshes': len(hours),
+        'refresh_fraction': refresh_fraction,
+        'full_refits': full_refits,
+        'stale_score': stale_score,
+        'incremental_score': incremental_score,
+        'full_refit_score': full_score,
+        'base_fit_seconds': base_fit_seconds,
+        'refresh_seconds': float(np.mean(refresh_seconds)),
+        'full_fit_seconds': full_fit_seconds,
+        'refresh_cost': float(np.mean(refresh_seconds)) / full_fit_seconds,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare hourly incremental model updates with full refits')
+    parser.add_argument('--refreshes', type=int, default=DEFAULT_REFRESHES, help='hours of readings fed one at a time')
+    parser.add_argument('--holdout-fraction', type=float, default=DEFAULT_VALIDATION_FRACTION,
+                        help='fraction of the most recent rows held out for scoring')
+    parser.add_argument('--refresh-fraction', type=float, default=DEFAULT_REFRESH_FRACTION,
+                        help='share of the trees replaced by every refresh')
+    parser.add_argument('--output', help='JSON file to write the report to')
+    parser.add_argument('models', nargs='*', metavar='model',
+                        help=f"models to compare, all by default: {', '.join(MODEL_CLASSES)}")
+    args = parser.parse_args()
+
+    weather_data = load_weather_data()
+    report = {}
+    for name in args.models or MODEL_CLASSES:
+        report[name] = result = evaluate_incremental(name, weather_data, args.refreshes, args.holdout_fraction,
+                                                     args.refresh_fraction)
+        print(f"{name}: holdout {result['metric']} {result['incremental_score']:.4f} after {result['refreshes']} "
+              f"refreshes, {result['full_refit_score']:.4f} refitted, {result['stale_score']:.4f} without refreshing")
+        print(f"  refresh {result['refresh_seconds']:.2f}s, full fit {result['full_fit_seconds']:.2f}s "
+              f"({result['refresh_cost']:.0%} of a full fit)")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
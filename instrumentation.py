@@ -0,0 +1,221 @@
+import atexit
+import bisect
+import collections
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Timing spans are recorded unless WEATHER_METRICS=0. Disabled spans cost one attribute check.
+METRICS_ENABLED = os.environ.get('WEATHER_METRICS', '1') != '0'
+
+# The sampling profiler is off unless WEATHER_PROFILER_INTERVAL gives the seconds between samples. Its folded stacks
+# are written to WEATHER_PROFILE_FILE when the process exits, and the span histograms to WEATHER_METRICS_FILE if set.
+PROFILER_INTERVAL = float(os.environ.get('WEATHER_PROFILER_INTERVAL', '0'))
+PROFILE_FILE = os.environ.get('WEATHER_PROFILE_FILE', os.path.join(current_dir, 'weather_profile.folded'))
+METRICS_FILE = os.environ.get('WEATHER_METRICS_FILE')
+
+# Upper bounds, in seconds, of the histogram buckets the spans are counted in
+HISTOGRAM_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                     5.0, 10.0, 30.0, 60.0, 300.0, float('inf'))
+
+
+class Histogram:
+    # Counts of a span's durations per bucket, along with their total, minimum and maximum
+    def __init__(self):
+        self.counts = [0] * len(HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float('inf')
+        self.maximum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.minimum = min(self.minimum, seconds)
+        self.maximum = max(self.maximum, seconds)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile, capped by the longest duration seen
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.minimum if self.count else 0.0,
+            'max': self.maximum,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': {str(bound): count for bound, count in zip(HISTOGRAM_BUCKETS, self.counts)},
+        }
+
+
+class Laps:
+    # Records the time since the previous mark, or since the laps started, as the span of the stage just finished
+    __slots__ = ('metrics', 'prefix', 'last')
+
+    def __init__(self, metrics, prefix):
+        self.metrics = metrics
+        self.prefix = prefix
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.metrics.observe(f'{self.prefix}.{stage}', now - self.last)
+        self.last = now
+
+
+class NoLaps:
+    # Handed out instead of Laps while the metrics are disabled
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+
+NO_LAPS = NoLaps()
+
+
+class Metrics:
+    # Histograms of the timing spans, by name. Stages of the same operation share its name as a prefix, such as
+    # 'temperature-classification.predict.load_model' within 'temperature-classification.predict'.
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def laps(self, prefix):
+        return Laps(self, prefix) if self.enabled else NO_LAPS
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())}
+
+    def prometheus(self):
+        # The histograms in the Prometheus text format, with the span name as a label
+        lines = ['# TYPE weather_span_seconds histogram']
+        for name, snapshot in self.snapshot().items():
+            cumulative = 0
+            for bound, count in snapshot['buckets'].items():
+                cumulative += count
+                bound = '+Inf' if bound == 'inf' else bound
+                lines.append(f'weather_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'weather_span_seconds_sum{{span="{name}"}} {snapshot["sum"]}')
+            lines.append(f'weather_span_seconds_count{{span="{name}"}} {snapshot["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, metrics_file):
+        with open(metrics_file, 'w') as output:
+            json.dump(self.snapshot(), output, indent=2)
+
+
+# Spans shared by everything in the process
+metrics = Metrics()
+
+
+def timed(name):
+    # Records every call of the decorated function as a span, including the calls that raise
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class SamplingProfiler:
+    # Samples the Python stacks of every other thread from a background thread and counts them as folded stacks, the
+    # input format of flame graph tools
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, interval=None):
+        if self.running:
+            return
+        self.interval = interval or self.interval
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.sample, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def sample(self):
+        own_thread = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def write(self, profile_file):
+        with open(profile_file, 'w') as output:
+            output.write(self.folded())
+
+
+# Profiler shared by everything in the process, started right away when an interval is configured
+profiler = SamplingProfiler()
+
+
+def write_on_exit():
+    if profiler.running:
+        profiler.stop()
+        profiler.write(PROFILE_FILE)
+    if METRICS_FILE:
+        metrics.write(METRICS_FILE)
+
+
+if PROFILER_INTERVAL > 0:
+    profiler.start(PROFILER_INTERVAL)
+atexit.register(write_on_exit)
@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import pandas as pd
+from benchmark import latency_summary
+from prediction_service import DEFAULT_MAX_QUEUE, PredictionService
+from training_orchestrator import MODEL_CLASSES
+
+
+def dashboard_views(count, day_fraction=0.5, popular_months=(1, 7, 12), seed=0):
+    # Views opened by the simulated users: half of them a month, most often one of a few popular months, the other
+    # half a day of 2024. Each view asks all four models for the same month or day, as the dashboard does.
+    rng = np.random.default_rng(seed)
+    days = pd.date_range('2024-01-01', '2024-12-31').strftime('%d-%m')
+    views = []
+    for _ in range(count):
+        if rng.random() < day_fraction:
+            views.append(('predict_day', days[rng.integers(len(days))]))
+        elif rng.random() < 0.5:
+            views.append(('predict', str(rng.choice(popular_months))))
+        else:
+            views.append(('predict', str(rng.integers(1, 13))))
+    return views
+
+
+async def http_request(host, port, name, method, argument):
+    # One POST over its own connection, returning the status code
+    path = f'/prediction/{name}/day-hourly' if method == 'predict_day' else f'/prediction/{name}/monthly'
+    body = json.dumps({'date': argument} if method == 'predict_day' else {'month': argument}).encode()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write((f'POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                      f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n').encode() + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        await reader.read()
+        return status
+    finally:
+        writer.close()
+
+
+async def run_load_test(views, users, request):
+    # Every user opens the views handed to it one after another, with the four requests of a view in flight together.
+    # Returns the latency of every request and the counts of the status codes.
+    latencies = []
+    statuses = {}
+    queue = asyncio.Queue()
+    for view in views:
+        queue.put_nowait(view)
+
+    async def timed_request(name, method, argument):
+        start = time.perf_counter()
+        status = await request(name, method, argument)
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    async def user():
+        while not queue.empty():
+            method, argument = queue.get_nowait()
+            await asyncio.gather(*(timed_request(name, method, argument) for name in MODEL_CLASSES))
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    return latencies, statuses
+
+
+async def load_test(views, users, host=None, port=8000, workers=None, max_queue=DEFAULT_MAX_QUEUE, processes=False):
+    # Against the server at host:port, or, without a host, against a service running in this process
+    service = None
+    if host:
+        async def request(name, method, argument):
+            return await http_request(host, port, name, method, argument)
+    else:
+        service = PredictionService(workers, max_queue, processes)
+        service.warm_up()
+
+        async def request(name, method, argument):
+            try:
+                await service.request(name, method, argument)
+                return 200
+            except Exception as error:
+                return type(error).__name__
+
+    start = time.perf_counter()
+    try:
+        latencies, statuses = await run_load_test(views, users, request)
+    finally:
+        if service:
+            service.close()
+    report = latency_summary(latencies)
+    report['throughput_per_second'] = len(latencies) / (time.perf_counter() - start)
+    report['users'] = users
+    report['statuses'] = {str(status): count for status, count in statuses.items()}
+    if service:
+        report['service'] = dict(service.stats)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the prediction service with concurrent dashboard views')
+    parser.add_argument('--views', type=int, default=200, help='dashboard views opened in total')
+    parser.add_argument('--users', type=int, default=8, help='users opening views at the same time')
+    parser.add_argument('--day-fraction', type=float, default=0.5, help='fraction of the views showing a day')
+    parser.add_argument('--host', help='server to test, e.g. 127.0.0.1; a service in this process by default')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help='workers of the in-process service')
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE, help='queue limit of the in-process service')
+    parser.add_argument('--processes', action='store_true', help='run the in-process service with worker processes')
+    parser.add_argument('--output', help='JSON file to write the report to')
+    args = parser.parse_args()
+
+    report = asyncio.run(load_test(dashboard_views(args.views, args.day_fraction), args.users, args.host, args.port,
+                                   args.workers, args.max_queue, args.processes))
+    print(f"{report['requests']} requests from {args.users} users: {report['throughput_per_second']:.1f} requests/s")
+    print(f"Latency p50 {report['p50_ms']:.1f} ms, p95 {report['p95_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms")
+    print(f"Statuses: {report['statuses']}")
+    if 'service' in report:
+        print(f"Service: {report['service']}")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
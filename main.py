@@ -0,0 +1,20 @@
+import argparse
+import asyncio
+import startup
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the weather predictions, building whatever is missing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help='predictions computed at once, one per core by default')
+    args = parser.parse_args()
+
+    # The imports are timed as the first phases of the startup report
+    startup_report = startup.StartupReport()
+    startup.import_modules(startup_report)
+    from prediction_service import serve
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, startup_report=startup_report))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,120 @@
+import joblib
+import json
+import os
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def file_signature(file_path):
+    # Modification time, size and inode of a file, which change whenever the file is rewritten or replaced
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def artifact_version(file_name):
+    # Signature of the artifact currently on disk, or None when it has not been written yet
+    file_path = os.path.join(current_dir, file_name)
+    return file_signature(file_path) if os.path.exists(file_path) else None
+
+
+def source_fingerprint(file_names):
+    # Size and modification time of every source file, None for the missing ones. The files are given relative to
+    # this folder or as absolute paths, and keyed by their path relative to this folder either way, so the same file
+    # always gets the same key.
+    fingerprint = {}
+    for file_name in file_names:
+        file_path = os.path.join(current_dir, file_name)
+        fingerprint[os.path.relpath(file_path, current_dir)] = (
+            list(file_signature(file_path)[:2]) if os.path.exists(file_path) else None)
+    return fingerprint
+
+
+def sources_file_name(file_name):
+    # Every artifact's sources are kept in a file of their own, so processes saving different artifacts at the same
+    # time never overwrite each other's
+    return file_name + '.sources.json'
+
+
+def recorded_sources(file_name):
+    # The sources the artifact was last built from, or None when they were never recorded
+    sources_path = os.path.join(current_dir, sources_file_name(file_name))
+    if not os.path.exists(sources_path):
+        return None
+    with open(sources_path) as sources_file:
+        return json.load(sources_file)
+
+
+def record_sources(file_name, sources):
+    sources_path = os.path.join(current_dir, sources_file_name(file_name))
+    with open(sources_path + '.tmp', 'w') as sources_file:
+        json.dump(sources, sources_file, indent=2)
+    os.replace(sources_path + '.tmp', sources_path)
+
+
+def sources_unchanged(file_name, sources):
+    # Whether the artifact exists and was built from these sources. They are compared after a JSON round trip, as
+    # they were recorded.
+    return artifact_version(file_name) is not None and recorded_sources(file_name) == json.loads(json.dumps(sources))
+
+
+def save_artifact(artifact, file_name, compress=0, sources=None):
+    # Dumping to a temporary file and renaming it over the old artifact, so a reader never loads a half written file.
+    # The sources the artifact was built from, when given, are recorded once it is in place.
+    file_path = os.path.join(current_dir, file_name)
+    joblib.dump(artifact, file_path + '.tmp', compress=compress)
+    os.replace(file_path + '.tmp', file_path)
+    if sources is not None:
+        record_sources(file_name, sources)
+
+
+class ModelRegistry:
+    # Keeps every model and scaler artifact resident after its first load. Each lookup compares the file's
+    # modification time, size and inode with the loaded copy and reloads it when the file was replaced, e.g. by train().
+    def __init__(self):
+        self.artifacts = {}
+        self.lock = threading.Lock()
+
+    def get(self, file_name):
+        file_path = os.path.join(current_dir, file_name)
+        signature = file_signature(file_path)
+
+        entry = self.artifacts.get(file_name)
+        if entry is not None and entry['signature'] == signature:
+            return entry['artifact']
+
+        with self.lock:
+            # Another thread may have reloaded the artifact while this one was waiting
+            entry = self.artifacts.get(file_name)
+            if entry is not None and entry['signature'] == signature:
+                return entry['artifact']
+
+            start = time.perf_counter()
+            artifact = joblib.load(file_path)
+            load_seconds = time.perf_counter() - start
+
+            # Swapping the whole entry in one assignment, so readers see either the old artifact or the new one
+            self.artifacts[file_name] = {
+                'artifact': artifact,
+                'signature': signature,
+                'size_bytes': signature[1],
+                'load_seconds': load_seconds,
+                'loaded_at': time.time(),
+                'loads': (entry['loads'] if entry else 0) + 1,
+            }
+            return artifact
+
+    def version(self, file_name):
+        # The signature of the loaded copy, which changes whenever the artifact is reloaded
+        entry = self.artifacts.get(file_name)
+        return entry['signature'] if entry else None
+
+    def metrics(self):
+        # Load time, size and number of loads of every resident artifact
+        return {file_name: {key: value for key, value in entry.items() if key not in ('artifact', 'signature')}
+                for file_name, entry in self.artifacts.items()}
+
+
+# Registry shared by all the predictors of the process
+model_registry = ModelRegistry()
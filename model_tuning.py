@@ -0,0 +1,192 @@
+import argparse
+import importlib
+import math
+import os
+import time
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid
+from sklearn.preprocessing import StandardScaler
+from columnar_store import dataset_version, load_weather_data
+from date_index import date_keys
+from model_registry import artifact_version, model_registry, save_artifact
+from training_orchestrator import MODEL_CLASSES
+
+# Forest settings searched for every model
+SEARCH_SPACE = {
+    'n_estimators': [25, 50, 100, 200],
+    'max_depth': [10, 20, 30, None],
+    'min_samples_leaf': [1, 2, 5, 10],
+}
+
+# Fraction of the rows, the most recent ones, held out to validate the candidates on
+DEFAULT_VALIDATION_FRACTION = 0.2
+
+# Validation score (R^2 for the regressors, accuracy for the classifiers) a model may lose against the best candidate
+# and still be picked for being smaller
+DEFAULT_TOLERANCE = 0.005
+
+# Each round of successive halving keeps 1 / ELIMINATION_FACTOR of the candidates and trains them on
+# ELIMINATION_FACTOR times more rows
+ELIMINATION_FACTOR = 3
+MIN_TRAINING_ROWS = 1000
+
+
+def tuning_file_name(name):
+    return f"tuning_{name.replace('-', '_')}.pkl"
+
+
+def tuned_parameters(name):
+    # The forest settings picked for the model by the last tuning run, or none when it has not been tuned
+    tuning_file = tuning_file_name(name)
+    if artifact_version(tuning_file) is None:
+        return {}
+    return dict(model_registry.get(tuning_file)['parameters'])
+
+
+def training_sources(name):
+    # What the model is trained from: the processed dataset and the forest settings picked for it
+    return {'dataset': dataset_version(), 'parameters': tuned_parameters(name)}
+
+
+def time_split(keys, validation_fraction=DEFAULT_VALIDATION_FRACTION):
+    # Rows before and from the first validation date, so that all the rows of a day land on the same side and the
+    # models are validated on days after the ones they were trained on
+    validation_start = int(np.quantile(keys, 1 - validation_fraction, method='higher'))
+    validation = keys >= validation_start
+    return np.flatnonzero(~validation), np.flatnonzero(validation), validation_start
+
+
+def holdout_predictions(estimator, X, y, keys, scale=False, validation_fraction=DEFAULT_VALIDATION_FRACTION):
+    # Fits a copy of the estimator on the rows before the time based holdout and predicts the holdout with it, so it is
+    # scored on days it has not seen. The features are scaled, for the classifiers, with a scaler fitted on the same
+    # rows as the copy. Returns the holdout's targets and predictions, or None when all the rows are of a single day.
+    train_rows, holdout_rows, _ = time_split(keys, validation_fraction)
+    if not len(train_rows):
+        return None
+    X_train, X_holdout = X.iloc[train_rows], X.iloc[holdout_rows]
+    if scale:
+        scaler = StandardScaler().fit(X_train)
+        X_train, X_holdout = scaler.transform(X_train), scaler.transform(X_holdout)
+    model = clone(estimator).fit(X_train, y.iloc[train_rows])
+    return y.iloc[holdout_rows], model.predict(X_holdout)
+
+
+def evaluate_candidate(estimator, parameters, scale, X_train, y_train, X_validation, y_validation):
+    # Trains one candidate and scores it on the validation rows, along with its size and prediction time
+    if scale:
+        scaler = StandardScaler()
+        X_train = scaler.fit_transform(X_train)
+        X_validation = scaler.transform(X_validation)
+    model = clone(estimator).set_params(n_jobs=1, **parameters)
+
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    score = model.score(X_validation, y_validation)
+    predict_seconds = time.perf_counter() - start
+
+    return {
+        'parameters': parameters,
+        'score': score,
+        'nodes': sum(tree.tree_.node_count for tree in model.estimators_),
+        'fit_seconds': fit_seconds,
+        'predict_seconds': predict_seconds,
+    }
+
+
+def successive_halving(estimator, candidates, scale, X_train, y_train, X_validation, y_validation,
+                       n_jobs=None, random_state=42):
+    # Every round trains the remaining candidates in parallel on a larger sample of the training rows and keeps the
+    # best scoring ones, until the last round trains the survivors on all the rows. Returns the results of the last
+    # round and of every evaluation made.
+    rounds = max(1, math.ceil(math.log(len(candidates), ELIMINATION_FACTOR)))
+    row_order = np.random.default_rng(random_state).permutation(len(X_train))
+    history = []
+    for round_number in range(rounds):
+        rows = len(X_train) // ELIMINATION_FACTOR ** (rounds - 1 - round_number)
+        sample = np.sort(row_order[:min(len(X_train), max(MIN_TRAINING_ROWS, rows))])
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(evaluate_candidate)(estimator, parameters, scale, X_train[sample], y_train[sample],
+                                        X_validation, y_validation)
+            for parameters in candidates)
+        history.extend(dict(result, round=round_number, rows=len(sample)) for result in results)
+
+        if round_number < rounds - 1:
+            results.sort(key=lambda result: result['score'], reverse=True)
+            candidates = [result['parameters'] for result in results[:math.ceil(len(results) / ELIMINATION_FACTOR)]]
+    return results, history
+
+
+def select_candidate(results, tolerance=DEFAULT_TOLERANCE):
+    # The smallest, then fastest, candidate scoring within the tolerance of the best one
+    best_score = max(result['score'] for result in results)
+    eligible = [result for result in results if result['score'] >= best_score - tolerance]
+    return min(eligible, key=lambda result: (result['nodes'], result['predict_seconds'])), best_score
+
+
+def tune_model(name, weather_data, search_space=SEARCH_SPACE, validation_fraction=DEFAULT_VALIDATION_FRACTION,
+               tolerance=DEFAULT_TOLERANCE, n_jobs=None):
+    # Searches the forest settings of one model on a time based holdout and saves the ones picked next to its
+    # artifacts, where the model's constructor picks them up for the next train()
+    module_name, class_name = MODEL_CLASSES[name]
+    predictor = getattr(importlib.import_module(module_name), class_name)()
+    predictor.weather_data = weather_data
+    X, y = predictor.training_data()
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+
+    train_rows, validation_rows, validation_start = time_split(date_keys(weather_data['Date']), validation_fraction)
+    # The classifiers scale their features, so their candidates are scaled on the training rows as well
+    scale = name.endswith('classification')
+    results, history = successive_halving(predictor.model, list(ParameterGrid(search_space)), scale,
+                                          X[train_rows], y[train_rows], X[validation_rows], y[validation_rows],
+                                          n_jobs)
+    selected, best_score = select_candidate(results, tolerance)
+
+    settings = {
+        'parameters': selected['parameters'],
+        'score': selected['score'],
+        'best_score': best_score,
+        'tolerance': tolerance,
+        'nodes': selected['nodes'],
+        'validation_start': validation_start,
+        'training_rows': len(train_rows),
+        'validation_rows': len(validation_rows),
+        'history': history,
+    }
+    save_artifact(settings, tuning_file_name(name))
+    return settings
+
+
+def tune_models(names=None, validation_fraction=DEFAULT_VALIDATION_FRACTION, tolerance=DEFAULT_TOLERANCE,
+                n_jobs=None):
+    names = list(names or MODEL_CLASSES)
+    for name in names:
+        if name not in MODEL_CLASSES:
+            raise ValueError(f"Unknown model {name!r}, expected one of {', '.join(MODEL_CLASSES)}")
+    weather_data = load_weather_data()
+    return {name: tune_model(name, weather_data, SEARCH_SPACE, validation_fraction, tolerance, n_jobs)
+            for name in names}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune the forest settings of the temperature and humidity models')
+    parser.add_argument('--validation-fraction', type=float, default=DEFAULT_VALIDATION_FRACTION,
+                        help='fraction of the most recent rows held out for validation')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='validation score a smaller model may lose against the best one')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='candidates trained in parallel')
+    parser.add_argument('models', nargs='*', metavar='model',
+                        help=f"models to tune, all by default: {', '.join(MODEL_CLASSES)}")
+    args = parser.parse_args()
+
+    for name, settings in tune_models(args.models, args.validation_fraction, args.tolerance, args.jobs).items():
+        print(f"{name}: {settings['parameters']}")
+        print(f"  validation score {settings['score']:.4f} (best {settings['best_score']:.4f}), "
+              f"{settings['nodes']} nodes, validated on {settings['validation_rows']} rows from "
+              f"{settings['validation_start']}")
+    print('The settings are used the next time the models are trained')
@@ -0,0 +1,80 @@
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from columnar_store import dataset_version
+from model_registry import artifact_version
+
+
+class PredictionCache:
+    # Bounded LRU cache of prediction results. Entries expire after ttl_seconds, and the least recently used entry is
+    # evicted once max_entries is reached.
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries)}
+
+
+# Cache shared by all the predictors of the process
+prediction_cache = PredictionCache()
+
+
+def cached_prediction(*artifact_names):
+    # Caches the results of a predict method. The key holds the normalised arguments and the versions of the given
+    # artifacts and of the processed dataset, so results computed before a retrain or reprocessing are never served.
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            arguments = signature.bind(self, *args, **kwargs)
+            arguments.apply_defaults()
+            arguments = tuple(str(value) for name, value in arguments.arguments.items() if name != 'self')
+
+            version = tuple(artifact_version(name) for name in artifact_names) + (dataset_version(),)
+            key = (type(self).__name__, method.__name__, arguments, version)
+
+            result = prediction_cache.get(key)
+            if result is None:
+                result = method(self, *args, **kwargs)
+                prediction_cache.put(key, result)
+            # Handing out a copy, so callers cannot change the cached result
+            return result.copy()
+
+        return wrapper
+
+    return decorator
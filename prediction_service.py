@@ -0,0 +1,391 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import startup
+from forecast_materialization import forecast_store
+from instrumentation import metrics
+from model_registry import model_registry
+from prediction_cache import prediction_cache
+from training_orchestrator import MODEL_CLASSES
+from weather_rollup import ROLLUP_KEYS, UnknownLocation, weather_statistics
+
+# Distinct predictions allowed to wait for a worker. Requests beyond that are turned away with ServiceOverloaded
+# (503 over HTTP) instead of queueing without bound, while requests joining a computation already in flight always
+# get through.
+DEFAULT_MAX_QUEUE = 64
+
+# The dashboard's endpoints: POST /prediction/<model>/monthly with an optional {"month": 3} body serves predict, and
+# POST /prediction/<model>/day-hourly with a {"date": "05-03"} body serves predict_day. Both answer with the records
+# under "Predictions".
+ROUTE_PATTERN = re.compile(r'/prediction/([a-z-]+)/(monthly|day-hourly)')
+
+# Model name of the endpoints answering with all four series at once, e.g. POST /prediction/combined/monthly, whose
+# "Predictions" hold the records of every model keyed by its name
+COMBINED_MODEL = 'combined'
+
+# POST /statistics/ with a {"by": ["day"], "month": 3} body serves the reading statistics of the dashboard views, with
+# any of "location", "month", "day" and "hour" narrowing them down
+STATISTICS_ROUTE = '/statistics/'
+
+# GET /metrics serves the timing spans of the process in the Prometheus text format, the requests' among them
+METRICS_ROUTE = '/metrics'
+MAX_BODY_BYTES = 65536
+
+class ServiceOverloaded(Exception):
+    pass
+
+
+class UnknownModel(Exception):
+    pass
+
+
+class InvalidRequest(Exception):
+    pass
+
+
+# Values the integer arguments of the requests may take
+ARGUMENT_RANGES = {'month': (1, 12), 'day': (1, 31), 'hour': (0, 23)}
+
+
+def integer_argument(key, value):
+    # The value of an optional integer argument, given as a JSON number or a string of digits
+    if value is None:
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise InvalidRequest(f'{key} must be an integer, got {value!r}')
+    low, high = ARGUMENT_RANGES[key]
+    if not low <= value <= high:
+        raise InvalidRequest(f'{key} must be between {low} and {high}, got {value}')
+    return value
+
+
+def worker_stats():
+    # Hits and misses of the worker's forecast store and prediction cache so far, and the load time, size and number
+    # of loads of every artifact its registry holds
+    return {'forecast': forecast_store.stats(), 'cache': prediction_cache.stats(),
+            'artifacts': model_registry.metrics()}
+
+
+def merge_worker_stats(previous, current):
+    # Worker threads may return their snapshots out of order. The counters only ever go up and an artifact's entry is
+    # replaced whenever it is reloaded, so the larger count and the later load are the latest.
+    if previous is None:
+        return current
+    merged = {}
+    for group, values in current.items():
+        if group == 'artifacts':
+            merged[group] = dict(previous[group])
+            for file_name, entry in values.items():
+                if file_name not in merged[group] or entry['loaded_at'] >= merged[group][file_name]['loaded_at']:
+                    merged[group][file_name] = entry
+        else:
+            merged[group] = {key: max(count, previous[group].get(key, 0)) for key, count in values.items()}
+    return merged
+
+
+def run_prediction(name, method, argument):
+    # Runs in a worker and returns the JSON-ready records, which are cheap to send back from a worker process. They
+    # are looked up in the materialized forecasts, and only computed live when those are missing or stale. The
+    # worker's stats so far come back along with them.
+    predict = getattr(forecast_store, method)
+    if name == COMBINED_MODEL:
+        # The live predictions of the four models are computed in one cached pass, so the models missing from the
+        # forecasts share it
+        records = {model: predict(model, argument).to_dict('records') for model in MODEL_CLASSES}
+    else:
+        records = predict(name, argument).to_dict('records')
+    return records, os.getpid(), worker_stats()
+
+
+def request_key(name, method, argument):
+    # The key identical requests share: the month as an int, or None for the whole year, and the date as 'dd-mm'
+    if name not in MODEL_CLASSES and name != COMBINED_MODEL:
+        raise UnknownModel(f"Unknown model {name!r}, expected one of {', '.join(MODEL_CLASSES)} or {COMBINED_MODEL}")
+    if method == 'predict':
+        return name, method, integer_argument('month', argument)
+    parts = argument.split('-') if isinstance(argument, str) else []
+    if len(parts) != 2:
+        raise InvalidRequest(f"date must be given as 'dd-mm', got {argument!r}")
+    day, month = (integer_argument(key, part) for key, part in zip(['day', 'month'], parts))
+    return name, method, f'{day:02d}-{month:02d}'
+
+
+def statistics_arguments(arguments):
+    # The grouping keys and the filters of a statistics request, checked before the rollup is consulted
+    by = arguments.get('by', [])
+    by = [by] if isinstance(by, str) else by
+    if not isinstance(by, list) or any(key not in ROLLUP_KEYS for key in by):
+        raise InvalidRequest(f"by must list keys among {', '.join(ROLLUP_KEYS)}, got {arguments.get('by')!r}")
+    location = arguments.get('location')
+    if location is not None and not isinstance(location, str):
+        raise InvalidRequest(f'location must be a string, got {location!r}')
+    return (by, location, integer_argument('month', arguments.get('month')),
+            integer_argument('day', arguments.get('day')), integer_argument('hour', arguments.get('hour')))
+
+
+async def read_line(reader):
+    # A line over the reader's limit is as unparseable as a malformed one
+    try:
+        return (await reader.readline()).decode('latin-1')
+    except ValueError as error:
+        raise InvalidRequest('request line or header line too long') from error
+
+
+async def read_request_head(reader):
+    # The method, path and headers of the next request, with the header names lowercased, or None when the client
+    # closed the connection
+    request_line = await read_line(reader)
+    if not request_line:
+        return None
+    parts = request_line.rstrip('\r\n').split(' ')
+    if len(parts) != 3 or not parts[0] or not parts[1].startswith('/') or not parts[2].startswith('HTTP/'):
+        raise InvalidRequest(f'malformed request line {request_line[:100]!r}')
+    headers = {}
+    while True:
+        line = (await read_line(reader)).strip()
+        if not line:
+            break
+        header, colon, value = line.partition(':')
+        if not colon or not header.strip():
+            raise InvalidRequest(f'malformed header line {line[:100]!r}')
+        headers[header.strip().lower()] = value.strip()
+    return parts[0], parts[1], headers
+
+
+def content_length(headers):
+    length = headers.get('content-length', '0')
+    if not length.isdigit():
+        raise InvalidRequest(f'Content-Length must be a non-negative integer, got {length!r}')
+    return int(length)
+
+
+class PredictionService:
+    # Serves the four predictors from an asyncio loop. Predictions run in a bounded pool of worker threads, or worker
+    # processes, and at most one prediction per worker is handed to the pool at a time, so the pool never builds a
+    # backlog of its own. Identical requests arriving while one is being computed wait for that computation instead
+    # of starting another one.
+    def __init__(self, workers=None, max_queue=DEFAULT_MAX_QUEUE, processes=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=self.workers)
+        self.slots = asyncio.Semaphore(self.workers)
+        self.in_flight = {}
+        self.queued = 0
+        self.stats = collections.Counter()
+        # Latest stats of every worker process, or of this process with threads
+        self.worker_stats = {}
+        self.startup_report = None
+
+    async def compute(self, key):
+        if self.queued >= self.max_queue:
+            self.stats['rejected'] += 1
+            raise ServiceOverloaded(f'{self.queued} predictions are already waiting for a worker')
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        try:
+            self.stats['computed'] += 1
+            records, pid, stats = await asyncio.get_running_loop().run_in_executor(self.executor, run_prediction, *key)
+            self.worker_stats[pid] = merge_worker_stats(self.worker_stats.get(pid), stats)
+            return records
+        finally:
+            self.slots.release()
+
+    async def request(self, name, method, argument):
+        key = request_key(name, method, argument)
+        self.stats['requests'] += 1
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.compute(key))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self.in_flight.pop(key) if self.in_flight.get(key) is done else None)
+        else:
+            self.stats['coalesced'] += 1
+        # A caller going away must not cancel the computation the other callers are waiting for, and the span is
+        # the wait of this caller, whether it started the computation or joined it
+        start = time.perf_counter()
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if metrics.enabled:
+                metrics.observe(f'service.{name}.{method}', time.perf_counter() - start)
+
+    async def predict(self, name, month=None):
+        return await self.request(name, 'predict', month)
+
+    async def predict_day(self, name, date='01-01'):
+        return await self.request(name, 'predict_day', date)
+
+    async def statistics(self, by=(), location=None, month=None, day=None, hour=None):
+        # Answered from the rollup in a thread, as loading it after preprocessing rewrote it must not block the loop.
+        # The arguments are checked already, but only the rollup knows its sensor locations.
+        self.stats['statistics'] += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(weather_statistics, by, location, month, day, hour)
+        except UnknownLocation as error:
+            raise InvalidRequest(str(error)) from error
+        finally:
+            if metrics.enabled:
+                metrics.observe('service.statistics', time.perf_counter() - start)
+
+    def worker_summary(self):
+        # The forecast lookups and prediction cache counts of all the workers, and for every artifact they loaded its
+        # size and latest load time as of the most recent load, along with the number of loads over all the workers
+        summary = {f'forecast_{key}': sum(stats['forecast'][key] for stats in self.worker_stats.values())
+                   for key in ('hits', 'misses')}
+        for key in ('hits', 'misses', 'evictions', 'entries'):
+            summary[f'cache_{key}'] = sum(stats['cache'][key] for stats in self.worker_stats.values())
+        artifacts = {}
+        for stats in self.worker_stats.values():
+            for file_name, entry in stats['artifacts'].items():
+                latest = artifacts.get(file_name)
+                loads = entry['loads'] + (latest['loads'] if latest else 0)
+                if latest is None or entry['loaded_at'] > latest['loaded_at']:
+                    latest = artifacts[file_name] = dict(entry)
+                latest['loads'] = loads
+        summary['artifacts'] = artifacts
+        return summary
+
+    def warm_up(self):
+        # Loads the materialized forecasts of the process ahead of the first requests when the workers are threads
+        if isinstance(self.executor, ThreadPoolExecutor):
+            for name in MODEL_CLASSES:
+                forecast_store.forecast_results(name)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        # A minimal HTTP/1.1 front end with keep-alive, enough for the dashboard's JSON POSTs. Requests it cannot
+        # parse are answered with 400, and chunked bodies with 411, before the connection is closed, as the next
+        # request could not be told apart from the rest of theirs.
+        try:
+            while True:
+                try:
+                    head = await read_request_head(reader)
+                    if head is None:
+                        break
+                    method, path, headers = head
+                    length = content_length(headers)
+                except InvalidRequest as error:
+                    await self.respond(writer, 400, {'detail': f'Invalid request: {error}'}, close=True)
+                    break
+                if 'transfer-encoding' in headers:
+                    await self.respond(writer, 411, {'detail': 'Chunked bodies are not supported, send a '
+                                                               'Content-Length'}, close=True)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {'detail': 'Request body too large'}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self.route(method, path.split('?')[0], body)
+                close = headers.get('connection', '').lower() == 'close'
+                await self.respond(writer, status, payload, close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if method == 'OPTIONS':
+            return 204, None
+        match = ROUTE_PATTERN.fullmatch(path)
+        if method == 'GET' and path == '/stats':
+            return 200, dict(self.stats, queued=self.queued, in_flight=len(self.in_flight), **self.worker_summary())
+        if method == 'GET' and path == METRICS_ROUTE:
+            return 200, metrics.prometheus()
+        if method == 'GET' and path == '/startup':
+            return 200, self.startup_report.to_dict() if self.startup_report else {'status': 'ready'}
+        if method != 'POST' or (match is None and path != STATISTICS_ROUTE):
+            return 404, {'detail': 'Not found'}
+        statistics = match is None
+        try:
+            try:
+                arguments = json.loads(body) if body else {}
+            except ValueError as error:
+                raise InvalidRequest(f'the body is not valid JSON: {error}') from error
+            if not isinstance(arguments, dict):
+                raise InvalidRequest('the body must be a JSON object')
+            if statistics:
+                return 200, await self.statistics(*statistics_arguments(arguments))
+            if match.group(2) == 'day-hourly':
+                return 200, {'Predictions': await self.predict_day(match.group(1), arguments.get('date', '01-01'))}
+            return 200, {'Predictions': await self.predict(match.group(1), arguments.get('month'))}
+        except ServiceOverloaded as error:
+            return 503, {'detail': str(error)}
+        except UnknownModel as error:
+            return 404, {'detail': str(error)}
+        except InvalidRequest as error:
+            return 400, {'detail': f'Invalid request: {error}'}
+        except FileNotFoundError:
+            # The model or the processed data is still being built in the background
+            if statistics:
+                return 503, {'detail': 'The statistics are not available yet, the data is still being processed'}
+            return 503, {'detail': 'The predictions are not available yet, the models are still being built'}
+        except Exception as error:
+            return 500, {'detail': f"{'Statistics' if statistics else 'Prediction'} failed: {error}"}
+
+    async def respond(self, writer, status, payload, close=False):
+        # The metrics are plain text, every other payload is JSON
+        text = isinstance(payload, str)
+        body = b'' if payload is None else (payload if text else json.dumps(payload)).encode()
+        reasons = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 411: 'Length Required',
+                   413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+        content_type = 'text/plain; version=0.0.4' if text else 'application/json'
+        headers = [f'HTTP/1.1 {status} {reasons[status]}', f'Content-Type: {content_type}',
+                   f'Content-Length: {len(body)}', 'Access-Control-Allow-Origin: *',
+                   'Access-Control-Allow-Methods: GET, POST, OPTIONS', 'Access-Control-Allow-Headers: Content-Type']
+        if status == 503:
+            headers.append('Retry-After: 1')
+        if close:
+            headers.append('Connection: close')
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(host='127.0.0.1', port=8000, workers=None, max_queue=DEFAULT_MAX_QUEUE, processes=False,
+                startup_report=None):
+    # With a startup report, requests are served right away while the stale artifacts are rebuilt and everything is
+    # warmed up in the background, and the report is printed once that is done
+    service = PredictionService(workers, max_queue, processes)
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f'Serving predictions on http://{host}:{port} with {service.workers} workers')
+    if startup_report is None:
+        service.warm_up()
+    else:
+        service.startup_report = startup_report
+        startup.start(startup_report, print_report=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the temperature and humidity predictions over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help='predictions computed at once, one per core by default')
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help='distinct predictions allowed to wait for a worker before requests are turned away')
+    parser.add_argument('--processes', action='store_true', help='compute the predictions in worker processes')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_queue, args.processes))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+import os
+import shutil
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+RAW_DATA_CACHE_DIR = os.path.join(current_dir, 'raw_data_cache')
+
+# Bumped whenever the layout of the cache or the way its columns are parsed changes, so older caches get rebuilt
+CACHE_FORMAT_VERSION = 2
+
+# Bytes of a source file hashed at a time
+HASH_BLOCK_BYTES = 1 << 20
+
+# Rows of a source file parsed at a time while its cache is built in streaming mode
+DEFAULT_CHUNKSIZE = 100000
+
+# Every cached column is one raw binary file of fixed width values. Text is stored as int32 codes into the
+# categories listed in the metadata, -1 for a missing value, timestamps as int64 nanoseconds since the epoch in UTC,
+# NaT included, and numbers as float64, with the values that are not numeric already coerced to NaN.
+COLUMN_KINDS = {'text': 'int32', 'timestamp': 'int64', 'number': 'float64'}
+
+
+def content_digest(file_path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+
+def cache_entry_dir(file_path, cache_dir=RAW_DATA_CACHE_DIR):
+    # One entry per source file, replaced whenever the file changes, so the cache never outgrows the sources. The
+    # entry is named after the file and a hash of its full path, as shards in different folders may share a name.
+    path_digest = hashlib.blake2b(os.path.abspath(file_path).encode(), digest_size=6).hexdigest()
+    return os.path.join(cache_dir, f'{os.path.basename(file_path)}-{path_digest}')
+
+
+def cache_layout(columns, dtypes, parsers):
+    # What the cached columns hold besides the source content. A cache built for another layout is rebuilt.
+    return {'version': CACHE_FORMAT_VERSION, 'columns': list(columns),
+            'dtypes': {column: str(dtype) for column, dtype in sorted(dtypes.items())},
+            'parsers': {column: f'{parser.__module__}.{parser.__qualname__}'
+                        for column, parser in sorted(parsers.items())}}
+
+
+def load_cache_metadata(entry_dir):
+    metadata_file = os.path.join(entry_dir, 'metadata.json')
+    if not os.path.exists(metadata_file):
+        return None
+    with open(metadata_file) as metadata_file:
+        return json.load(metadata_file)
+
+
+def write_cache_metadata(entry_dir, metadata):
+    metadata_file = os.path.join(entry_dir, 'metadata.json')
+    with open(metadata_file + '.tmp', 'w') as output:
+        json.dump(metadata, output)
+    os.replace(metadata_file + '.tmp', metadata_file)
+
+
+def valid_cache(file_path, layout, cache_dir=RAW_DATA_CACHE_DIR):
+    # The metadata of the file's cache when it was built from the same content, with the same layout, or None. The
+    # content is only hashed when the file's modification time, size or inode changed since it was last hashed, so a
+    # file touched without being changed keeps its cache.
+    entry_dir = cache_entry_dir(file_path, cache_dir)
+    metadata = load_cache_metadata(entry_dir)
+    if metadata is None or metadata['layout'] != layout:
+        return None
+    signature = file_signature(file_path)
+    if metadata['signature'] == signature:
+        return metadata
+    if metadata['size'] != signature[1] or metadata['digest'] != content_digest(file_path):
+        return None
+    metadata['signature'] = signature
+    write_cache_metadata(entry_dir, metadata)
+    return metadata
+
+
+def column_kind(column, dtypes, parsers):
+    if column in parsers:
+        return 'timestamp'
+    return 'text' if column in dtypes else 'number'
+
+
+def encode_column(values, kind, categories):
+    if kind == 'timestamp':
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        return values.to_numpy(dtype='datetime64[ns]').view('int64')
+    if kind == 'number':
+        return pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64')
+    # Codes of the chunk's distinct values among the categories seen in all the chunks before it
+    codes, uniques = pd.factorize(values)
+    known_codes = [categories.setdefault(value, len(categories)) for value in uniques]
+    return np.array(known_codes + [-1], dtype=COLUMN_KINDS['text'])[codes]
+
+
+def build_cache(file_path, columns, dtypes, parsers, chunksize=None, cache_dir=RAW_DATA_CACHE_DIR):
+    # Parses the source file once, chunk by chunk when a chunksize is given, and writes its typed columns to the
+    # cache. The file is hashed before it is parsed, so changes made to it meanwhile invalidate the cache next time.
+    layout = cache_layout(columns, dtypes, parsers)
+    signature = file_signature(file_path)
+    digest = content_digest(file_path)
+    kinds = {column: column_kind(column, dtypes, parsers) for column in columns}
+    categories = {column: {} for column in columns if kinds[column] == 'text'}
+    text_dtypes = {}
+
+    entry_dir = cache_entry_dir(file_path, cache_dir)
+    # Building next to the existing entry and swapping it in at the end, so readers never see a partial cache. The old
+    # entry is renamed aside before the new one is renamed in, so a reader opening the entry in between finds none
+    # and builds it again, but never a half deleted one.
+    temporary_dir = f'{entry_dir}.{os.getpid()}.tmp'
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+    os.makedirs(temporary_dir)
+
+    rows = 0
+    column_files = {column: open(os.path.join(temporary_dir, f'{column}.bin'), 'wb') for column in columns}
+    try:
+        chunks = pd.read_csv(file_path, usecols=columns, dtype=dtypes, chunksize=chunksize)
+        for chunk in [chunks] if chunksize is None else chunks:
+            for column in columns:
+                values = chunk[column]
+                if column in parsers:
+                    values = parsers[column](values)
+                elif kinds[column] == 'text':
+                    text_dtypes.setdefault(column, str(values.dtype))
+                column_files[column].write(encode_column(values, kinds[column], categories.get(column)).tobytes())
+            rows += len(chunk)
+    finally:
+        for column_file in column_files.values():
+            column_file.close()
+
+    metadata = {'layout': layout, 'digest': digest, 'size': signature[1], 'signature': signature, 'rows': rows,
+                'kinds': kinds, 'text_dtypes': text_dtypes,
+                'categories': {column: list(values) for column, values in categories.items()}}
+    write_cache_metadata(temporary_dir, metadata)
+    old_dir = f'{entry_dir}.{os.getpid()}.old'
+    if os.path.exists(entry_dir):
+        os.replace(entry_dir, old_dir)
+    os.replace(temporary_dir, entry_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return metadata
+
+
+def open_cached_columns(entry_dir, columns):
+    # Opens the metadata and the column files of an entry through one handle on its folder, so they all come from the
+    # same build even when the entry is swapped for a new one meanwhile. The files opened stay readable after the old
+    # entry is deleted.
+    entry_fd = os.open(entry_dir, os.O_RDONLY)
+    column_files = {}
+    try:
+        with open(os.open('metadata.json', os.O_RDONLY, dir_fd=entry_fd)) as metadata_file:
+            metadata = json.load(metadata_file)
+        for column in columns:
+            column_files[column] = open(os.open(f'{column}.bin', os.O_RDONLY, dir_fd=entry_fd), 'rb')
+    except OSError:
+        close_cached_columns(column_files)
+        raise
+    finally:
+        os.close(entry_fd)
+    return metadata, column_files
+
+
+def close_cached_columns(column_files):
+    for column_file in column_files.values():
+        column_file.close()
+
+
+def read_cached_rows(column_files, metadata, columns, start, end):
+    # Decodes rows start to end of the open cached columns into a frame indexed by their row numbers in the source
+    # file
+    data = {}
+    for column in columns:
+        kind = metadata['kinds'][column]
+        dtype = np.dtype(COLUMN_KINDS[kind])
+        column_files[column].seek(start * dtype.itemsize)
+        values = np.fromfile(column_files[column], dtype=dtype, count=end - start)
+        if kind == 'timestamp':
+            data[column] = pd.Series(values.view('datetime64[ns]')).dt.tz_localize('UTC')
+        elif kind == 'text':
+            categories = np.array(metadata['categories'][column] + [np.nan], dtype=object)
+            data[column] = pd.Series(categories[values], dtype=metadata['text_dtypes'].get(column, object))
+        else:
+            data[column] = values
+    frame = pd.DataFrame(data)
+    frame.index = pd.RangeIndex(start, end)
+    return frame
+
+
+def read_raw_csv(file_path, columns, dtypes, parsers, chunksize=None, select=None, cache_dir=RAW_DATA_CACHE_DIR):
+    # Reads the given columns of a raw CSV file through its parse cache, with the parsers applied to their columns,
+    # the text columns read as the dtypes give them and the other columns coerced to numbers. The file is only
+    # parsed when it has no cache yet or its content changed. Returns the whole frame, or an iterator over frames of
+    # chunksize rows when a chunksize is given, with only the select columns when given.
+    layout = cache_layout(columns, dtypes, parsers)
+    build_chunksize = chunksize and max(chunksize, DEFAULT_CHUNKSIZE)
+    if valid_cache(file_path, layout, cache_dir) is None:
+        build_cache(file_path, columns, dtypes, parsers, build_chunksize, cache_dir)
+
+    # Every chunk is read from the files of the entry opened here. A reader finding no entry, as another one is
+    # swapping in a new build, builds it again.
+    entry_dir = cache_entry_dir(file_path, cache_dir)
+    select = list(select or columns)
+    try:
+        metadata, column_files = open_cached_columns(entry_dir, select)
+    except FileNotFoundError:
+        build_cache(file_path, columns, dtypes, parsers, build_chunksize, cache_dir)
+        metadata, column_files = open_cached_columns(entry_dir, select)
+
+    if chunksize is None:
+        try:
+            return read_cached_rows(column_files, metadata, select, 0, metadata['rows'])
+        finally:
+            close_cached_columns(column_files)
+    return read_cached_chunks(column_files, metadata, select, chunksize)
+
+
+def read_cached_chunks(column_files, metadata, columns, chunksize):
+    try:
+        for start in range(0, metadata['rows'], chunksize):
+            yield read_cached_rows(column_files, metadata, columns, start, min(start + chunksize, metadata['rows']))
+    finally:
+        close_cached_columns(column_files)
+
+
+def clear_cache(cache_dir=RAW_DATA_CACHE_DIR):
+    shutil.rmtree(cache_dir, ignore_errors=True)
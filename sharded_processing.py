@@ -0,0 +1,168 @@
+import argparse
+import glob
+import pandas as pd
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from category_encodings import category_encodings
+from data_processing import (ARGYLE_SQUARE_SENSOR_DATA_COLUMNS, ARGYLE_SQUARE_SENSOR_DATA_DTYPES,
+                             ARGYLE_SQUARE_SENSOR_DATA_FILE, ARGYLE_SQUARE_SENSOR_DATA_PARSERS,
+                             COMPACT_WEATHER_DATA_DTYPES, MICROCLIMATE_SENSORS_DATA_COLUMNS,
+                             MICROCLIMATE_SENSORS_DATA_DTYPES, MICROCLIMATE_SENSORS_DATA_FILE,
+                             MICROCLIMATE_SENSORS_DATA_PARSERS, UNIQUE_SENSOR_LOCATIONS, WEATHER_DATA_NUMERIC_COLUMNS,
+                             clean_weather_data_chunk, compact_weather_data, encode_weather_data,
+                             prepare_argyle_square_sensor_data, prepare_microclimate_sensors_data,
+                             save_processed_data, summarize_weather_statistics)
+from date_index import date_keys
+from instrumentation import metrics, timed
+from model_registry import source_fingerprint
+from raw_data_cache import read_raw_csv
+from streaming_statistics import ColumnStatistics
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# How the shards of each source schema are read and prepared. The readings are named as in the processed data once
+# renamed.
+SHARD_SCHEMAS = {
+    'microclimate': {
+        'columns': MICROCLIMATE_SENSORS_DATA_COLUMNS,
+        'dtypes': MICROCLIMATE_SENSORS_DATA_DTYPES,
+        'parsers': MICROCLIMATE_SENSORS_DATA_PARSERS,
+        'readings': WEATHER_DATA_NUMERIC_COLUMNS,
+        'renames': {},
+        'prepare': prepare_microclimate_sensors_data,
+    },
+    'argyle_square': {
+        'columns': ARGYLE_SQUARE_SENSOR_DATA_COLUMNS,
+        'dtypes': ARGYLE_SQUARE_SENSOR_DATA_DTYPES,
+        'parsers': ARGYLE_SQUARE_SENSOR_DATA_PARSERS,
+        'readings': ["relativehumidity", "airtemp", "atmosphericpressure"],
+        'renames': {'airtemp': 'airtemperature'},
+        'prepare': prepare_argyle_square_sensor_data,
+    },
+}
+
+# The cleaned rows only hold known sensor locations, so every shard sends them back with the same categories
+SENSOR_LOCATION_DTYPE = pd.CategoricalDtype(sorted(UNIQUE_SENSOR_LOCATIONS))
+
+
+def shard_files(patterns):
+    # The files matching a glob or a list of globs and file names, relative to this folder unless absolute, in sorted
+    # order within each pattern and in the order of the patterns
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.join(current_dir, pattern)))
+        if not matches:
+            raise FileNotFoundError(f'No sensor export matches {pattern!r}')
+        files.extend(match for match in matches if match not in files)
+    return files
+
+
+def shard_schema(file_path):
+    # The schema of a sensor export, told apart by the columns in its header
+    header = set(pd.read_csv(file_path, nrows=0).columns)
+    for schema, spec in SHARD_SCHEMAS.items():
+        if set(spec['columns']) <= header:
+            return schema
+    raise ValueError(f'{file_path} is not a known sensor export')
+
+
+def process_sources(file_names, workers=None):
+    # Processes the exports recorded as the sources of the processed data again, sorted back into their schemas
+    schemas = {schema: [] for schema in SHARD_SCHEMAS}
+    for file_name in file_names:
+        file_path = os.path.join(current_dir, file_name)
+        schemas[shard_schema(file_path)].append(file_path)
+    return process_sharded_data(schemas['microclimate'], schemas['argyle_square'], workers)
+
+
+def read_shard(schema, file_path, readings_only=False):
+    schema = SHARD_SCHEMAS[schema]
+    select = schema['readings'] if readings_only else None
+    shard = read_raw_csv(file_path, schema['columns'], schema['dtypes'], schema['parsers'], select=select)
+    return shard.rename(columns=schema['renames']) if readings_only else schema['prepare'](shard)
+
+
+def shard_statistics(schema, file_path, quantile_error=None):
+    # First pass, in a worker: the statistics of one shard's readings, which merge into the global ones
+    readings = read_shard(schema, file_path, readings_only=True)
+    weather_statistics = {}
+    for column in WEATHER_DATA_NUMERIC_COLUMNS:
+        weather_statistics[column] = ColumnStatistics(quantile_error=quantile_error)
+        weather_statistics[column].update(readings[column])
+    return weather_statistics
+
+
+def clean_shard(schema, file_path, cleaning_statistics):
+    # Second pass, in a worker: cleaning one shard with the global statistics. The rows encode_weather_data would
+    # drop for a missing value are dropped here already, so every column but the encoded ones is sent back in its
+    # compact dtype. The sensor locations of the rows dropped are sent back too, as the encodings register them.
+    weather_data = clean_weather_data_chunk(read_shard(schema, file_path), cleaning_statistics)
+    sensor_locations = set(weather_data['sensorlocation'].dropna())
+    weather_data = weather_data.dropna()
+    dtypes = {column: dtype for column, dtype in COMPACT_WEATHER_DATA_DTYPES.items()
+              if column in weather_data.columns and dtype != 'category'}
+    dtypes['sensorlocation'] = SENSOR_LOCATION_DTYPE
+    weather_data = weather_data.assign(Date=date_keys(weather_data['Date'])).astype(dtypes)
+    return weather_data, sensor_locations
+
+
+@timed('process_sharded_data')
+def process_sharded_data(microclimate_files=MICROCLIMATE_SENSORS_DATA_FILE,
+                         argyle_square_files=ARGYLE_SQUARE_SENSOR_DATA_FILE, workers=None, quantile_error=None):
+    # Processes sensor exports split over many files, each source given as a glob or a list of files, and saves the
+    # result like process_and_clean_data. Every shard is read, typed and cleaned in a pool of worker processes, in two
+    # passes: the first collects each shard's statistics, which are merged into the global imputation means and IQR
+    # bounds the second one cleans every shard with. The output matches process_and_clean_data on the concatenated
+    # exports, microclimate rows first.
+    laps = metrics.laps('process_sharded_data')
+    shards = [('microclimate', file_path) for file_path in shard_files(microclimate_files)]
+    shards += [('argyle_square', file_path) for file_path in shard_files(argyle_square_files)]
+    if not shards:
+        raise ValueError('No sensor exports to process')
+    schemas, file_paths = zip(*shards)
+    # Fingerprinted before reading, so changes made to the files while they are processed are picked up next time
+    raw_data_sources = source_fingerprint(file_paths)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        weather_statistics = None
+        for statistics in executor.map(shard_statistics, schemas, file_paths, [quantile_error] * len(shards)):
+            if weather_statistics is None:
+                weather_statistics = statistics
+            else:
+                for column in WEATHER_DATA_NUMERIC_COLUMNS:
+                    weather_statistics[column].merge(statistics[column])
+        cleaning_statistics = summarize_weather_statistics(weather_statistics)
+        laps.mark('statistics')
+
+        cleaned_shards = list(executor.map(clean_shard, schemas, file_paths, [cleaning_statistics] * len(shards)))
+        laps.mark('clean_shards')
+
+    # Registering the sensor locations of all the cleaned rows at once, as encoding them in a single frame would
+    sensor_locations = set().union(*(locations for _, locations in cleaned_shards))
+    category_encodings.encode('sensorlocation', pd.Series(sorted(sensor_locations), dtype=object),
+                              UNIQUE_SENSOR_LOCATIONS)
+    weather_data = pd.concat([shard for shard, _ in cleaned_shards], ignore_index=True)
+    weather_data = compact_weather_data(encode_weather_data(weather_data))
+    laps.mark('encode')
+
+    save_processed_data(weather_data, raw_data_sources, laps)
+    return weather_data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Process sensor exports split over many files on several cores')
+    parser.add_argument('--microclimate', nargs='+', default=[MICROCLIMATE_SENSORS_DATA_FILE],
+                        help='microclimate sensor exports, as file names or globs')
+    parser.add_argument('--argyle-square', nargs='+', default=[ARGYLE_SQUARE_SENSOR_DATA_FILE],
+                        help='Argyle Square sensor exports, as file names or globs')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per core by default')
+    parser.add_argument('--quantile-error', type=float, default=None,
+                        help='rank error of the quartile sketch, exact quartiles by default')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    processed_data = process_sharded_data(args.microclimate, args.argyle_square, args.workers, args.quantile_error)
+    print(f'Processed {len(processed_data)} rows in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,183 @@
+import argparse
+import contextlib
+import importlib
+import json
+import threading
+import time
+
+# Libraries and modules a server imports, timed one by one in the startup report. The libraries come first, so every
+# module is only charged for itself. Nothing is imported at the top of this module beyond the standard library, so the
+# imports are measured cold.
+STARTUP_IMPORTS = ['numpy', 'pandas', 'joblib', 'sklearn.ensemble', 'sklearn.preprocessing', 'data_processing',
+                   'feature_store', 'flat_forest', 'combined_prediction', 'forecast_materialization',
+                   'temperature_random_forest_regression', 'humidity_random_forest_regression',
+                   'temperature_classification', 'humidity_classification', 'weather_rollup',
+                   'prediction_service']
+
+
+class StartupReport:
+    # Time spent in every phase of a startup, along with when the phase began since the report was created, and the
+    # artifacts found stale. Phases run in the background thread while requests are already being served.
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self.lock = threading.Lock()
+        self.status = 'starting'
+        self.plan = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases.append({'phase': name, 'began': start - self.started,
+                                    'seconds': time.perf_counter() - start,
+                                    'thread': threading.current_thread().name})
+
+    def to_dict(self):
+        with self.lock:
+            return {'status': self.status, 'elapsed': time.perf_counter() - self.started, 'plan': self.plan,
+                    'phases': list(self.phases)}
+
+    def format(self):
+        report = self.to_dict()
+        lines = [f"Startup {report['status']} after {report['elapsed']:.2f}s", '   began  seconds  phase']
+        for phase in sorted(report['phases'], key=lambda phase: phase['began']):
+            lines.append(f"{phase['began']:8.3f} {phase['seconds']:8.3f}  {phase['phase']}")
+        return '\n'.join(lines)
+
+
+def import_modules(report, modules=STARTUP_IMPORTS):
+    for module in modules:
+        with report.phase(f'import {module}'):
+            importlib.import_module(module)
+
+
+def raw_data_files():
+    # The raw files the processed data was last built from, which may be shards processed by sharded_processing, or
+    # the two default exports when it was never built
+    from data_processing import ARGYLE_SQUARE_SENSOR_DATA_FILE, MICROCLIMATE_SENSORS_DATA_FILE, PROCESSED_DATA_NAME
+    from model_registry import recorded_sources
+
+    return list(recorded_sources(PROCESSED_DATA_NAME)
+                or [MICROCLIMATE_SENSORS_DATA_FILE, ARGYLE_SQUARE_SENSOR_DATA_FILE])
+
+
+def stale_artifacts():
+    # Whether the processed data has to be rebuilt, because the raw files changed since it was built from them, and
+    # the models to retrain, because they are missing or their dataset or forest settings changed since they were
+    # trained. Without raw files the processed data on disk, if any, is used as it is.
+    from combined_prediction import PREDICTION_MODELS
+    from data_processing import PROCESSED_DATA_NAME
+    from model_registry import artifact_version, source_fingerprint, sources_unchanged
+    from model_tuning import training_sources
+
+    raw_data_sources = source_fingerprint(raw_data_files())
+    has_raw_data = all(raw_data_sources.values())
+    process_data = has_raw_data and not sources_unchanged(PROCESSED_DATA_NAME, raw_data_sources)
+
+    models = []
+    for name, spec in PREDICTION_MODELS.items():
+        if (process_data or not sources_unchanged(spec['model'], training_sources(name))
+                or (spec['scaler'] and artifact_version(spec['scaler']) is None)):
+            models.append(name)
+    return process_data, models
+
+
+def build_artifacts(report, process_data, models, cores=None):
+    if process_data:
+        with report.phase('process the raw data'):
+            from data_processing import (ARGYLE_SQUARE_SENSOR_DATA_FILE, MICROCLIMATE_SENSORS_DATA_FILE,
+                                         process_and_clean_data)
+            file_names = raw_data_files()
+            if file_names == [MICROCLIMATE_SENSORS_DATA_FILE, ARGYLE_SQUARE_SENSOR_DATA_FILE]:
+                process_and_clean_data()
+            else:
+                # Data processed from shards is rebuilt from the same shards
+                from sharded_processing import process_sources
+                process_sources(file_names, cores)
+    if models:
+        with report.phase(f"train {', '.join(models)}"):
+            from training_orchestrator import train_models
+            train_models(models, cores)
+
+    # The forecasts of the models that were not retrained are computed again when they are missing or stale, e.g. after
+    # a training that stopped before materializing them
+    from forecast_materialization import materialize_forecasts, stale_forecasts
+    stale = stale_forecasts()
+    if stale:
+        with report.phase(f"materialize the forecasts of {', '.join(stale)}"):
+            materialize_forecasts(stale)
+
+
+def warm_up(report):
+    # Loads everything the first requests would otherwise wait for: the feature store, every model and scaler, one
+    # prediction of each model from its materialized forecasts and the rollup the statistics are answered from
+    from combined_prediction import PREDICTION_MODELS
+    from feature_store import feature_store
+    from flat_forest import load_model
+    from forecast_materialization import forecast_store
+    from model_registry import model_registry
+    from weather_rollup import load_rollup
+
+    with report.phase('build the feature store'):
+        feature_store.year_rows()
+    for name, spec in PREDICTION_MODELS.items():
+        with report.phase(f'load {name}'):
+            load_model(spec['model'])
+            if spec['scaler']:
+                model_registry.get(spec['scaler'])
+    for name in PREDICTION_MODELS:
+        with report.phase(f'first prediction of {name}'):
+            forecast_store.predict_day(name, '01-01')
+    with report.phase('load the weather rollup'):
+        load_rollup()
+
+
+def start(report=None, background=True, cores=None, print_report=False):
+    # Reuses the artifacts whose sources are unchanged, then builds the stale ones and warms everything up, in a
+    # background thread by default so the caller can start serving right away
+    report = report or StartupReport()
+    with report.phase('check the artifacts'):
+        process_data, models = stale_artifacts()
+    report.plan = {'process_data': process_data, 'train': models}
+
+    def run():
+        report.status = 'building' if process_data or models else 'warming up'
+        try:
+            build_artifacts(report, process_data, models, cores)
+            warm_up(report)
+            report.status = 'ready'
+        except Exception as error:
+            report.status = f'failed: {error!r}'
+        if print_report:
+            print(report.format())
+
+    if background:
+        threading.Thread(target=run, name='startup', daemon=True).start()
+    else:
+        run()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Start up cold, building the stale artifacts, and report the time spent')
+    parser.add_argument('--check', action='store_true', help='only list the artifacts that would be rebuilt')
+    parser.add_argument('--cores', type=int, help='cores used to train the models')
+    parser.add_argument('--output', help='JSON file to write the report to')
+    args = parser.parse_args()
+
+    startup_report = StartupReport()
+    import_modules(startup_report)
+    if args.check:
+        process_data, models = stale_artifacts()
+        print(f"Process the raw data: {'yes' if process_data else 'no'}")
+        print(f"Train: {', '.join(models) or 'nothing'}")
+    else:
+        start(startup_report, background=False, cores=args.cores)
+        print(startup_report.format())
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(startup_report.to_dict(), output, indent=2)
@@ -0,0 +1,213 @@
+import math
+import numpy as np
+import pandas as pd
+
+# Seed of the sketches' random compactions unless another one is given, so the same data always gives the same
+# quartiles and outlier bounds
+DEFAULT_SEED = 0
+
+
+def weighted_quantile(values, weights, q):
+    # Returns the q-th quantile of the values repeated by their weights, interpolating linearly between the two
+    # closest ranks as DataFrame.quantile does
+    order = np.argsort(values, kind='stable')
+    values = np.asarray(values, dtype='float64')[order]
+    cumulative_weights = np.asarray(weights, dtype='float64')[order].cumsum()
+    if len(values) == 0 or cumulative_weights[-1] == 0:
+        return np.nan
+
+    position = (cumulative_weights[-1] - 1) * q
+    lower_rank = math.floor(position)
+    upper_rank = min(lower_rank + 1, int(cumulative_weights[-1]) - 1)
+    lower = values[np.searchsorted(cumulative_weights, lower_rank, side='right')]
+    upper = values[np.searchsorted(cumulative_weights, upper_rank, side='right')]
+    return np.quantile(np.array([lower, upper]), position - lower_rank)
+
+
+class MeanAccumulator:
+    # Exact running mean. Each update is summed with math.fsum, so the result does not depend on how the data
+    # is split into chunks.
+    def __init__(self):
+        self.partial_sums = []
+        self.count = 0
+
+    def update(self, values):
+        values = pd.Series(values, dtype='float64').dropna()
+        self.partial_sums.append(math.fsum(values))
+        self.count += len(values)
+
+    def merge(self, other):
+        self.partial_sums.extend(other.partial_sums)
+        self.count += other.count
+        return self
+
+    @property
+    def mean(self):
+        if not self.count:
+            return np.nan
+        return math.fsum(self.partial_sums) / self.count
+
+
+class HistogramQuantiles:
+    # Exact quantiles from a histogram of the values. Memory grows with the number of distinct values, which
+    # stays small for readings rounded to a fixed number of decimals.
+    def __init__(self):
+        self.histogram = pd.Series(dtype='float64')
+
+    def update(self, values, weight=1):
+        counts = pd.Series(values, dtype='float64').value_counts() * weight
+        self.histogram = self.histogram.add(counts, fill_value=0)
+
+    def merge(self, other):
+        self.histogram = self.histogram.add(other.histogram, fill_value=0)
+        return self
+
+    @property
+    def count(self):
+        return int(self.histogram.sum())
+
+    def quantile(self, q):
+        return weighted_quantile(self.histogram.index.to_numpy(), self.histogram.to_numpy(), q)
+
+
+class KLLSketch:
+    # Mergeable quantile sketch (Karnin, Lang and Liberty, 2016). The items kept at level h each stand for 2**h
+    # of the values seen, and the rank of any returned quantile is within about error * count of the true rank.
+    def __init__(self, error=0.01, seed=DEFAULT_SEED):
+        self.error = error
+        self.k = max(8, math.ceil(1.7 / error))
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.random = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def update(self, values, weight=1):
+        values = pd.Series(values, dtype='float64').dropna().to_numpy()
+        # A weight is split into its powers of two, each placed on the level where items carry that weight
+        level = 0
+        while weight:
+            if weight & 1:
+                while len(self.levels) <= level:
+                    self.levels.append(np.empty(0))
+                self.levels[level] = np.concatenate([self.levels[level], values])
+                self.count += len(values) << level
+            weight >>= 1
+            level += 1
+        self.compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.compress()
+        return self
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                # Keeping every other sorted item, starting at a random offset, and promoting them one level up.
+                # An odd item out stays behind so no weight is lost.
+                items = np.sort(items)
+                leftover = items[:len(items) % 2]
+                items = items[len(items) % 2:]
+                promoted = items[self.random.integers(2)::2]
+                self.levels[level] = leftover
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    @property
+    def size(self):
+        return sum(len(items) for items in self.levels)
+
+    def quantile(self, q):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        return weighted_quantile(values, weights, q)
+
+
+class ColumnStatistics:
+    # Streaming statistics for one numeric column: the exact mean used for imputation and the quartiles of the
+    # imputed, rounded column used for the IQR outlier bounds. The quartiles are exact by default, or come from a
+    # KLL sketch with the given rank error when quantile_error is set.
+    def __init__(self, decimals=1, quantile_error=None, seed=DEFAULT_SEED):
+        self.decimals = decimals
+        self.seed = seed
+        self.means = MeanAccumulator()
+        self.null_count = 0
+        if quantile_error:
+            self.quantiles = KLLSketch(quantile_error, seed=seed)
+        else:
+            self.quantiles = HistogramQuantiles()
+
+    def update(self, values):
+        values = pd.to_numeric(pd.Series(values), errors='coerce').astype('float64')
+        self.means.update(values)
+        self.null_count += int(values.isna().sum())
+        self.quantiles.update(values.round(self.decimals))
+
+    def merge(self, other):
+        self.means.merge(other.means)
+        self.null_count += other.null_count
+        self.quantiles.merge(other.quantiles)
+        return self
+
+    @property
+    def mean(self):
+        return self.means.mean
+
+    @property
+    def count(self):
+        return self.means.count + self.null_count
+
+    def quantile(self, q):
+        # The missing values are filled with the mean and rounded before the quartiles are taken
+        if not self.null_count or np.isnan(self.mean):
+            return self.quantiles.quantile(q)
+        fill_value = np.round(self.mean, self.decimals)
+        if isinstance(self.quantiles, KLLSketch):
+            quantiles = KLLSketch(self.quantiles.error, seed=self.seed)
+            quantiles.merge(self.quantiles)
+        else:
+            quantiles = HistogramQuantiles().merge(self.quantiles)
+        quantiles.update([fill_value], weight=self.null_count)
+        return quantiles.quantile(q)
+
+    def iqr_bounds(self, whisker=1.5):
+        Q1 = self.quantile(0.25)
+        Q3 = self.quantile(0.75)
+        IQR = Q3 - Q1
+        return Q1 - whisker * IQR, Q3 + whisker * IQR
+
+
+if __name__ == '__main__':
+    # Comparing the streaming statistics against the exact pandas result on synthetic readings
+    rng = np.random.default_rng(42)
+    readings = pd.Series(rng.normal(15, 6, 1000000))
+    readings[rng.random(len(readings)) < 0.02] = np.nan
+
+    expected = readings.fillna(readings.mean()).round(1)
+    for quantile_error in [None, 0.01, 0.001]:
+        statistics = [ColumnStatistics(quantile_error=quantile_error, seed=seed) for seed in range(10)]
+        for seed, chunk in enumerate(np.array_split(readings, 10)):
+            statistics[seed].update(chunk)
+        merged = statistics[0]
+        for other in statistics[1:]:
+            merged.merge(other)
+
+        print(f"quantile_error={quantile_error}")
+        print(f"Mean: {merged.mean:.6f} (pandas {readings.mean():.6f})")
+        for q in [0.25, 0.75]:
+            estimate = merged.quantile(q)
+            # Readings tie after rounding, so any rank between the first and last copy of the estimate is exact
+            rank_error = max(0, (expected < estimate).mean() - q, q - (expected <= estimate).mean())
+            print(f"Q{q}: {estimate:.2f} (pandas {expected.quantile(q):.2f}), rank error {rank_error:.5f}")
+        print('-' * 50)
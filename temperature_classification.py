@@ -2,22 +2,41 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, classification_report
 import pandas as pd
-import joblib
-import os
+from columnar_store import load_weather_data
+from combined_prediction import distribution_by_group
+from data_processing import expand_readings
+from date_index import date_keys, day_of_month
+from feature_store import TEMPERATURE_FEATURES, feature_store
+from flat_forest import load_model
+from incremental_training import fit_forest, record_training
+from instrumentation import metrics, timed
+from model_registry import artifact_version, model_registry, save_artifact
+from model_tuning import holdout_predictions, training_sources, tuned_parameters
+from prediction_cache import cached_prediction
 
 
 class TemperatureClassifier:
     def __init__(self):
         self.model = RandomForestClassifier(n_estimators=100, random_state=42)
+        # The forest settings picked by model_tuning, once it has been run, replace the defaults
+        self.model.set_params(**tuned_parameters('temperature-classification'))
         self.weather_data_file = 'processed_weather_data.pkl'
-        current_dir = os.path.dirname(__file__)
-        file_path = os.path.join(current_dir, 'processed_weather_data.pkl')
-        self.weather_data = joblib.load(file_path)
+        self._weather_data = None
 
-    def train(self):
+    @property
+    def weather_data(self):
+        # The full processed dataset is only loaded when training needs it, predictions read just their own rows
+        if self._weather_data is None:
+            self._weather_data = load_weather_data()
+        return self._weather_data
+
+    @weather_data.setter
+    def weather_data(self, weather_data):
+        self._weather_data = weather_data
+
+    def training_data(self):
         # Feature selection: Choosing relevant columns as input_date features (X)
-        X = self.weather_data[
-            ['relativehumidity', 'day', 'hour', 'sensor-location-encoded', 'atmosphericpressure', 'season-encoded']]
+        X = expand_readings(self.weather_data[TEMPERATURE_FEATURES])
 
         # Discretizing the 'airtemperature' column into categories (e.g., cold, moderate, hot)
         temp_bins = [0, 10, 20, 30]  # Temperature ranges for binning
@@ -27,25 +46,49 @@ class TemperatureClassifier:
 
         # Target selection: The 'temperature_category' column is our target variable (y)
         y = self.weather_data['temperature_category']
-
-        # Splitting the dataset into training and testing sets (80% train, 20% test)
-
-        # Standardize the features to have a mean of 0 and a standard deviation of 1
-        scaler = StandardScaler()
-        X_train_scaled = scaler.fit_transform(X)  # Fit and transform the training data
-
-        scaler_file_path = os.path.join(os.path.dirname(__file__), 'temperature_scaler.pkl')
-        joblib.dump(scaler, scaler_file_path)
-
-        # Train the Random Forest model using the training data
-        self.model.fit(X_train_scaled, y)
-
-        # Make predictions using the trained model on the test data
-        y_pred = self.model.predict(X_train_scaled)
-
-        current_dir = os.path.dirname(__file__)
-        file_path = os.path.join(current_dir, 'temperature_classification_model.pkl')
-        joblib.dump(self.model, file_path)
+        return X, y
+
+    @timed('temperature-classification.train')
+    def train(self, incremental=False, evaluate=False):
+        laps = metrics.laps('temperature-classification.train')
+        # The dataset and settings the model is trained from, recorded along with it
+        sources = training_sources('temperature-classification')
+        X, y = self.training_data()
+        laps.mark('training_data')
+
+        # Standardize the features to have a mean of 0 and a standard deviation of 1. An incremental update keeps the
+        # scaler the trained model was fitted with.
+        if incremental and artifact_version('temperature_scaler.pkl') is not None:
+            X_train_scaled = model_registry.get('temperature_scaler.pkl').transform(X)
+        else:
+            scaler = StandardScaler()
+            X_train_scaled = scaler.fit_transform(X)  # Fit and transform the training data
+
+            save_artifact(scaler, 'temperature_scaler.pkl')
+        laps.mark('scale')
+
+        # Train the Random Forest model using the training data, or refresh the trained one with the new readings for
+        # an incremental update
+        self.model, evaluation_rows = fit_forest(self.model, 'temperature_classification_model.pkl', X_train_scaled, y,
+                                                 self.weather_data, incremental)
+        if evaluation_rows is None:
+            print('No new readings since the model was last trained')
+            return
+        laps.mark('fit')
+
+        save_artifact(self.model, 'temperature_classification_model.pkl', sources=sources)
+        record_training('temperature_classification_model.pkl', self.weather_data, evaluation_rows)
+        laps.mark('save')
+
+        if not evaluate:
+            return
+        # Scoring the model's settings on the most recent days with a copy fitted on the days before them, as the model
+        # saved was trained on every row
+        holdout = holdout_predictions(self.model, X, y, date_keys(self.weather_data['Date']), scale=True)
+        if holdout is None:
+            print('Too few days of readings to hold some out for evaluation')
+            return
+        y, y_pred = holdout
 
         # Function to evaluate the model's performance
         print(f"Evaluation:")
@@ -58,96 +101,87 @@ class TemperatureClassifier:
         print("\nClassification Report:")
         print(classification_report(y, y_pred))  # Print detailed classification report
         print('-' * 50)
+        laps.mark('evaluate')
 
-    def predict(self, month=None):
-        # Selecting the features (X) for the model
+    @timed('temperature-classification.predict')
+    @cached_prediction('temperature_classification_model.pkl', 'temperature_scaler.pkl')
+    def predict(self, month=None, distribution=False):
+        laps = metrics.laps('temperature-classification.predict')
 
-        self.weather_data['Date'] = pd.to_datetime(self.weather_data['Date'], format='%d-%m-%y', errors='coerce')
+        # Selecting the 2024 rows of the specific month, if provided, from the feature store
+        rows = feature_store.lookup(int(month) if month else None)
+        laps.mark('lookup')
 
-        # Filter the data for the specific month and day
-        if month:
-            month = int(month)
-            weather_data = self.weather_data[(self.weather_data["month"] == month)]
-            weather_data = weather_data[weather_data['Date'].dt.year == 2024]
-        else:
-            weather_data = self.weather_data[self.weather_data['Date'].dt.year == 2024]
-
-        X = weather_data[
-            ['relativehumidity', 'day', 'hour', 'sensor-location-encoded', 'atmosphericpressure', 'season-encoded']]
-
-        dates = weather_data['Date']
+        X = rows.features(TEMPERATURE_FEATURES)
 
-        # Load the saved model
-        current_dir = os.path.dirname(__file__)
-        model_file_path = os.path.join(current_dir, 'temperature_classification_model.pkl')
-        model = joblib.load(model_file_path)
+        dates = rows.date_keys
 
-        # Load the saved scaler and scale the features
-        scaler_file_path = os.path.join(current_dir, 'temperature_scaler.pkl')
-        scaler = joblib.load(scaler_file_path)
-        X_scaled = scaler.transform(X)
+        # Get the saved model from the registry
+        model = load_model('temperature_classification_model.pkl')
+        laps.mark('load_model')
 
-        # Make predictions for all entries in the dataset
-        predictions = model.predict(X_scaled)
+        # Get the saved scaler from the registry and scale the features
+        scaler = model_registry.get('temperature_scaler.pkl')
+        X_scaled = scaler.transform(expand_readings(X))
+        laps.mark('scale')
 
-        # Create a DataFrame to store dates and predictions
-        result = pd.DataFrame({
-            'Date': dates,
-            'Prediction': predictions
-        })
+        # Class probabilities of all entries, the predictions being the most probable classes
+        probabilities = model.predict_proba(X_scaled)
+        laps.mark('model_predict')
 
-        result_grouped = result.groupby('Date', as_index=False).agg(lambda x: pd.Series.mode(x)[0])
+        # Majority vote of the predictions of each date, with the average class probabilities when a
+        # distribution is asked for
+        result_grouped = distribution_by_group(pd.DataFrame({'Date': dates}), probabilities, model.classes_)
+        if not distribution:
+            result_grouped = result_grouped[['Date', 'Prediction']]
 
-        result_grouped['Date'] = result_grouped['Date'].dt.strftime('%d')
+        result_grouped['Date'] = day_of_month(result_grouped['Date'])
+        laps.mark('aggregate')
         # Return the DataFrame
         return result_grouped
 
 
-    def predict_day(self, date="01-01"):
+    @timed('temperature-classification.predict_day')
+    @cached_prediction('temperature_classification_model.pkl', 'temperature_scaler.pkl')
+    def predict_day(self, date="01-01", distribution=False):
+        laps = metrics.laps('temperature-classification.predict_day')
+
         # Split and extract the month and day from the input date
         date = date.split("-")
         month = int(date[1])
         day = int(date[0])
 
-        # Ensure that the Date column is in datetime format
-        self.weather_data['Date'] = pd.to_datetime(self.weather_data['Date'], format='%d-%m-%y', errors='coerce')
-
-        # Filter the data for the year 2024
-        weather_data = self.weather_data[self.weather_data['Date'].dt.year == 2024]
-
-        # Filter the data for the specific month and day
-        weather_data = weather_data[(weather_data["month"] == month) & (weather_data["Date"].dt.day == day)]
+        # Selecting the 2024 rows of the specific month and day from the feature store
+        rows = feature_store.lookup(month, day)
+        laps.mark('lookup')
 
         # Selecting the features (X) for the model
-        X = weather_data[
-            ['relativehumidity', 'day', 'hour', 'sensor-location-encoded', 'atmosphericpressure', 'season-encoded']]
+        X = rows.features(TEMPERATURE_FEATURES)
 
         # Store the hour column
-        hours = weather_data['hour']
+        hours = rows.hours
 
-        # Load the trained model
-        current_dir = os.path.dirname(__file__)
-        file_path = os.path.join(current_dir, 'temperature_classification_model.pkl')
-        model = joblib.load(file_path)
+        # Get the trained model from the registry
+        model = load_model('temperature_classification_model.pkl')
+        laps.mark('load_model')
 
-        # Load the scaler
-        scaler_file_path = os.path.join(current_dir, 'temperature_scaler.pkl')
-        scaler = joblib.load(scaler_file_path)
+        # Get the scaler from the registry
+        scaler = model_registry.get('temperature_scaler.pkl')
 
         # Scale the input features
-        X_scaled = scaler.transform(X)
-
-        # Make predictions
-        predictions = model.predict(X_scaled)
-
-        # Create a DataFrame to store hours and predictions
-        result = pd.DataFrame({
-            'hour': hours,
-            'Prediction': predictions
-        })
-
-        # Group by 'hour' and calculate the most frequent 'Classified Humidity' value for each hour
-        result_grouped = result.groupby('hour', as_index=False).agg(lambda x: pd.Series.mode(x)[0])
+        X_scaled = scaler.transform(expand_readings(X))
+        laps.mark('scale')
+
+        # Class probabilities of all entries, the predictions being the most probable classes
+        probabilities = model.predict_proba(X_scaled)
+        laps.mark('model_predict')
+
+        # Majority vote of the predictions of each hour, with the average class probabilities when a
+        # distribution is asked for
+        result_grouped = distribution_by_group(pd.DataFrame({'hour': hours}), probabilities, model.classes_)
+        if not distribution:
+            result_grouped = result_grouped[['hour', 'Prediction']]
+        laps.mark('aggregate')
 
 
         # Return the DataFrame with one entry per hour (most frequent classified humidity)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from flat_forest import FlatForest
+
+
+def training_rows(rows=600, seed=0):
+    # Features shaped like the scaled model inputs, with a few missing values, and a reading to predict from them
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(rows, 6))
+    X[rng.random(X.shape) < 0.02] = np.nan
+    y = np.nan_to_num(X[:, 0]) * 5 + np.nan_to_num(X[:, 4]) + rng.normal(scale=0.5, size=rows)
+    return X, y
+
+
+@pytest.mark.parametrize('batch_size', [32768, 7])
+def test_flat_regressor_matches_sklearn_exactly(batch_size):
+    X, y = training_rows()
+    model = RandomForestRegressor(n_estimators=20, max_depth=8, random_state=42).fit(X, y)
+    forest = FlatForest.from_model(model)
+
+    X_new, _ = training_rows(seed=1)
+    assert np.array_equal(forest.predict(X_new, batch_size), model.predict(X_new))
+
+
+@pytest.mark.parametrize('batch_size', [32768, 7])
+def test_flat_classifier_matches_sklearn_exactly(batch_size):
+    # The readings binned into the labels the classifiers predict, as in training_data
+    X, y = training_rows()
+    labels = np.array(['cold', 'moderate', 'hot'])[np.digitize(y, [-3, 3])]
+    model = RandomForestClassifier(n_estimators=20, random_state=42).fit(X, labels)
+    forest = FlatForest.from_model(model)
+
+    X_new, _ = training_rows(seed=1)
+    assert np.array_equal(forest.predict_proba(X_new, batch_size), model.predict_proba(X_new))
+    assert np.array_equal(forest.predict(X_new, batch_size), model.predict(X_new))
+    assert list(forest.classes_) == list(model.classes_)
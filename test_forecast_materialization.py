@@ -0,0 +1,101 @@
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+from combined_prediction import PREDICTION_MODELS
+from test_incremental_processing import raw_exports
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Processes the raw exports and trains every model through the orchestrator, then prints whether each model's forecasts
+# are current and the rows served for a month and a day from them
+TRAIN_AND_SERVE = '''
+import json
+from data_processing import process_and_clean_data
+from forecast_materialization import forecast_store, forecasts_current
+from training_orchestrator import MODEL_CLASSES, train_models
+
+process_and_clean_data()
+train_models(cores=1)
+served = {name: {'current': forecasts_current(name), 'monthly': len(forecast_store.predict(name, 3)),
+                 'day_hourly': len(forecast_store.predict_day(name, '05-03'))} for name in MODEL_CLASSES}
+print(json.dumps({'served': served, 'stats': forecast_store.stats()}))
+'''
+
+
+# Trains every model on readings of 2024, then materializes their forecasts again counting the predictions the models
+# make, and prints whether the tables match the ones computed grouping by grouping
+MATERIALIZE_AGAIN = '''
+import json
+import combined_prediction
+from combined_prediction import predict_models
+from data_processing import process_and_clean_data
+from feature_store import feature_store
+from forecast_materialization import forecast_file_name, materialize_forecasts
+from model_registry import model_registry
+from training_orchestrator import MODEL_CLASSES, train_models
+
+process_and_clean_data()
+train_models(cores=1)
+
+predictions = {}
+load_model = combined_prediction.load_model
+
+class CountingModel:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.model = load_model(file_name)
+
+    def predict(self, X):
+        predictions[self.file_name] = predictions.get(self.file_name, 0) + 1
+        return self.model.predict(X)
+
+combined_prediction.load_model = CountingModel
+materialize_forecasts()
+combined_prediction.load_model = load_model
+
+rows = feature_store.lookup()
+matches = {}
+for name in MODEL_CLASSES:
+    forecasts = model_registry.get(forecast_file_name(name))
+    matches[name] = (forecasts['daily'].equals(predict_models(rows, ['date_key'], [name])[name])
+                     and forecasts['hourly'].equals(predict_models(rows, ['date_key', 'hour'], [name])[name]))
+print(json.dumps({'predictions': predictions, 'matches': matches}))
+'''
+
+
+def backend_with_exports(tmp_path, start):
+    # A copy of the modules, which keep their artifacts next to them, with raw exports of their own
+    for module in glob.glob(os.path.join(repo_dir, '*.py')):
+        if not os.path.basename(module).startswith('test_'):
+            shutil.copy(module, tmp_path)
+    microclimate, argyle_square = raw_exports(start=start)
+    microclimate.to_csv(tmp_path / 'microclimate-sensors-data.csv', index=False)
+    argyle_square.to_csv(tmp_path / 'meshed-sensor-type-1.csv', index=False)
+    return tmp_path
+
+
+def run_script(backend_dir, script):
+    output = subprocess.run([sys.executable, '-c', script], cwd=backend_dir, capture_output=True, text=True,
+                            env=dict(os.environ, WEATHER_METRICS='0'))
+    assert output.returncode == 0, output.stderr
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def test_materialization_predicts_once_per_model(tmp_path):
+    result = run_script(backend_with_exports(tmp_path, '2024-01-01'), MATERIALIZE_AGAIN)
+
+    assert result['predictions'] == {spec['model']: 1 for spec in PREDICTION_MODELS.values()}
+    assert all(result['matches'].values())
+
+
+def test_training_without_prediction_year_rows_materializes_empty_forecasts(tmp_path):
+    # Readings of 2023 only, so the feature store holds no rows of the prediction year
+    result = run_script(backend_with_exports(tmp_path, '2023-01-01'), TRAIN_AND_SERVE)
+
+    for name, served in result['served'].items():
+        assert served == {'current': True, 'monthly': 0, 'day_hourly': 0}, name
+    # Every request was answered from the forecast tables, none computed live
+    assert result['stats'] == {'hits': 8, 'misses': 0}
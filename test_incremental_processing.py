@@ -0,0 +1,215 @@
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Runs the incremental processing over the raw exports, appends readings to both of them, one of them at the time of
+# the newest reading already processed, and runs it again. Prints the rows of the processed data the predictors read
+# and of the rollup the statistics are served from after each run, and whether a joblib pickle was written.
+INCREMENTAL_RUNS = '''
+import json
+import os
+from columnar_store import load_weather_data
+from incremental_processing import SENSOR_SOURCES, process_new_data
+from weather_rollup import build_rollup, load_rollup, weather_statistics
+
+def served():
+    weather_data = load_weather_data()
+    rollup = load_rollup()
+    return {'appended': appended, 'data_rows': len(weather_data), 'rollup_rows': rollup.rows,
+            'statistics_count': weather_statistics()[0]['count'],
+            'matches_rebuild': rollup.summary('month').equals(build_rollup(weather_data).summary('month')),
+            'pickle_written': os.path.exists('processed_weather_data.pkl')}
+
+runs = []
+appended = process_new_data()
+runs.append(served())
+for source, rows in json.loads(open('appended_rows.json').read()).items():
+    with open(SENSOR_SOURCES[source]['file'], 'a') as raw_file:
+        raw_file.writelines(rows)
+appended = process_new_data()
+runs.append(served())
+print(json.dumps(runs))
+'''
+
+# Runs the incremental processing once, appends Argyle Square readings without a valid time and runs it again, then
+# appends valid readings and runs it with the columnar append failing. Prints the state's offset and the size of the
+# export after the second run, and the rows of the processed data and of the rollup served after the failed run.
+FAILED_AND_INVALID_RUNS = """
+import json
+import os
+import incremental_processing
+from columnar_store import load_weather_data
+from incremental_processing import SENSOR_SOURCES, load_state, process_new_data
+from weather_rollup import load_rollup
+
+argyle_square_file = SENSOR_SOURCES['argyle_square']['file']
+process_new_data()
+with open(argyle_square_file, 'a') as raw_file:
+    raw_file.write('y,not a time,50.0,20.0,1010.0\\ny,,50.0,20.0,1010.0\\n')
+result = {'invalid_appended': process_new_data(), 'offset': load_state()['sources']['argyle_square']['offset'],
+          'size': os.path.getsize(argyle_square_file)}
+
+def fail(new_rows):
+    raise OSError('disk full')
+
+incremental_processing.append_columnar = fail
+with open(argyle_square_file, 'a') as raw_file:
+    raw_file.writelines(json.loads(open('appended_rows.json').read())['argyle_square'])
+try:
+    process_new_data()
+except OSError:
+    pass
+result.update(data_rows=len(load_weather_data()), rollup_rows=load_rollup().rows)
+print(json.dumps(result))
+"""
+
+
+def raw_exports(rows=400, seed=0, start='2024-01-01'):
+    # Hourly readings of two microclimate sensors and of Argyle Square from the start of 2024, or the given start, as
+    # the exports hold them. They are spread evenly over their range, so none of them is an outlier.
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=rows, freq='h', tz='UTC')
+    microclimate = pd.DataFrame({
+        'device_id': 'x',
+        'received_at': times.strftime('%Y-%m-%dT%H:%M:%S+0000'),
+        'sensorlocation': rng.choice(['Batman Park', '101 Collins St L11 Rooftop'], rows),
+        'latlong': 'a', 'minimumwinddirection': 1,
+        'airtemperature': rng.uniform(5, 25, rows).round(2),
+        'relativehumidity': rng.uniform(40, 80, rows).round(2),
+        'atmosphericpressure': rng.uniform(1000, 1020, rows).round(2),
+    })
+    argyle_square = pd.DataFrame({
+        'dev_id': 'y',
+        'time': times.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+        'relativehumidity': rng.uniform(40, 80, rows).round(1),
+        'airtemp': rng.uniform(5, 25, rows).round(1),
+        'atmosphericpressure': rng.uniform(1000, 1020, rows).round(1),
+    })
+    return microclimate, argyle_square
+
+
+@pytest.fixture
+def backend_dir(tmp_path):
+    # A copy of the modules, which keep their artifacts next to them, with raw exports of their own
+    for module in glob.glob(os.path.join(repo_dir, '*.py')):
+        if not os.path.basename(module).startswith('test_'):
+            shutil.copy(module, tmp_path)
+    microclimate, argyle_square = raw_exports()
+    microclimate.to_csv(tmp_path / 'microclimate-sensors-data.csv', index=False)
+    argyle_square.to_csv(tmp_path / 'meshed-sensor-type-1.csv', index=False)
+
+    # Readings appended after the first run: a late one at the time of the newest Argyle Square reading, and a few
+    # newer ones of every sensor
+    appended_microclimate, appended_argyle_square = raw_exports(rows=410, seed=1)
+    late_reading = argyle_square.tail(1).assign(relativehumidity=55.0)
+    appended = {
+        'microclimate': appended_microclimate.tail(10).to_csv(index=False, header=False).splitlines(True),
+        'argyle_square': pd.concat([late_reading, appended_argyle_square.tail(10)]).to_csv(
+            index=False, header=False).splitlines(True),
+    }
+    (tmp_path / 'appended_rows.json').write_text(json.dumps(appended))
+    return tmp_path
+
+
+def test_rollup_matches_served_data_after_incremental_run(backend_dir):
+    output = subprocess.run([sys.executable, '-c', INCREMENTAL_RUNS], cwd=backend_dir, capture_output=True,
+                            text=True, env=dict(os.environ, WEATHER_METRICS='0'))
+    assert output.returncode == 0, output.stderr
+    first_run, second_run = json.loads(output.stdout.splitlines()[-1])
+
+    assert first_run['appended'] == first_run['data_rows'] > 0
+    # The late reading is kept along with the newer ones
+    assert second_run['appended'] == 21
+    assert second_run['data_rows'] == first_run['data_rows'] + second_run['appended']
+    for run in (first_run, second_run):
+        assert run['rollup_rows'] == run['statistics_count'] == run['data_rows']
+        assert run['matches_rebuild']
+    # The processed data is only kept in the columnar store
+    assert not first_run['pickle_written'] and not second_run['pickle_written']
+
+
+def processed_rows(months, rows_per_month=50, locations=('Batman Park', 'CH1 rooftop'), seed=0):
+    # Processed rows with the compact dtypes, spread over the days of the given 2024 months
+    rng = np.random.default_rng(seed)
+    month = np.repeat(months, rows_per_month)
+    day = rng.integers(1, 29, len(month))
+    return pd.DataFrame({
+        'Date': (20240000 + month * 100 + day).astype('int32'),
+        'sensorlocation': pd.Categorical(rng.choice(locations, len(month))),
+        'airtemperature': rng.uniform(5, 25, len(month)).astype('float32'),
+        'month': month.astype('int8'),
+        'day': day.astype('int8'),
+        'hour': rng.integers(0, 24, len(month)).astype('int8'),
+    })
+
+
+def test_append_columnar_rewrites_only_the_partitions_it_touches(tmp_path):
+    from columnar_store import append_columnar, dataset_dir, read_columnar, write_columnar
+
+    stored = processed_rows([1, 2])
+    write_columnar(stored, root=tmp_path / 'store')
+    january = os.path.join(dataset_dir(tmp_path / 'store'), 'year=2024', 'month=01')
+    january_files = {name: (os.stat(os.path.join(january, name)).st_ino,
+                            open(os.path.join(january, name), 'rb').read()) for name in os.listdir(january)}
+
+    # New rows in February and March, with a sensor location the store has not seen yet
+    new_rows = processed_rows([2, 3], locations=('Batman Park', 'Tram Stop 7B'), seed=1)
+    assert append_columnar(new_rows, root=tmp_path / 'store')
+
+    january = os.path.join(dataset_dir(tmp_path / 'store'), 'year=2024', 'month=01')
+    assert sorted(os.listdir(january)) == sorted(january_files)
+    for name, (inode, content) in january_files.items():
+        assert os.stat(os.path.join(january, name)).st_ino == inode
+        assert open(os.path.join(january, name), 'rb').read() == content
+
+    # The store reads back as if the whole data had been written at once, in the processed order and by day
+    write_columnar(pd.concat([stored, new_rows], ignore_index=True), root=tmp_path / 'rebuilt')
+    for query in ({}, {'month': 2}, {'month': 3, 'day': 10}):
+        appended = read_columnar(root=tmp_path / 'store', **query)
+        rebuilt = read_columnar(root=tmp_path / 'rebuilt', **query)
+        pd.testing.assert_frame_equal(appended.astype({'sensorlocation': str}),
+                                      rebuilt.astype({'sensorlocation': str}))
+
+
+def test_read_columnar_keeps_the_processed_order(tmp_path):
+    # Rows of a single partition as of several come back in the order they were written, whole or filtered by month
+    from columnar_store import read_columnar, write_columnar
+
+    for months in ([1], [1, 2]):
+        weather_data = processed_rows(months)
+        write_columnar(weather_data, root=tmp_path / str(len(months)))
+        read = read_columnar(root=tmp_path / str(len(months))).astype({'sensorlocation': str})
+        pd.testing.assert_frame_equal(read, weather_data.astype({'sensorlocation': str}))
+        january = weather_data[weather_data['month'] == 1].reset_index(drop=True)
+        pd.testing.assert_frame_equal(read_columnar(month=1, root=tmp_path / str(len(months))).astype(
+            {'sensorlocation': str}), january.astype({'sensorlocation': str}))
+
+
+def test_append_columnar_leaves_store_when_columns_differ(tmp_path):
+    from columnar_store import append_columnar, dataset_dir, write_columnar
+
+    write_columnar(processed_rows([1]), root=tmp_path)
+    version = dataset_dir(tmp_path)
+    assert not append_columnar(processed_rows([1]).astype({'airtemperature': 'float64'}), root=tmp_path)
+    assert dataset_dir(tmp_path) == version
+
+
+def test_invalid_rows_are_skipped_and_failed_appends_leave_the_rollup(backend_dir):
+    output = subprocess.run([sys.executable, '-c', FAILED_AND_INVALID_RUNS], cwd=backend_dir, capture_output=True,
+                            text=True, env=dict(os.environ, WEATHER_METRICS='0'))
+    assert output.returncode == 0, output.stderr
+    result = json.loads(output.stdout.splitlines()[-1])
+
+    # The readings without a valid time are passed over once and never read again
+    assert result['invalid_appended'] == 0
+    assert result['offset'] == result['size']
+    # The rollup served is the one of the data served, the failed append added its rows to neither
+    assert result['rollup_rows'] == result['data_rows']
@@ -0,0 +1,328 @@
+import asyncio
+import json
+import joblib
+import os
+import threading
+import pandas as pd
+import pytest
+import prediction_service
+from model_registry import model_registry
+from prediction_cache import cached_prediction, prediction_cache
+from prediction_service import PredictionService
+from training_orchestrator import MODEL_CLASSES
+
+
+class FakeLivePredictor:
+    # Computes a monthly prediction through the prediction cache, as the live fallback of the forecast store does
+    @cached_prediction()
+    def predict(self, name, month=None):
+        return pd.DataFrame({'Date': ['01', '02'], 'Prediction': [month] * 2})
+
+
+class FakeForecastStore:
+    # Answers like the materialized forecasts, a regression's numbers or a classifier's labels, loaded through the
+    # model registry as the forecast tables are, and records the calls
+    def __init__(self, forecast_file):
+        self.forecast_file = forecast_file
+        self.live_predictor = FakeLivePredictor()
+        self.calls = []
+
+    def prediction(self, name):
+        kind = 'classification' if name.endswith('classification') else 'regression'
+        return model_registry.get(self.forecast_file)[kind]
+
+    def predict(self, name, month=None):
+        self.calls.append((name, 'predict', month))
+        return pd.DataFrame({'Date': ['01', '02'], 'Prediction': [self.prediction(name)] * 2})
+
+    def predict_day(self, name, date='01-01'):
+        self.calls.append((name, 'predict_day', date))
+        return pd.DataFrame({'hour': [0, 1], 'Prediction': [self.prediction(name)] * 2})
+
+    def stats(self):
+        return {'hits': len(self.calls), 'misses': 0}
+
+
+@pytest.fixture
+def forecast_store(monkeypatch, tmp_path):
+    forecast_file = str(tmp_path / 'forecast_fake.pkl')
+    joblib.dump({'regression': 15.5, 'classification': 'moderate'}, forecast_file)
+    store = FakeForecastStore(forecast_file)
+    monkeypatch.setattr(prediction_service, 'forecast_store', store)
+    return store
+
+
+def serve_requests(*requests):
+    # Drives one service's router the way the HTTP front end does, with the bodies JSON encoded, one request after
+    # the other
+    async def serve():
+        service = PredictionService(workers=2)
+        try:
+            responses = []
+            for method, path, *arguments in requests:
+                body = json.dumps(arguments[0]).encode() if arguments else b''
+                responses.append(await service.route(method, path, body))
+            return responses
+        finally:
+            service.close()
+
+    return asyncio.run(serve())
+
+
+def route(method, path, arguments=None):
+    return serve_requests((method, path) + (() if arguments is None else (arguments,)))[0]
+
+
+@pytest.mark.parametrize('name', MODEL_CLASSES)
+def test_monthly_view_requests(forecast_store, name):
+    # MonthlyForecast.jsx and DataVisualization.jsx post the selected month as a number
+    status, payload = route('POST', f'/prediction/{name}/monthly', {'month': 3})
+
+    assert status == 200
+    assert payload == {'Predictions': forecast_store.predict(name, 3).to_dict('records')}
+    assert forecast_store.calls[0] == (name, 'predict', 3)
+
+
+@pytest.mark.parametrize('name', MODEL_CLASSES)
+def test_daily_view_requests(forecast_store, name):
+    # DailyForecast.jsx posts the selected date formatted as 'dd-MM'
+    status, payload = route('POST', f'/prediction/{name}/day-hourly', {'date': '05-03'})
+
+    assert status == 200
+    assert payload == {'Predictions': forecast_store.predict_day(name, '05-03').to_dict('records')}
+    assert forecast_store.calls[0] == (name, 'predict_day', '05-03')
+
+
+def test_preflight_and_unknown_routes(forecast_store):
+    assert route('OPTIONS', '/prediction/temperature-regression/monthly')[0] == 204
+    assert route('POST', '/prediction/temperature-regression/')[0] == 404
+    assert route('POST', '/prediction/wind-regression/monthly', {'month': 3})[0] == 404
+    assert route('POST', '/prediction/temperature-regression/monthly', {'month': 13})[0] == 400
+    assert route('POST', '/prediction/temperature-regression/day-hourly', {'date': '2024-03-05'})[0] == 400
+    assert not forecast_store.calls
+
+
+@pytest.mark.parametrize('view, arguments, method', [('monthly', {'month': 3}, 'predict'),
+                                                     ('day-hourly', {'date': '05-03'}, 'predict_day')])
+def test_combined_view_requests(forecast_store, view, arguments, method):
+    # One request answers with the series of all four models, each as its own endpoint returns it
+    status, payload = route('POST', f'/prediction/combined/{view}', arguments)
+
+    assert status == 200
+    assert list(payload['Predictions']) == list(MODEL_CLASSES)
+    for name in MODEL_CLASSES:
+        expected = getattr(forecast_store, method)(name, *arguments.values()).to_dict('records')
+        assert payload['Predictions'][name] == expected
+    assert forecast_store.calls[:len(MODEL_CLASSES)] == [(name, method, *arguments.values()) for name in MODEL_CLASSES]
+
+
+def test_stats_report_forecast_lookups_and_artifact_loads(forecast_store):
+    responses = serve_requests(('POST', '/prediction/temperature-regression/monthly', {'month': 3}),
+                               ('POST', '/prediction/humidity-regression/day-hourly', {'date': '05-03'}),
+                               ('GET', '/stats'))
+    status, stats = responses[-1]
+
+    assert status == 200
+    assert stats['requests'] == 2
+    assert stats['forecast_hits'] == 2
+    artifact = stats['artifacts'][forecast_store.forecast_file]
+    assert artifact == model_registry.metrics()[forecast_store.forecast_file]
+    assert artifact['loads'] == 1 and artifact['size_bytes'] > 0 and artifact['load_seconds'] >= 0
+
+
+def test_stats_report_prediction_cache_counts(forecast_store, monkeypatch):
+    # Every monthly prediction is computed live, the second identical request is answered from the cache
+    monkeypatch.setattr(forecast_store, 'predict', lambda name, month=None: forecast_store.live_predictor.predict(
+        name, month))
+    hits = prediction_cache.stats()['hits']
+    responses = serve_requests(('POST', '/prediction/temperature-regression/monthly', {'month': 4}),
+                               ('POST', '/prediction/temperature-regression/monthly', {'month': 4}),
+                               ('GET', '/stats'))
+    status, stats = responses[-1]
+
+    assert status == 200
+    assert responses[0] == responses[1]
+    assert {key: stats[f'cache_{key}'] for key in prediction_cache.stats()} == prediction_cache.stats()
+    assert stats['cache_hits'] == hits + 1
+
+
+def test_metrics_serve_the_request_spans(forecast_store):
+    responses = serve_requests(('POST', '/prediction/temperature-classification/day-hourly', {'date': '05-03'}),
+                               ('GET', '/metrics'))
+    status, text = responses[-1]
+
+    assert status == 200
+    assert text.startswith('# TYPE weather_span_seconds histogram\n')
+    span = 'span="service.temperature-classification.predict_day"'
+    assert f'weather_span_seconds_bucket{{{span},le="+Inf"}}' in text
+    assert f'weather_span_seconds_count{{{span}}}' in text
+
+
+class RecordingWriter:
+    # Stands in for the stream writer of a connection and keeps what the service wrote to it
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class BlockingPrediction:
+    # Stands in for run_prediction in the worker threads: every call blocks until released, and is counted
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.calls = []
+
+    def __call__(self, name, method, argument):
+        self.calls.append((name, method, argument))
+        self.started.release()
+        self.release.wait(timeout=10)
+        return [{'Prediction': argument}], os.getpid(), prediction_service.worker_stats()
+
+    async def wait_started(self, count=1):
+        for _ in range(count):
+            assert await asyncio.to_thread(self.started.acquire, timeout=10)
+
+
+@pytest.fixture
+def blocking_prediction(monkeypatch, forecast_store):
+    prediction = BlockingPrediction()
+    monkeypatch.setattr(prediction_service, 'run_prediction', prediction)
+    yield prediction
+    prediction.release.set()
+
+
+def test_identical_concurrent_requests_share_one_computation(blocking_prediction):
+    async def serve():
+        service = PredictionService(workers=2)
+        try:
+            requests = [asyncio.ensure_future(service.predict('temperature-regression', 3)) for _ in range(5)]
+            await blocking_prediction.wait_started()
+            assert len(service.in_flight) == 1
+            blocking_prediction.release.set()
+            return await asyncio.gather(*requests), service.stats
+        finally:
+            service.close()
+
+    results, stats = asyncio.run(serve())
+
+    assert blocking_prediction.calls == [('temperature-regression', 'predict', 3)]
+    assert results == [[{'Prediction': 3}]] * 5
+    assert stats['requests'] == 5 and stats['computed'] == 1 and stats['coalesced'] == 4
+
+
+def test_cancelled_caller_leaves_the_shared_computation_running(blocking_prediction):
+    async def serve():
+        service = PredictionService(workers=1)
+        try:
+            leaving = asyncio.ensure_future(service.predict_day('humidity-regression', '05-03'))
+            staying = asyncio.ensure_future(service.predict_day('humidity-regression', '05-03'))
+            await blocking_prediction.wait_started()
+            leaving.cancel()
+            await asyncio.sleep(0)
+            assert leaving.cancelled() and len(service.in_flight) == 1
+            blocking_prediction.release.set()
+            return await staying
+        finally:
+            service.close()
+
+    assert asyncio.run(serve()) == [{'Prediction': '05-03'}]
+    assert len(blocking_prediction.calls) == 1
+
+
+def test_requests_beyond_the_queue_are_turned_away(blocking_prediction):
+    # One worker busy and one distinct prediction waiting for it fill a queue of one, so a third distinct prediction
+    # is rejected, while a request identical to the waiting one still joins it
+    async def serve():
+        service = PredictionService(workers=1, max_queue=1)
+        try:
+            running = asyncio.ensure_future(service.predict('temperature-regression', 1))
+            await blocking_prediction.wait_started()
+            waiting = asyncio.ensure_future(service.predict('temperature-regression', 2))
+            for _ in range(10):
+                await asyncio.sleep(0)
+            assert service.queued == 1
+            with pytest.raises(prediction_service.ServiceOverloaded):
+                await service.predict('temperature-regression', 3)
+            status, payload = await service.route('POST', '/prediction/humidity-regression/monthly', b'')
+            writer = RecordingWriter()
+            await service.respond(writer, status, payload)
+            joined = asyncio.ensure_future(service.predict('temperature-regression', 2))
+            blocking_prediction.release.set()
+            return writer.data, await asyncio.gather(running, waiting, joined), service.stats
+        finally:
+            service.close()
+
+    response, results, stats = asyncio.run(serve())
+
+    assert response.startswith(b'HTTP/1.1 503 Service Unavailable\r\n')
+    assert b'\r\nRetry-After: 1\r\n' in response
+    assert results == [[{'Prediction': 1}], [{'Prediction': 2}], [{'Prediction': 2}]]
+    assert stats['rejected'] == 2 and stats['computed'] == 2 and stats['coalesced'] == 1
+
+
+def exchange(data):
+    # Feeds raw bytes to the HTTP front end as one connection and returns what it answered
+    async def serve():
+        service = PredictionService(workers=1)
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        writer = RecordingWriter()
+        try:
+            await service.handle_connection(reader, writer)
+        finally:
+            service.close()
+        assert writer.closed
+        return writer.data
+
+    return asyncio.run(serve())
+
+
+def test_keep_alive_requests_are_answered_in_turn(forecast_store):
+    body = json.dumps({'month': 3}).encode()
+    request = (b'POST /prediction/temperature-regression/monthly HTTP/1.1\r\nContent-Type: application/json\r\n'
+               b'Content-Length: %d\r\n\r\n' % len(body) + body)
+    response = exchange(request + request)
+
+    assert response.count(b'HTTP/1.1 200 OK\r\n') == 2
+    assert response.count(json.dumps({'Predictions': forecast_store.predict('temperature-regression', 3).to_dict(
+        'records')}).encode()) == 2
+
+
+@pytest.mark.parametrize('request_head', [
+    b'garbage\r\n\r\n',
+    b'POST /prediction/temperature-regression/monthly\r\n\r\n',
+    b'POST /prediction/temperature-regression/monthly HTTP/1.1\r\nContent-Length: ten\r\n\r\n',
+    b'POST /prediction/temperature-regression/monthly HTTP/1.1\r\nContent-Length: -1\r\n\r\n',
+    b'POST /prediction/temperature-regression/monthly HTTP/1.1\r\nno colon\r\n\r\n',
+    b'GET /' + b'a' * 70000 + b' HTTP/1.1\r\n\r\n',
+], ids=['request line', 'no version', 'length not a number', 'negative length', 'header line', 'line too long'])
+def test_unparseable_requests_get_400_and_close(forecast_store, request_head):
+    # The request after an unparseable one is never read
+    response = exchange(request_head + b'GET /stats HTTP/1.1\r\n\r\n')
+
+    assert response.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+    assert b'\r\nConnection: close\r\n' in response
+    assert response.count(b'HTTP/1.1') == 1
+    assert not forecast_store.calls
+
+
+def test_chunked_bodies_get_411_and_close(forecast_store):
+    response = exchange(b'POST /prediction/temperature-regression/monthly HTTP/1.1\r\n'
+                        b'Transfer-Encoding: chunked\r\n\r\n'
+                        b'd\r\n{"month": 3}\r\n0\r\n\r\n'
+                        b'GET /stats HTTP/1.1\r\n\r\n')
+
+    assert response.startswith(b'HTTP/1.1 411 Length Required\r\n')
+    assert b'\r\nConnection: close\r\n' in response
+    assert response.count(b'HTTP/1.1') == 1
+    assert not forecast_store.calls
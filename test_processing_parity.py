@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from test_incremental_processing import backend_dir, raw_exports  # noqa: F401
+
+# Processes the raw exports in full, in chunks and in shards with one and two workers, each path in a process of its
+# own as the category encodings are kept across runs, and saves the frame it returned in parity_<path>.pkl. The
+# shards are the exports split in halves.
+PROCESSING_PATH = '''
+import sys
+import pandas as pd
+from data_processing import process_and_clean_data
+from sharded_processing import process_sharded_data
+
+path = sys.argv[1]
+if path == 'full':
+    weather_data = process_and_clean_data()
+elif path == 'chunked':
+    weather_data = process_and_clean_data(chunksize=97)
+else:
+    weather_data = process_sharded_data('microclimate-shard-*.csv', 'argyle-square-shard-*.csv',
+                                        workers=int(path.split('-')[1]))
+weather_data.to_pickle(f'parity_{path}.pkl')
+'''
+
+PATHS = ['full', 'chunked', 'sharded-1', 'sharded-2']
+
+
+def messy_exports(rows=400):
+    # The raw exports with missing and unparseable readings, a few outliers, readings without a valid time and an
+    # unknown sensor location, so every cleaning step has rows to act on
+    microclimate, argyle_square = raw_exports(rows)
+    rng = np.random.default_rng(2)
+    for export, readings in ((microclimate, ['airtemperature', 'relativehumidity', 'atmosphericpressure']),
+                             (argyle_square, ['airtemp', 'relativehumidity', 'atmosphericpressure'])):
+        export[readings] = export[readings].astype(object)
+        for column in readings:
+            export.loc[rng.choice(rows, 8, replace=False), column] = np.nan
+            export.loc[rng.choice(rows, 3, replace=False), column] = 500.0
+        export.loc[rng.choice(rows, 2, replace=False), readings[0]] = 'n/a'
+    microclimate.loc[[5, 6], 'received_at'] = ['not a time', np.nan]
+    microclimate.loc[7, 'sensorlocation'] = 'Unknown St'
+    argyle_square.loc[9, 'time'] = np.nan
+    return microclimate, argyle_square
+
+
+def write_exports(backend_dir):
+    microclimate, argyle_square = messy_exports()
+    microclimate.to_csv(backend_dir / 'microclimate-sensors-data.csv', index=False)
+    argyle_square.to_csv(backend_dir / 'meshed-sensor-type-1.csv', index=False)
+    for name, export in (('microclimate', microclimate), ('argyle-square', argyle_square)):
+        half = len(export) // 2 + 1
+        export.iloc[:half].to_csv(backend_dir / f'{name}-shard-0.csv', index=False)
+        export.iloc[half:].to_csv(backend_dir / f'{name}-shard-1.csv', index=False)
+
+
+@pytest.fixture
+def processed_frames(backend_dir):
+    write_exports(backend_dir)
+    frames = {}
+    for path in PATHS:
+        output = subprocess.run([sys.executable, '-c', PROCESSING_PATH, path], cwd=backend_dir, capture_output=True,
+                                text=True, env=dict(os.environ, WEATHER_METRICS='0'))
+        assert output.returncode == 0, output.stderr
+        frames[path] = pd.read_pickle(backend_dir / f'parity_{path}.pkl')
+    return frames
+
+
+def test_processing_paths_produce_the_same_frame(processed_frames):
+    full = processed_frames['full']
+    # Some rows of every kind were dropped, and the rest kept
+    assert 0 < len(full) < 800
+    for path in PATHS[1:]:
+        pd.testing.assert_frame_equal(processed_frames[path], full, obj=f'{path} processing')
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from data_processing import parse_timestamps
+from raw_data_cache import build_cache, read_raw_csv
+
+COLUMNS = ['time', 'location', 'reading']
+DTYPES = {'time': str, 'location': str}
+PARSERS = {'time': parse_timestamps}
+
+
+def raw_export(file_path, rows=1000, reading=0.0):
+    # Readings timed as the exports time them. The first rows carry no fraction of a second and the later ones do,
+    # so a format inferred from the first value of a chunk differs between the chunks.
+    times = pd.date_range('2024-01-01', periods=rows, freq='min', tz='UTC')
+    time_text = np.where(np.arange(rows) < rows // 2, times.strftime('%Y-%m-%dT%H:%M:%S+0000'),
+                         times.strftime('%Y-%m-%dT%H:%M:%S.000Z'))
+    pd.DataFrame({'time': time_text, 'location': np.where(np.arange(rows) % 2, 'Batman Park', 'Argyle Square'),
+                  'reading': reading + np.arange(rows) / 10}).to_csv(file_path, index=False)
+
+
+def test_chunked_build_parses_like_a_full_read(tmp_path):
+    raw_export(tmp_path / 'export.csv')
+    expected = pd.read_csv(tmp_path / 'export.csv', usecols=COLUMNS, dtype=DTYPES)
+    # The cache keeps the times in nanoseconds
+    expected['time'] = parse_timestamps(expected['time']).astype('datetime64[ns, UTC]')
+
+    # The cache is built in chunks, then read whole and in chunks from it
+    build_cache(tmp_path / 'export.csv', COLUMNS, DTYPES, PARSERS, chunksize=100, cache_dir=tmp_path / 'cache')
+    cached = read_raw_csv(tmp_path / 'export.csv', COLUMNS, DTYPES, PARSERS, cache_dir=tmp_path / 'cache')
+    chunks = list(read_raw_csv(tmp_path / 'export.csv', COLUMNS, DTYPES, PARSERS, chunksize=100,
+                               cache_dir=tmp_path / 'cache'))
+
+    assert expected['time'].notna().all()
+    pd.testing.assert_frame_equal(pd.concat(chunks), cached)
+    pd.testing.assert_frame_equal(cached, expected)
+
+
+def test_chunked_read_keeps_reading_the_entry_it_opened(tmp_path):
+    raw_export(tmp_path / 'export.csv')
+    build_cache(tmp_path / 'export.csv', COLUMNS, DTYPES, PARSERS, cache_dir=tmp_path / 'cache')
+    chunks = read_raw_csv(tmp_path / 'export.csv', COLUMNS, DTYPES, PARSERS, chunksize=100,
+                          cache_dir=tmp_path / 'cache')
+    first_chunk = next(chunks)
+
+    # The export is rewritten with other readings and its cache rebuilt while the chunks are being read
+    raw_export(tmp_path / 'export.csv', rows=800, reading=1000.0)
+    build_cache(tmp_path / 'export.csv', COLUMNS, DTYPES, PARSERS, cache_dir=tmp_path / 'cache')
+    weather_data = pd.concat([first_chunk] + list(chunks))
+
+    assert len(weather_data) == 1000
+    np.testing.assert_allclose(weather_data['reading'], np.arange(1000) / 10)
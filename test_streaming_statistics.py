@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from streaming_statistics import ColumnStatistics
+
+
+def synthetic_readings(rows=200000, seed=42):
+    # Normal readings with a few missing values, as the sensor exports hold them
+    rng = np.random.default_rng(seed)
+    readings = pd.Series(rng.normal(15, 6, rows))
+    readings[rng.random(rows) < 0.02] = np.nan
+    return readings
+
+
+def merged_statistics(readings, chunks=10, quantile_error=None):
+    # Statistics of every chunk, merged into the first chunk's, as the chunked and sharded processing merge them
+    statistics = []
+    for chunk in np.array_split(readings, chunks):
+        statistics.append(ColumnStatistics(quantile_error=quantile_error))
+        statistics[-1].update(chunk)
+    for other in statistics[1:]:
+        statistics[0].merge(other)
+    return statistics[0]
+
+
+def test_exact_statistics_match_pandas():
+    readings = synthetic_readings()
+    statistics = merged_statistics(readings)
+    expected = readings.fillna(readings.mean()).round(1)
+
+    assert statistics.count == len(readings)
+    assert statistics.mean == pytest.approx(readings.mean(), rel=1e-12)
+    for q in [0.25, 0.5, 0.75]:
+        assert statistics.quantile(q) == expected.quantile(q)
+
+
+@pytest.mark.parametrize('quantile_error', [0.01, 0.001])
+def test_sketch_rank_error_within_bound_after_merging(quantile_error):
+    readings = synthetic_readings()
+    statistics = merged_statistics(readings, quantile_error=quantile_error)
+    expected = readings.fillna(readings.mean()).round(1)
+
+    assert statistics.mean == pytest.approx(readings.mean(), rel=1e-12)
+    for q in [0.25, 0.75]:
+        estimate = statistics.quantile(q)
+        # Readings tie after rounding, so any rank between the first and last copy of the estimate is exact
+        rank_error = max(0, (expected < estimate).mean() - q, q - (expected <= estimate).mean())
+        assert rank_error <= quantile_error
+
+
+def test_sketch_is_deterministic_by_default():
+    readings = synthetic_readings(rows=50000)
+    first = merged_statistics(readings, quantile_error=0.01)
+    second = merged_statistics(readings, quantile_error=0.01)
+
+    assert first.iqr_bounds() == second.iqr_bounds()
@@ -0,0 +1,111 @@
+import argparse
+import contextlib
+import importlib
+import io
+import joblib
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from columnar_store import load_weather_data
+from forecast_materialization import materialize_forecasts
+
+# Module and class of every model, keyed like the /prediction/<model>/ endpoints
+MODEL_CLASSES = {
+    'temperature-regression': ('temperature_random_forest_regression', 'TemperatureRegressor'),
+    'humidity-regression': ('humidity_random_forest_regression', 'HumidityRegressor'),
+    'temperature-classification': ('temperature_classification', 'TemperatureClassifier'),
+    'humidity-classification': ('humidity_classification', 'HumidityClassifier'),
+}
+
+
+def train_model(name, weather_data_file, tree_jobs, incremental=False, evaluate=False):
+    # Trains one model in a worker process. The processed dataset is memory-mapped from the file the orchestrator wrote,
+    # so its numeric columns are shared with the other workers instead of copied. Returns the training time and the
+    # evaluation the model printed, with evaluate. With incremental, the trained model is refreshed with the new
+    # readings instead.
+    module_name, class_name = MODEL_CLASSES[name]
+    predictor = getattr(importlib.import_module(module_name), class_name)()
+    predictor.weather_data = joblib.load(weather_data_file, mmap_mode='r')
+    predictor.model.set_params(n_jobs=tree_jobs)
+
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        predictor.train(incremental, evaluate)
+    return name, time.perf_counter() - start, output.getvalue()
+
+
+def split_cores(cores, model_count, model_workers=None):
+    # Splitting the core budget between models trained at the same time and trees grown in parallel inside each model
+    if model_workers is None:
+        model_workers = min(model_count, cores)
+    model_workers = max(1, min(model_workers, model_count, cores))
+    return model_workers, max(1, cores // model_workers)
+
+
+def train_models(names=None, cores=None, model_workers=None, incremental=False, evaluate=False):
+    # Trains the given models, all four by default, concurrently in a process pool, then materializes their forecasts,
+    # and returns the wall clock time, the time of every model and the time spent materializing
+    names = list(names or MODEL_CLASSES)
+    for name in names:
+        if name not in MODEL_CLASSES:
+            raise ValueError(f"Unknown model {name!r}, expected one of {', '.join(MODEL_CLASSES)}")
+    model_workers, tree_jobs = split_cores(cores or os.cpu_count(), len(names), model_workers)
+
+    start = time.perf_counter()
+    # Loading the processed dataset once and writing it where every worker can memory-map it
+    shared_dir = tempfile.mkdtemp(prefix='weather_training_')
+    weather_data_file = os.path.join(shared_dir, 'weather_data.pkl')
+    joblib.dump(load_weather_data(), weather_data_file)
+    load_seconds = time.perf_counter() - start
+
+    model_seconds = {}
+    try:
+        with ProcessPoolExecutor(max_workers=model_workers) as executor:
+            futures = [executor.submit(train_model, name, weather_data_file, tree_jobs, incremental, evaluate)
+                       for name in names]
+            for future in as_completed(futures):
+                name, seconds, output = future.result()
+                model_seconds[name] = seconds
+                print(f"{name} ({seconds:.2f}s)")
+                print(output)
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+    # Precomputing every monthly and daily forecast of the new models, once they are all saved
+    materialize_start = time.perf_counter()
+    materialize_forecasts(names)
+    materialize_seconds = time.perf_counter() - materialize_start
+
+    return {
+        'wall_seconds': time.perf_counter() - start,
+        'load_seconds': load_seconds,
+        'model_seconds': model_seconds,
+        'materialize_seconds': materialize_seconds,
+        'model_workers': model_workers,
+        'tree_jobs': tree_jobs,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the temperature and humidity models in parallel')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='total number of cores to use')
+    parser.add_argument('--model-workers', type=int, help='number of models trained at the same time')
+    parser.add_argument('--incremental', action='store_true',
+                        help='refresh the trained models with the readings that are new since they were trained')
+    parser.add_argument('--evaluate', action='store_true',
+                        help='also score each model on the most recent days with a copy fitted on the days before')
+    parser.add_argument('models', nargs='*', metavar='model',
+                        help=f"models to train, all by default: {', '.join(MODEL_CLASSES)}")
+    args = parser.parse_args()
+
+    report = train_models(args.models, args.cores, args.model_workers, args.incremental, args.evaluate)
+    print(f"Trained {len(report['model_seconds'])} models with {report['model_workers']} worker(s) of "
+          f"{report['tree_jobs']} tree job(s) each")
+    print(f"Loading the dataset: {report['load_seconds']:.2f}s")
+    for name, seconds in report['model_seconds'].items():
+        print(f"{name}: {seconds:.2f}s")
+    print(f"Materializing the forecasts: {report['materialize_seconds']:.2f}s")
+    print(f"Wall clock: {report['wall_seconds']:.2f}s")
@@ -0,0 +1,207 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import os
+from columnar_store import dataset_version, load_weather_data
+from data_processing import expand_readings
+from model_registry import artifact_version, model_registry, save_artifact
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+ROLLUP_FILE_NAME = 'weather_rollup.pkl'
+
+# The keys of the rollup cells, with the number of values each key takes. Locations are added as they show up.
+ROLLUP_KEYS = ['location', 'month', 'day', 'hour']
+ROLLUP_SHAPE = {'month': 12, 'day': 31, 'hour': 24}
+
+# The readings the rollup aggregates, under the names its summaries give them
+ROLLUP_READINGS = {'temperature': 'airtemperature', 'humidity': 'relativehumidity', 'pressure': 'atmosphericpressure'}
+
+
+class UnknownLocation(Exception):
+    pass
+
+
+class WeatherRollup:
+    # Count, sum, sum of squares, minimum and maximum of every reading per (location, month, day, hour) cell, over
+    # all the years of the data, in dense arrays of a few hundred thousand cells. Any coarser grain is answered by
+    # reducing the cells it covers instead of scanning the rows, and new rows are added to their cells as they
+    # arrive, so the rollup never has to be rebuilt.
+    def __init__(self):
+        shape = (0,) + tuple(ROLLUP_SHAPE.values())
+        self.locations = []
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.sums = {reading: np.zeros(shape) for reading in ROLLUP_READINGS}
+        self.squares = {reading: np.zeros(shape) for reading in ROLLUP_READINGS}
+        self.minimums = {reading: np.full(shape, np.inf) for reading in ROLLUP_READINGS}
+        self.maximums = {reading: np.full(shape, -np.inf) for reading in ROLLUP_READINGS}
+        self.rows = 0
+        self.dataset = None  # Version of the processed data the rollup summarizes, set when it is saved
+
+    def add_locations(self, locations):
+        # Growing every array by the cells of the locations not seen before
+        def grow(array, fill):
+            extra = np.full((len(locations),) + array.shape[1:], fill, dtype=array.dtype)
+            return np.concatenate([array, extra])
+
+        if not locations:
+            return
+        self.locations.extend(locations)
+        self.count = grow(self.count, 0)
+        for reading in ROLLUP_READINGS:
+            self.sums[reading] = grow(self.sums[reading], 0)
+            self.squares[reading] = grow(self.squares[reading], 0)
+            self.minimums[reading] = grow(self.minimums[reading], np.inf)
+            self.maximums[reading] = grow(self.maximums[reading], -np.inf)
+
+    def update(self, weather_data):
+        # Adds processed rows to their cells. The readings are expanded to the float64 values they were processed to,
+        # so the sums match the ones of the processed data.
+        if not len(weather_data):
+            return self
+        codes, uniques = pd.factorize(weather_data['sensorlocation'])
+        self.add_locations([location for location in uniques if location not in self.locations])
+        location = np.array([self.locations.index(location) for location in uniques], dtype=np.int64)[codes]
+        cells = np.ravel_multi_index((location, weather_data['month'].to_numpy(dtype=np.int64) - 1,
+                                      weather_data['day'].to_numpy(dtype=np.int64) - 1,
+                                      weather_data['hour'].to_numpy(dtype=np.int64)), self.count.shape)
+
+        size = self.count.size
+        self.count += np.bincount(cells, minlength=size).reshape(self.count.shape)
+        for reading, column in ROLLUP_READINGS.items():
+            values = expand_readings(weather_data[column]).to_numpy(dtype=np.float64)
+            self.sums[reading] += np.bincount(cells, values, minlength=size).reshape(self.count.shape)
+            self.squares[reading] += np.bincount(cells, values * values, minlength=size).reshape(self.count.shape)
+            np.minimum.at(self.minimums[reading].reshape(-1), cells, values)
+            np.maximum.at(self.maximums[reading].reshape(-1), cells, values)
+        self.rows += len(weather_data)
+        return self
+
+    def select(self, key, value):
+        # Slice of a key's axis holding the cells matching its value, all of them for None. A slice keeps the axis and
+        # takes a view of the cells, never a copy.
+        if value is None:
+            return slice(None)
+        if key == 'location':
+            if value not in self.locations:
+                raise UnknownLocation(f'Unknown sensor location {value!r}')
+            index = self.locations.index(value)
+        else:
+            index = int(value) - (0 if key == 'hour' else 1)
+            if not 0 <= index < ROLLUP_SHAPE[key]:
+                raise ValueError(f'{key} {value} is out of range')
+        return slice(index, index + 1)
+
+    def summary(self, by=(), location=None, month=None, day=None, hour=None):
+        # Count, mean, standard deviation, minimum and maximum of every reading per group of the by keys, over the
+        # cells matching the given key values. Groups without readings are left out.
+        by = [by] if isinstance(by, str) else list(by)
+        for key in by:
+            if key not in ROLLUP_KEYS:
+                raise ValueError(f"Unknown key {key!r}, expected one of {', '.join(ROLLUP_KEYS)}")
+        filters = {'location': location, 'month': month, 'day': day, 'hour': hour}
+        cells = tuple(self.select(key, filters[key]) for key in ROLLUP_KEYS)
+        axes = tuple(axis for axis, key in enumerate(ROLLUP_KEYS) if key not in by)
+
+        def reduce(array, function):
+            # At least one dimension, so the whole selection is a single group when there are no by keys
+            return np.atleast_1d(function(array[cells], axis=axes))
+
+        count = reduce(self.count, np.sum)
+        groups = np.nonzero(count)
+        # The values of the by keys every group stands for, with the groups ordered as ROLLUP_KEYS
+        summary = {}
+        for key, positions in zip([key for key in ROLLUP_KEYS if key in by], groups):
+            axis = ROLLUP_KEYS.index(key)
+            values = np.arange(self.count.shape[axis])[cells[axis]]
+            if key == 'location':
+                summary[key] = [self.locations[value] for value in values[positions]]
+            else:
+                summary[key] = values[positions] + (0 if key == 'hour' else 1)
+        count = count[groups]
+        summary = pd.DataFrame(summary)
+        summary['count'] = count
+        for reading in ROLLUP_READINGS:
+            sums = reduce(self.sums[reading], np.sum)[groups]
+            squares = reduce(self.squares[reading], np.sum)[groups]
+            mean = sums / count
+            # Sample variance from the sums, clipped at 0 where rounding leaves it slightly negative
+            with np.errstate(divide='ignore', invalid='ignore'):
+                variance = np.clip(squares - sums * mean, 0, None) / (count - 1)
+            summary[f'{reading}_mean'] = mean
+            summary[f'{reading}_std'] = np.where(count > 1, np.sqrt(variance), np.nan)
+            summary[f'{reading}_min'] = reduce(self.minimums[reading], np.min)[groups]
+            summary[f'{reading}_max'] = reduce(self.maximums[reading], np.max)[groups]
+        # Locations are numbered as they showed up, the groups are returned in the order of their keys
+        return summary.sort_values(by, ignore_index=True) if 'location' in by else summary
+
+
+def build_rollup(weather_data):
+    return WeatherRollup().update(weather_data)
+
+
+def save_rollup(rollup, sources=None):
+    # Saved along with the version of the processed data it summarizes, which is written before it
+    rollup.dataset = dataset_version()
+    save_artifact(rollup, ROLLUP_FILE_NAME, sources=sources)
+
+
+def load_rollup():
+    # The rollup of the processed data the predictors read. It is built from the data when preprocessing did not write
+    # it yet, or when it summarizes another version of the data than the current one.
+    if artifact_version(ROLLUP_FILE_NAME) is not None:
+        rollup = model_registry.get(ROLLUP_FILE_NAME)
+        if getattr(rollup, 'dataset', None) == dataset_version():
+            return rollup
+    save_rollup(build_rollup(load_weather_data()))
+    return model_registry.get(ROLLUP_FILE_NAME)
+
+
+def weather_statistics(by=(), location=None, month=None, day=None, hour=None):
+    # JSON-ready records of the summary, as the prediction service returns them
+    summary = load_rollup().summary(by, location, month, day, hour)
+    return summary.astype(object).where(summary.notna(), None).to_dict('records')
+
+
+def scan_statistics(weather_data, by=(), location=None, month=None, day=None, hour=None):
+    # The same summary computed by scanning the rows, which the rollup is checked and timed against
+    filters = {'sensorlocation': location, 'month': month, 'day': day, 'hour': hour}
+    rows = np.ones(len(weather_data), dtype=bool)
+    for column, value in filters.items():
+        if value is not None:
+            rows &= (weather_data[column] == value).to_numpy()
+    readings = expand_readings(weather_data.loc[rows, list(ROLLUP_READINGS.values())])
+    columns = ['sensorlocation' if key == 'location' else key for key in by]
+    groups = readings.groupby([weather_data.loc[rows, column].astype(str if column == 'sensorlocation' else int)
+                               for column in columns]) if columns else readings.groupby(np.zeros(len(readings)))
+    return groups.agg(['count', 'mean', 'std', 'min', 'max'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize the readings from the rollup of the processed data')
+    parser.add_argument('--by', nargs='*', default=[], choices=ROLLUP_KEYS, help='keys to group the summary by')
+    parser.add_argument('--location', help='sensor location to summarize')
+    parser.add_argument('--month', type=int)
+    parser.add_argument('--day', type=int)
+    parser.add_argument('--hour', type=int)
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the rollup from the processed data first')
+    parser.add_argument('--compare', action='store_true', help='time the summary against a scan of the rows')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        start = time.perf_counter()
+        save_rollup(build_rollup(load_weather_data()))
+        print(f'Rebuilt the rollup in {time.perf_counter() - start:.2f}s')
+    query = (args.by, args.location, args.month, args.day, args.hour)
+    rollup = load_rollup()
+    start = time.perf_counter()
+    summary = rollup.summary(*query)
+    rollup_seconds = time.perf_counter() - start
+    with pd.option_context('display.max_rows', 50, 'display.width', 200):
+        print(summary)
+    if args.compare:
+        weather_data = load_weather_data()
+        start = time.perf_counter()
+        scan_statistics(weather_data, *query)
+        print(f'Rollup {rollup_seconds * 1000:.2f}ms, scan of {len(weather_data)} rows '
+              f'{(time.perf_counter() - start) * 1000:.2f}ms')